@@ -7,37 +7,237 @@ James Jenkins 2025
 '''
 
 # Flask imports
-from flask import Flask, request, redirect, render_template
+from flask import Flask, Response, g, request, redirect, render_template, jsonify, session
 
 # Other imports
-from bitarray import bitarray
 from bitarray.util import ba2int
+from functools import lru_cache
+import html
+import json
+import os
+import secrets
+import threading
+import time
 from brisc_logging import init_log, log
 from common import *
-from simulator import processor # simulator
-from assembler import assemble, format_program_text # assembler
+from simulator import create_processor, dirty_tracker, _read16 # simulator
+from memory import allocated_bytes, memory_pages # sparse memory
+from history import history # reverse stepping
+from profiler import profiler # per-line execution counts
+from breakpoints import split_list, stop_conditions # breakpoints, watchpoints and conditions
+from jobs import run_job # background runs
+import metrics # /metrics and Server-Timing instrumentation
+from sessions import session_store # per-visitor state
+from assembler import assemble, format_program_text, incremental_assembler # assembler
+from brisc_object import pack_binary, read_data_image # packed programs and data images
 
 app = Flask(__name__)
-init_log("log/app.log")
+app.secret_key = os.environ.get("BRISC_SECRET_KEY") or secrets.token_bytes(32)
+init_log("log/app.log", level="INFO")
 
-ctx = {
-        "assembly_error": "",
-        "program_text": "",
-        "binary_string": "",
+# Simulator backend and backend options used for the run view, see simulator.BACKENDS. memory_size
+# goes up to 0x10000 bytes; memories larger than a page are sparse and only pages in use are shown
+SIMULATOR_BACKEND = "int"
+SIMULATOR_OPTIONS = {"jit": True, "memory_size": 256}
 
-        "formatted_text": "",
-        "formatted_binary": "",
+# Data memory image loaded on reset, an object file data section or a raw image (see brisc_object.py)
+DATA_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ref", "test_data.bo")
 
-        "formatted_registers": "",
-        "formatted_data_memory": "",
-        "formatted_text_memory": "",
+# Count executions per instruction and show them as a heat overlay on the run view's listing
+PROFILE_RUNS = False
 
-        "processor": None,
-}
+# Budget for "Step until halt?" runs, which go to a background job. A request waits up to
+# RUN_WAIT_SECONDS for the run to finish before rendering, and /run/progress streams the rest
+RUN_MAX_CYCLES = 10_000_000
+RUN_MAX_SECONDS = 30.0
+RUN_WAIT_SECONDS = 0.5
+PROGRESS_INTERVAL = 0.25
+
+# Session store limits. Each visitor gets their own processor, dropped after SESSION_IDLE_TIMEOUT
+# seconds without a request, or least recently used first beyond MAX_SESSIONS or SESSION_MAX_BYTES
+MAX_SESSIONS = 256
+SESSION_IDLE_TIMEOUT = 3600.0
+SESSION_MAX_BYTES = 256 * 1024 * 1024
+
+# Assembled programs are shared between sessions that load the same source
+PROGRAM_CACHE_SIZE = 128
+
+# Request metrics, served in the Prometheus text format on /metrics. With TIMING_HEADER every
+# response also gets a Server-Timing header giving its assemble, simulate and render time
+METRICS = True
+TIMING_HEADER = False
+
+class program_image:
+        '''Assembled program and its display listing, rendered once as a span per line so a render
+        only marks the lines at the PC and breakpoints. Shared between sessions, never modified.'''
+        __slots__ = ("binary_string", "text", "text_lines", "binary_lines", "symbols", "sources", "text_spans", "binary_spans")
+
+        def __init__(self, program_text):
+                self.symbols = {} # label -> byte address, for breakpoints
+                self.sources = {} # byte address -> (line, column) in program_text
+                with stats.timed("assemble", "brisc_assemble_duration_seconds", ("full",)):
+                        self.binary_string = assemble(program_text, symbols=self.symbols, sources=self.sources)
+                self.text = pack_binary(self.binary_string) # packed text memory image
+
+                formatted_text = format_program_text(program_text)
+                self.text_lines = tuple(formatted_text.strip().split("\n"))
+                self.binary_lines = tuple(pretty_print_16(self.binary_string[index * 16:index * 16 + 16]) if index * 16 < len(self.binary_string) else "" for index in range(len(self.text_lines)))
+
+                self.text_spans = tuple(self.span("text_line", index) for index in range(len(self.text_lines)))
+                self.binary_spans = tuple(self.span("binary_line", index) for index in range(len(self.text_lines)))
+
+        def span(self, prefix, index, classes=""):
+                '''Listing line index as a text_line or binary_line span, with its source line.'''
+                content = html.escape(self.text_lines[index]) if prefix == "text_line" else self.binary_lines[index]
+                location = self.sources.get(2 * index)
+                source = f" data-source=\"{location[0]}\" title=\"line {location[0]}\"" if location is not None else ""
+                class_attribute = f" class=\"{classes}\"" if classes else ""
+                return f"<span id=\"{prefix}{index}\"{class_attribute}{source}>{content}</span>"
+
+@lru_cache(maxsize=PROGRAM_CACHE_SIZE)
+def load_program(program_text):
+        '''Assembles program_text, reusing the image of an earlier identical program.'''
+        return program_image(program_text)
+
+def new_context():
+        '''Fresh per-session state.'''
+        return {
+                "assembly_error": "",
+                "program_text": "",
+                "binary_string": "",
+                "image": None,
+                "editor": None, # incremental_assembler behind /edit/assemble
+
+                "formatted_text": "",
+                "formatted_binary": "",
+
+                "formatted_registers": "",
+                "formatted_data_memory": "",
+                "formatted_text_memory": "",
+                "data_pages": "",
+
+                # Breakpoint, watch and stop condition fields of the run form, see breakpoints.py
+                "breakpoints": "",
+                "watch": "",
+                "conditions": "",
+                "stop_error": "",
+                "goto_warning": "", # why the last go to cycle stopped short
+
+                "processor": None,
+                "history": None,
+                "tracker": None,
+                "profiler": None,
+                "job": None,
+
+                # Held while the processor is stepped or read
+                "lock": threading.RLock(),
+        }
+
+def context_size(ctx):
+        '''Rough size in bytes of a session's state, for SESSION_MAX_BYTES.'''
+        size = 4096 + len(ctx["program_text"])
+
+        if ctx["processor"] is not None:
+                size += 2048 + 64 * len(getattr(ctx["processor"], "_decoded", ()))
+        if ctx["history"] is not None:
+                size += len(ctx["history"].checkpoints) * (allocated_bytes(ctx["processor"]._data) + 256) + len(ctx["history"].journal) * 256
+        if ctx["tracker"] is not None:
+                size += 64 * len(ctx["tracker"].changed_words)
+        if ctx["profiler"] is not None:
+                size += 5 * 4 * 0x10000
+        if getattr(ctx["processor"], "stops", None) is not None:
+                size += 2 * 0x10000
+        if ctx["editor"] is not None:
+                size += 256 * len(ctx["editor"].lines)
+
+        return size
+
+def close_context(ctx):
+        '''Stops a dropped session's background run.'''
+        if ctx["job"] is not None:
+                ctx["job"].cancel()
+
+sessions = session_store(new_context, MAX_SESSIONS, SESSION_IDLE_TIMEOUT, SESSION_MAX_BYTES, context_size, close_context)
+
+def session_gauges():
+        '''Open sessions, their estimated size in bytes and background runs in progress.'''
+        with sessions.lock:
+                contexts = [entry[1] for entry in sessions.sessions.values()]
+        return len(contexts), sum(context_size(ctx) for ctx in contexts), sum(1 for ctx in contexts if ctx["job"] is not None and ctx["job"].running)
+
+def simulator_speed():
+        '''Instructions per second over every simulation since the app started.'''
+        totals = stats.totals()
+        instructions = sum(slot[0] for (name, _), slot in totals.items() if name == "brisc_instructions_total")
+        seconds = sum(slot[0] for (name, _), slot in totals.items() if name == "brisc_simulate_seconds_total")
+        return instructions / seconds if seconds else 0.0
+
+stats = metrics.registry(enabled=METRICS)
+stats.histogram("brisc_request_duration_seconds", "Time to handle a request, until its response starts", labels=("route", "method"))
+stats.counter("brisc_requests_total", "Requests handled", labels=("route", "method", "status"))
+stats.histogram("brisc_assemble_duration_seconds", "Time to assemble a program, whole or as an editor patch", labels=("kind",))
+stats.histogram("brisc_simulate_duration_seconds", "Time simulating for a step action or background run", labels=("mode",))
+stats.histogram("brisc_render_duration_seconds", "Time to render a page template", labels=("template",))
+stats.histogram("brisc_request_instructions", "Instructions executed by a request's step actions", metrics.INSTRUCTION_BUCKETS, labels=("route",))
+stats.counter("brisc_instructions_total", "Instructions simulated", labels=("mode",))
+stats.counter("brisc_simulate_seconds_total", "Seconds spent simulating", labels=("mode",))
+stats.gauge("brisc_simulator_instructions_per_second", "Instructions per second over all simulation since start; rate() the totals for recent speed", simulator_speed)
+stats.gauge("brisc_sessions_active", "Open sessions", lambda: session_gauges()[0])
+stats.gauge("brisc_session_bytes", "Estimated memory held by open sessions", lambda: session_gauges()[1])
+stats.gauge("brisc_runs_active", "Background runs in progress", lambda: session_gauges()[2])
+stats.gauge("brisc_program_cache_programs", "Assembled programs cached", lambda: load_program.cache_info().currsize)
+stats.gauge("brisc_process_resident_bytes", "Resident memory of the app process", metrics.resident_bytes)
+
+@app.before_request
+def start_request_metrics():
+        if METRICS:
+                g.request_started = time.perf_counter()
+                g.instructions = 0
+                stats.begin_request()
+
+@app.after_request
+def finish_request_metrics(response):
+        '''Records the request's latency and instructions, and adds its Server-Timing header.'''
+        if not METRICS or "request_started" not in g:
+                return response
+
+        seconds = time.perf_counter() - g.request_started
+        phases = stats.end_request()
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched" # raw paths would be unbounded
+        stats.observe("brisc_request_duration_seconds", seconds, (route, request.method))
+        stats.add("brisc_requests_total", 1, (route, request.method, str(response.status_code)))
+        if "simulate" in phases:
+                stats.observe("brisc_request_instructions", g.instructions, (route,))
+
+        if TIMING_HEADER:
+                response.headers["Server-Timing"] = metrics.server_timing(phases, seconds)
+        return response
+
+def record_simulation(mode, instructions, seconds):
+        stats.add("brisc_instructions_total", instructions, (mode,))
+        stats.add("brisc_simulate_seconds_total", seconds, (mode,))
+
+def record_job(job):
+        '''run_job completion callback, recording the background run.'''
+        stats.observe("brisc_simulate_duration_seconds", job.elapsed, ("run",))
+        record_simulation("run", job.cycle - job.start_cycle, job.elapsed)
+
+@app.route("/metrics")
+def route_metrics():
+        '''Metrics in the Prometheus text exposition format.'''
+        if not METRICS:
+                return Response("Metrics are disabled\n", status=404, mimetype="text/plain")
+        return Response(stats.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+def session_context():
+        '''State for the requesting visitor's session.'''
+        if "id" not in session:
+                session["id"] = secrets.token_hex(16)
+        return sessions.get(session["id"])
 
 @app.context_processor
 def inject_context():
-    return dict(ctx=ctx) # pass ctx pieces to html
+    return dict(ctx=session_context()) # pass ctx pieces to html
 
 @app.route("/", methods=["GET", "POST"])
 def route_root():
@@ -45,12 +245,14 @@ def route_root():
 
 @app.route("/edit", methods=["GET", "POST"]) 
 def route_edit():
+        ctx = session_context()
         if request.method == "POST":
                 ctx["program_text"] = request.form["program_text"] # saves program to context for repeated assemblies
  
                 # Attempt assembly on program text
                 try:
-                        ctx["binary_string"] = assemble(ctx["program_text"]) # assemble
+                        ctx["image"] = load_program(ctx["program_text"]) # assemble, or reuse an identical program
+                        ctx["binary_string"] = ctx["image"].binary_string
                         return redirect("/run") # Go to run page
 
                 # If bad, set error value and reload route
@@ -58,76 +260,321 @@ def route_edit():
                         ctx["assembly_error"] = err
 
         # Render the document
-        return render_template("edit.html")
+        with stats.timed("render", "brisc_render_duration_seconds", ("edit.html",)):
+                return render_template("edit.html")
+
+@app.route("/edit/assemble", methods=["POST"])
+def route_edit_assemble():
+        '''Live assembly for the editor. Takes JSON with the whole program as text, or with edits as
+        a list of {start, end, lines} source line replacements, and returns the resulting
+        instruction patches (see incremental_assembler.edit) with words in hex, plus all errors.'''
+        ctx = session_context()
+        body = request.get_json(silent=True) or {}
+
+        with ctx["lock"], stats.timed("assemble", "brisc_assemble_duration_seconds", ("incremental",)):
+                if "text" in body:
+                        ctx["editor"] = incremental_assembler()
+                        patches = [ctx["editor"].set_text(body["text"])]
+                elif ctx["editor"] is None:
+                        return jsonify(error="No program loaded, send its text first"), 409
+                else:
+                        try:
+                                patches = [ctx["editor"].edit(int(edit["start"]), int(edit["end"]), list(edit["lines"])) for edit in body.get("edits", [])]
+                        except (KeyError, TypeError, ValueError) as err:
+                                return jsonify(error=f"Bad edit: {err}"), 400
+
+                editor = ctx["editor"]
+                return jsonify(
+                        patches=[{
+                                "start": patch["start"],
+                                "removed": patch["removed"],
+                                "words": [hex_word(word) for word in patch["words"]],
+                                "changed": {index: hex_word(word) for index, word in patch["changed"].items()},
+                        } for patch in patches],
+                        errors=[{"line": line_number, "message": message} for line_number, message in editor.errors()],
+                        lines=len(editor.lines),
+                        instructions=len(editor.instructions),
+                )
+
+def hex_word(word):
+        '''Hex string of a 16-bit binary string, or None.'''
+        return None if word is None else format(int(word, 2), "04X")
 
 @app.route("/run", methods=["GET", "POST"]) 
 def route_run():
+        ctx = session_context()
 
-        # Reset processor and text memory on GET (initial load from /edit or reset)
+        # Reset processor and text memory on GET (initial load from /edit or reset). The whole reset
+        # holds the lock, so /run/state and a finishing job never see a new processor with old state
         if request.method == "GET":
-                ctx["processor"] = processor() # initialize processor
-                text_mem = bitarray(256 * 8)
-                text_mem[0:len(ctx["binary_string"])] = bitarray(ctx["binary_string"])
-
-                ctx["processor"].text_memory = text_mem
-
-                # FIXME remove after test or add place to init data
-                data_mem = bitarray(256 * 8)
-                data_mem[0x0010 * 8:0x0010 * 8 + 16] = bitarray("0000_0001_0000_0001")
-                data_mem[0x0010 * 8 + 16:0x0010 * 8 + 32] = bitarray("0000_0001_0001_0000")
-                data_mem[0x0010 * 8 + 32:0x0010 * 8 + 48] = bitarray("0000_0000_0001_0001")
-                data_mem[0x0010 * 8 + 48:0x0010 * 8 + 64] = bitarray("0000_0000_1111_0000")
-                data_mem[0x0010 * 8 + 64:0x0010 * 8 + 80] = bitarray("0000_0000_1111_1111")
-                
-                ctx["processor"].data_memory = data_mem
-                # FIXME 
+                cancel_job(ctx)
+                with ctx["lock"]:
+                        ctx["job"] = None
+                        ctx["processor"] = create_processor(SIMULATOR_BACKEND, **SIMULATOR_OPTIONS) # initialize processor
+
+                        # Copy the packed program and the data image straight into processor memory
+                        if ctx["image"] is not None:
+                                ctx["processor"].load_text(ctx["image"].text)
+
+                        with read_data_image(DATA_IMAGE) as data_image:
+                                data_image.load_data(ctx["processor"])
+
+                        # Record history for stepping back and changes for /run/state, where the backend supports hooks
+                        supports_hooks = hasattr(ctx["processor"], "add_hook")
+                        ctx["history"] = history(ctx["processor"]) if supports_hooks else None
+                        ctx["tracker"] = dirty_tracker(ctx["processor"]) if supports_hooks else None
+                        ctx["profiler"] = profiler(ctx["processor"]) if supports_hooks and PROFILE_RUNS else None
+                        apply_stops(ctx)
         
-        # On POST, step or step repeatedly
+        # On POST, step, step repeatedly, step back or go to a cycle
         if request.method == "POST":
-                print(processor)
-                if "continue_run" in request.form:
-                        ctx["processor"].start()
-                else:
-                        ctx["processor"].step()
+                run_action(ctx, request.form)
 
-        # Format program text and binary for display. This is horrifically inefficient and should instead be assigning the class to the appropriate instruction
-        formatted_text = format_program_text(ctx["program_text"])
+        with ctx["lock"]:
+                return render_run(ctx)
 
-        # Clear formatted buffers. Needs to be done every reload.
-        ctx["formatted_text"] = ""
-        ctx["formatted_binary"] = ""
+def render_run(ctx):
+        '''Renders the run page for the current processor state.'''
+        # Program text and binary lines come prerendered from the shared program image. Only the
+        # lines at the PC and breakpoints are rendered again, found by PC; the heat overlay is
+        # applied by the page
+        image = ctx["image"] if ctx["image"] is not None else load_program(ctx["program_text"])
+        text_spans = list(image.text_spans)
+        binary_spans = list(image.binary_spans)
 
-        # Loop over program lines
-        for index, line in enumerate(formatted_text.strip().split("\n")):
-                # Check if PC matches instruction index and add highlight class if so
-                highlight_class = " class=\"highlight\"" if ba2int(ctx["processor"].pc) / 2 == index else ""
-                ctx["formatted_text"] += f"<span{highlight_class}>{line}</span>" # format instruction as span
+        marks = {pc: ["breakpoint"] for pc in stop_pcs(ctx)}
+        marks.setdefault(ba2int(ctx["processor"].pc), []).insert(0, "highlight")
+        for pc, classes in marks.items():
+                if pc % 2 == 0 and pc // 2 < len(text_spans):
+                        text_spans[pc // 2] = image.span("text_line", pc // 2, " ".join(classes))
+                        binary_spans[pc // 2] = image.span("binary_line", pc // 2, " ".join(classes))
 
-                # Extract binary instruction, convert to hex, and pretty print
-                instruction = ctx["binary_string"][index * 16:index * 16 + 16] 
-                hex_string = format(int(instruction, 2), f"04x").upper()
-                binary_line = f"0x{hex_string}: {insert_every(instruction, " ", 4)}\n"
-
-                ctx["formatted_binary"] += f"<span{highlight_class}>{pretty_print_16(instruction)}</span>"
+        ctx["formatted_text"] = "".join(text_spans)
+        ctx["formatted_binary"] = "".join(binary_spans)
 
         # Format registers and memory for display. This does need to be done per-cycle unlike the above
         ctx["formatted_registers"] = "<table>"
 
         for register_number, register_value in enumerate(ctx["processor"].register_file):
-                ctx["formatted_registers"] += f"<tr><th>$r{register_number}</th><td>{pretty_print_16(register_value)}</td></tr>"
+                ctx["formatted_registers"] += f"<tr><th>$r{register_number}</th><td id=\"register{register_number}\">{pretty_print_16(register_value)}</td></tr>"
                 
         ctx["formatted_registers"] += "</table>"
 
         #ctx["formatted_registers"] = format_registers_report(ctx["processor"].register_file)
 
-        ctx["formatted_data_memory"] = format_memory(ctx["processor"].data_memory, 4)
+        ctx["formatted_data_memory"] = format_memory(raw_memory(ctx["processor"], "data"), 4, id_prefix="data")
         #ctx["formatted_data_memory"] = format_memory_report(ctx["processor"].data_memory)
 
-        ctx["formatted_text_memory"] = format_memory(ctx["processor"].text_memory, 4)
+        ctx["formatted_text_memory"] = format_memory(raw_memory(ctx["processor"], "text"), 4)
         #ctx["formatted_text_memory"] = format_memory_report(ctx["processor"].text_memory)
+        ctx["data_pages"] = data_pages(ctx["processor"]) if ctx["tracker"] is not None else ""
         
         # Render the document
-        return render_template("run.html")
+        with stats.timed("render", "brisc_render_duration_seconds", ("run.html",)):
+                return render_template("run.html", heat=line_heat(ctx))
+
+def line_heat(ctx):
+        '''Executions of each program listing line, or None when runs are not profiled.'''
+        if ctx["profiler"] is None:
+                return None
+
+        image = ctx["image"] if ctx["image"] is not None else load_program(ctx["program_text"])
+        return ctx["profiler"].line_counts(len(image.text_lines))
+
+def stop_pcs(ctx):
+        '''Breakpoint PCs of the session's processor.'''
+        stops = getattr(ctx["processor"], "stops", None)
+        return stops.pcs if stops is not None else set()
+
+def apply_stops(ctx):
+        '''Gives the processor the breakpoints, watchpoints and conditions in the session's run form
+        fields, with labels resolved against the program. Bad fields leave it without any.'''
+        proc = ctx["processor"]
+        ctx["stop_error"] = ""
+        if not hasattr(proc, "stops"):
+                return
+
+        symbols = ctx["image"].symbols if ctx["image"] is not None else {}
+        try:
+                stops = stop_conditions(split_list(ctx["breakpoints"]), split_list(ctx["watch"]), split_list(ctx["conditions"]), symbols)
+        except ValueError as err:
+                ctx["stop_error"] = str(err)
+                stops = None
+
+        proc.stops = None if stops is None or stops.empty else stops
+
+def update_stops(ctx, form):
+        '''Applies the run form's breakpoint, watch and condition fields if they changed.'''
+        fields = {name: form.get(name, ctx[name]).strip() for name in ("breakpoints", "watch", "conditions")}
+        if any(ctx[name] != value for name, value in fields.items()):
+                ctx.update(fields)
+                apply_stops(ctx)
+
+def raw_memory(proc, name):
+        '''A processor's "data" or "text" memory, as the backend holds it where that avoids building a bitarray.'''
+        memory = getattr(proc, f"_{name}", None)
+        return memory if memory is not None else getattr(proc, f"{name}_memory")
+
+def data_pages(proc):
+        '''Comma separated base addresses of the data memory pages shown on the run page.'''
+        return ",".join(str(base) for base, _ in memory_pages(proc._data))
+
+def run_action(ctx, form):
+        '''Performs the step, step until halt, step back or go to cycle action requested by a /run form.
+        Step until halt starts a background run_job, which also stops at the form's breakpoints,
+        watchpoints and conditions. Nothing else runs while it is in progress.'''
+        with ctx["lock"]:
+                if ctx["job"] is not None and ctx["job"].running:
+                        log("Ignoring run action during a background run", level="WARNING")
+                        return
+
+                update_stops(ctx, form)
+                ctx["goto_warning"] = ""
+                if "continue_run" in form:
+                        detach_recorders(ctx)
+                        ctx["job"] = run_job(ctx["processor"], RUN_MAX_CYCLES, RUN_MAX_SECONDS, lock=ctx["lock"], on_done=lambda job: finish_run(ctx, job))
+                else:
+                        cycle = ctx["processor"].cycle
+                        with stats.timed("simulate") as timer:
+                                step_action(ctx, form)
+                        if METRICS:
+                                instructions = max(ctx["processor"].cycle - cycle, 0)
+                                g.instructions += instructions
+                                stats.observe("brisc_simulate_duration_seconds", timer.seconds, ("step",))
+                                record_simulation("step", instructions, timer.seconds)
+
+        # Give short runs the chance to finish so their final state is rendered straight away
+        if "continue_run" in form:
+                ctx["job"].wait(RUN_WAIT_SECONDS)
+
+def detach_recorders(ctx):
+        '''Detaches the history and change tracker before a background run, so the processor can
+        take its fast path (the JIT or decode cache) instead of stepping with hooks. History gets a
+        checkpoint to replay the run from. A profiler, when PROFILE_RUNS is set, stays attached.'''
+        if ctx["history"] is not None:
+                ctx["history"].record()
+                ctx["history"].detach()
+        if ctx["tracker"] is not None:
+                ctx["processor"].remove_hook(ctx["tracker"])
+
+def finish_run(ctx, job):
+        '''run_job completion callback: reattaches what detach_recorders() removed, checkpointing the
+        state the run ended in and marking all of it changed, and records the run's metrics.'''
+        with ctx["lock"]:
+                if ctx["history"] is not None:
+                        ctx["history"].record()
+                        ctx["history"].attach()
+                if ctx["tracker"] is not None:
+                        ctx["processor"].add_hook(ctx["tracker"])
+                        ctx["tracker"].mark_all()
+
+        if METRICS:
+                record_job(job)
+
+def step_action(ctx, form):
+        '''Performs a step, step back or go to cycle action.'''
+        if "step_back" in form and ctx["history"] is not None:
+                ctx["history"].step_back()
+                ctx["tracker"].mark_all()
+        elif "goto" in form and ctx["history"] is not None:
+                # Going forward is held to a background run's budgets, as it runs in the request
+                proc = ctx["processor"]
+                try:
+                        cycle = int(form["goto_cycle"])
+                        if cycle > proc.cycle + RUN_MAX_CYCLES:
+                                cycle = proc.cycle + RUN_MAX_CYCLES
+                                ctx["goto_warning"] = f"Went forward at most {RUN_MAX_CYCLES} cycles"
+                        if not ctx["history"].goto(cycle, RUN_MAX_SECONDS):
+                                ctx["goto_warning"] = f"Stopped at cycle {proc.cycle} after {RUN_MAX_SECONDS:g} seconds"
+                        ctx["tracker"].mark_all()
+                except ValueError as err:
+                        log(f"Bad go to cycle request: {err}", level="WARNING")
+        else:
+                ctx["processor"].step()
+
+@app.route("/run/state", methods=["GET", "POST"])
+def route_run_state():
+        '''JSON view of what changed since the client's last known version, optionally after a /run action.
+        The run page applies these as patches instead of reloading.'''
+        ctx = session_context()
+        if ctx["tracker"] is None:
+                return jsonify(error="No processor state tracking for this backend"), 409
+
+        if request.method == "POST":
+                run_action(ctx, request.form)
+
+        with ctx["lock"]:
+                return jsonify(run_state(ctx))
+
+def run_state(ctx):
+        '''Changes since the request's since version, plus the background run's progress.'''
+        proc = ctx["processor"]
+        tracker = ctx["tracker"]
+
+        try:
+                since = int(request.values.get("since", -1))
+        except ValueError:
+                since = -1
+
+        full, registers, words = tracker.changes_since(since)
+        if full:
+                words = [base + offset for base, page in memory_pages(proc._data) for offset in range(0, len(page), 2)]
+
+        # Pages allocated since the client rendered its data memory table have no cells to patch, so
+        # the table is resent whenever the set of pages differs from the one the client reports
+        pages = data_pages(proc)
+        data_memory = None
+        if request.values.get("pages", pages) != pages:
+                data_memory = format_memory(proc._data, 4, id_prefix="data")
+
+        return dict(
+                version=tracker.version,
+                full=full,
+                cycle=proc.cycle,
+                pc=proc._pc,
+                nzp=proc._nzp,
+                run=proc.run,
+                registers={i: pretty_print_16(int_to_bits(proc._regs[i], 16)) for i in registers},
+                memory={word: format_memory_word(_read16(proc._data, word)) for word in words},
+                pages=pages,
+                data_memory=data_memory,
+                heat=line_heat(ctx),
+                breakpoints=sorted(stop_pcs(ctx)),
+                stop_error=ctx["stop_error"],
+                goto_warning=ctx["goto_warning"],
+                job=ctx["job"].progress() if ctx["job"] is not None else None,
+        )
+
+def cancel_job(ctx):
+        '''Cancels the background run, if any, and waits for it to stop.'''
+        job = ctx["job"]
+        if job is not None:
+                job.cancel()
+                job.wait()
+
+@app.route("/run/progress")
+def route_run_progress():
+        '''Server-Sent Events stream of the background run's progress, ending with a done event.'''
+        job = session_context()["job"]
+
+        def stream():
+                if job is None:
+                        yield "event: done\ndata: null\n\n"
+                        return
+
+                while not job.wait(PROGRESS_INTERVAL):
+                        yield f"data: {json.dumps(job.progress())}\n\n"
+
+                yield f"event: done\ndata: {json.dumps(job.progress())}\n\n"
+
+        return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.route("/run/cancel", methods=["POST"])
+def route_run_cancel():
+        '''Cancels the background run and returns its final progress.'''
+        ctx = session_context()
+        cancel_job(ctx)
+        return jsonify(job=ctx["job"].progress() if ctx["job"] is not None else None)
 
 def main():
         app.run(host="0.0.0.0", debug=True, port=1234)
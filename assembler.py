@@ -6,9 +6,10 @@ BRISC assembler code
 James Jenkins 2025
 '''
 
-from brisc_logging import log
+from brisc_logging import log, log_enabled
 from common import int_to_bits
 
+from functools import lru_cache
 import re
 
 opcode_mnemonic_lut = [
@@ -64,10 +65,27 @@ br_register_lut = [
         [0b111, r"brnzp"]
 ]
 
+# Exact-match indexes of the tables above. Mnemonics missing from these fall back to the regex
+# tables, which match prefixes, so unusual spellings assemble exactly as they always have
+opcode_mnemonic_index = {}
+for row in opcode_mnemonic_lut:
+        for mnemonic in row[2].split("|"):
+                if "?" not in mnemonic:
+                        opcode_mnemonic_index[mnemonic] = (int_to_bits(row[0], 4), row[1])
+for _, mnemonic in br_register_lut:
+        opcode_mnemonic_index[mnemonic] = (int_to_bits(0b0000, 4), "I")
+opcode_mnemonic_lut = [[row[0], row[1], re.compile(row[2])] for row in opcode_mnemonic_lut]
+
+func_mnemonic_index = {mnemonic: int_to_bits(func, 3) for func, mnemonic in func_mnemonic_lut}
+func_mnemonic_lut = [[row[0], re.compile(row[1])] for row in func_mnemonic_lut]
+
+REGISTER_PATTERN = re.compile(r"\$r(\d+)")
+BINARY_PATTERN = re.compile(r"[0-1]+")
+
 def format_program_text(text):
         ''' Formats program text to easily-parseable lines, and removes comments and whitespace'''
         text_lines = text.split("\n")
-        trimmed_text = ""
+        trimmed_text = []
         
         for line in text_lines:
                 line = line.split("#")[0] # Remove all text after a '#'
@@ -76,55 +94,112 @@ def format_program_text(text):
                 if line != "":
                         # If the line is labeled, prepend the next line with it. Otherwise, add the line to the text.
                         if line.endswith(":"):
-                                trimmed_text += line + " "
+                                trimmed_text.append(line + " ")
                         else:
-                                trimmed_text += line + "\n"
+                                trimmed_text.append(line + "\n")
                 
-        return trimmed_text[:-1] # Return the trimmed text without the trailing newline
+        return "".join(trimmed_text)[:-1] # Return the trimmed text without the trailing newline
+
+def source_locations(text):
+        '''(line, column) in text, counting from 1, of each line format_program_text() makes of it:
+        where its instruction starts, after any label.'''
+        locations = []
+        label_line = None
+
+        for line_number, line in enumerate(text.split("\n"), 1):
+                code = line.split("#")[0]
+                fields = code.split()
+                if not fields:
+                        continue
+
+                # Label-only lines are folded into the next line, as format_program_text() does
+                if code.strip().endswith(":"):
+                        label_line = label_line or (line_number, len(code) - len(code.lstrip()) + 1)
+                        continue
+
+                start = code.index(fields[0])
+                if fields[0].endswith(":") and len(fields) > 1:
+                        start = code.index(fields[1], start + len(fields[0]))
+                locations.append((line_number, start + 1))
+                label_line = None
+
+        # A label at the very end is left on a line of its own
+        if label_line is not None:
+                locations.append(label_line)
 
-def first_pass_translate(text):
-        '''Fills a translation table with an array of binary fields and labels'''
+        return locations
+
+def numbered_listing(text):
+        '''Lines of format_program_text(text), each prefixed with the source line it came from.'''
+        lines = format_program_text(text).split("\n")
+        return [f"{line:>4}: {formatted}" for (line, _), formatted in zip(source_locations(text), lines)]
+
+class assembly_error(ValueError):
+        '''A program line that cannot be assembled.'''
+
+def first_pass_translate(text, source=None):
+        '''Fills a translation table with an array of binary fields and labels. source is the program
+        text that text was formatted from, if known, so errors can give its line.'''
 
         text_lines = text.split("\n")
         translation_table = []
-        label_lut = []
+        label_lut = {} # label name -> line number, later definitions win
 
         # First translate pass, determine instruction type, opcode, operands
         for line_number, text_line in enumerate(text_lines):
-                line_fields = text_line.split() # Break line into fields
-                line_translation = []
-                instruction_type = ""
-                
-                # Check for a label, append the line number and name to the label lut, and prune it.
-                if line_fields[0].endswith(":"):
-                        label_lut.append([line_number, line_fields[0][:-1]])
-                        line_fields = line_fields[1:]
+                try:
+                        label, line_translation = translate_line(text_line)
+                except assembly_error as err:
+                        log(f"{_source_line(source, line_number)}{err}", level="ERROR")
+                        exit(1)
+
+                if label is not None:
+                        label_lut[label] = line_number
+
+                translation_table.append(line_translation)
 
-                # Match the mnemonic to an instruction in the LUT
+        return translation_table, label_lut
+
+def translate_line(text_line):
+        '''Translates one formatted program line into its label, or None, and its translation row.
+        Branch and jump rows end with their target label until linked.'''
+        line_fields = text_line.split() # Break line into fields
+        line_translation = []
+        instruction_type = ""
+        label = None
+
+        # Check for a label, keep its name and prune it.
+        if line_fields[0].endswith(":"):
+                label = line_fields[0][:-1]
+                line_fields = line_fields[1:]
+
+        # Match the mnemonic to an instruction, by exact lookup or else through the LUT
+        opcode = opcode_mnemonic_index.get(line_fields[0])
+        if opcode is not None:
+                line_translation.append(opcode[0]) # Append the opcode to the translation
+                instruction_type = opcode[1]
+        else:
                 for index, row in enumerate(opcode_mnemonic_lut):
-                        if re.match(row[2], line_fields[0]):
+                        if row[2].match(line_fields[0]):
                                 line_translation.append(int_to_bits(row[0], 4)) # Append the opcode to the translation
                                 instruction_type = row[1]
                                 break
 
-                # Handle rest of the fields according to instruction type
-                match instruction_type:
-                        case "R":
-                                translate_r_type(line_fields, line_translation)
-
-                        case "I":
-                                translate_i_type(line_fields, line_translation)
+        # Handle rest of the fields according to instruction type
+        match instruction_type:
+                case "R":
+                        translate_r_type(line_fields, line_translation)
 
-                        case "J":
-                                translate_j_type(line_fields, line_translation)
+                case "I":
+                        translate_i_type(line_fields, line_translation)
 
-                        case _:
-                                log(f"Error determining instruction type of {text_line}")
-                                exit(1)
+                case "J":
+                        translate_j_type(line_fields, line_translation)
 
-                translation_table.append(line_translation)
+                case _:
+                        raise assembly_error(f"Error determining instruction type of {text_line}")
 
-        return translation_table, label_lut
+        return label, line_translation
 
 # Main instruction parsers, get passed the unfinished translation row and complete it (minus labels)
 def translate_r_type(line_fields, line_translation):
@@ -132,15 +207,20 @@ def translate_r_type(line_fields, line_translation):
         count = 0
         for field in line_fields[1:]:
                 # For each field, check for a register id and append the bit string to the translation
-                line_translation.append(int_to_bits(int(re.match(r"\$r(\d+)", field).group(1)), 3))
+                line_translation.append(int_to_bits(int(REGISTER_PATTERN.match(field).group(1)), 3))
                 count += 1
 
         for i in range(3 - count):
                 line_translation.append("000")
         
         # Find the Func field mapping for the mnemonic
+        func = func_mnemonic_index.get(line_fields[0])
+        if func is not None:
+                line_translation.append(func)
+                return
+
         for mapping in func_mnemonic_lut:
-                if re.match(mapping[1], line_fields[0]):
+                if mapping[1].match(line_fields[0]):
                         line_translation.append(int_to_bits(mapping[0], 3))
 
 def translate_i_type(line_fields, line_translation):
@@ -156,7 +236,7 @@ def translate_i_type(line_fields, line_translation):
                 line_translation.append(int_to_bits(rs, 3))
                 line_translation.append(line_fields[1])
         else:
-                line_translation.append(int_to_bits(int(re.match(r"\$r(\d+)", line_fields[1]).group(1)), 3))
+                line_translation.append(int_to_bits(int(REGISTER_PATTERN.match(line_fields[1]).group(1)), 3))
                 line_translation.append(int_to_bits(int(line_fields[2], 0), 9))
 
 def translate_j_type(line_fields, line_translation):
@@ -167,52 +247,629 @@ def link_labels(table, label_lut):
         
         for line_number, translation in enumerate(table):
                 # If the last value is not binary, it's a label.
-                # NOTE: don't look at this. I am sorry
-                if not re.match(r"[0-1]+", translation[-1]):
-                        target_line = 0
-                        for label_mapping in label_lut:
-                                if label_mapping[1] == translation[-1]:
-                                        target_line = label_mapping[0]
-                        if len(translation) == 3:
-                                translation[-1] = int_to_bits(2 * (target_line - (line_number + 1)), 9)
-                        else:
-                                translation[-1] = int_to_bits(2 * (target_line - (line_number + 1)), 12)
-
-def merge_and_check_binary(table):
-        binary = ""
+                if not BINARY_PATTERN.match(translation[-1]):
+                        target_line = label_lut.get(translation[-1], 0) # unknown labels link to line 0
+                        translation[-1] = link_field(translation, line_number, target_line)
+
+def link_field(translation, line_number, target_line):
+        '''PC offset field from line_number to target_line, 9 bits for a branch row and 12 for a jump.'''
+        return int_to_bits(2 * (target_line - (line_number + 1)), 9 if len(translation) == 3 else 12)
+
+def _source_line(source, line_number):
+        '''"Line N: " prefix for messages about formatted line line_number of source, if known.'''
+        locations = source_locations(source) if source is not None else ()
+        if line_number >= len(locations):
+                return ""
+        return f"Line {locations[line_number][0]}: "
+
+def merge_and_check_binary(table, source=None, origins=None):
+        '''Joins the table rows into a binary string. origins maps each row to its formatted line, where
+        optimize_table() has removed rows.'''
+        binary = []
         for line_number, line in enumerate(table):
                 instruction = "".join(line)
                 if len(instruction) != 16:
-                        log(f"ERROR: problem assembling instruction #{line_number + 1}")
+                        origin = line_number if origins is None else origins[line_number]
+                        log(f"ERROR: {_source_line(source, origin)}problem assembling instruction #{origin + 1}", level="ERROR")
                         exit(1)
                 else:
-                        binary += instruction
-        return binary
-
-def assemble(program_text):
-        log(f"Assembly started with program text:\n{program_text}")
+                        binary.append(instruction)
+        return "".join(binary)
+
+# Peephole optimization, run between the first pass and linking. Rewrites never change what a
+# program computes, only how many instructions it takes, assuming it does not read or write its
+# own text:
+#   fold        ldi followed by addi/subi/sl/srl/sra of the same register, to one ldi
+#   dead_flags  move $rX $rX and ALU ops by 0, which only set NZP, where NZP is overwritten
+#               before any branch reads it
+#   thread      branches and jumps to a jmp, retargeted to where the jmp goes
+#   dead_jump   branches and jumps to the next instruction, and branches that never branch
+# ldi does not set NZP, so a fold whose flags are read ends with a move $rX $rX to set them.
+# lpc, save, rest and literal offsets depend on where instructions are, so no instruction before
+# the last of them is removed.
+_FOLDS = {
+        "0011": lambda value, imm: value + imm,
+        "0100": lambda value, imm: value - imm,
+        "0111": lambda value, imm: value << imm,
+        "1000": lambda value, imm: value >> imm,
+        "1001": lambda value, imm: _signed16(value) >> imm,
+}
+_SHIFTS = ("0111", "1000", "1001")
+_FOLD_MNEMONICS = {"0011": "addi", "0100": "subi", "0111": "sl", "1000": "srl", "1001": "sra"}
+
+# Reachable offsets, in bytes, of a branch and a jump
+_BRANCH_REACH = (-256, 254)
+_JUMP_REACH = (-2048, 2046)
+
+def _signed16(value):
+        return value - 0x10000 if value & 0x8000 else value
+
+def _field_value(bits):
+        '''Two's complement value of a bit string field.'''
+        value = int(bits, 2)
+        return value - (1 << len(bits)) if bits[0] == "1" else value
+
+class _peephole_line:
+        '''One instruction being optimized: its labels, translation row, source text without the
+        label and the formatted line it came from.'''
+        __slots__ = ("labels", "row", "text", "origin")
+
+        def __init__(self, labels, row, text, origin):
+                self.labels = labels
+                self.row = row
+                self.text = text
+                self.origin = origin
+
+        @property
+        def source(self):
+                return "".join(f"{label}: " for label in self.labels) + self.text
+
+        @property
+        def targets_label(self):
+                '''Whether the row is a branch or jump still naming its target label.'''
+                return self.row[0] in ("0000", "1111") and not BINARY_PATTERN.match(self.row[-1])
+
+        def sets_nzp(self):
+                return "0001" <= self.row[0] <= "1001" or (self.row[0] == "1010" and self.row[-1] == "000")
+
+        def reads_nzp(self):
+                return self.row[0] == "0000" and self.row[1] != "000"
+
+        def only_sets_nzp(self):
+                '''Whether the instruction leaves every register as it was and only sets NZP.'''
+                row = self.row
+                if row[0] == "1010":
+                        return row[-1] == "000" and row[1] == row[2]
+                return row[0] in _FOLDS and _field_value(row[2]) == 0
+
+def _peephole_target(lines, index, label_index):
+        '''Index of the instruction lines[index] branches or jumps to, None if it is not a branch or
+        jump and len(lines) if it leaves the program.'''
+        row = lines[index].row
+        if row[0] not in ("0000", "1111"):
+                return None
+        if lines[index].targets_label:
+                return label_index.get(row[-1], 0) # unknown labels link to line 0
+        target = index + 1 + _field_value(row[-1]) // 2
+        return target if 0 <= target < len(lines) else len(lines)
+
+def _peephole_successors(lines, index, label_index):
+        row = lines[index].row
+        end = len(lines)
+        if row[0] == "0000":
+                if row[1] == "000":
+                        return (index + 1,)
+                return (index + 1, _peephole_target(lines, index, label_index))
+        if row[0] == "1111":
+                return (_peephole_target(lines, index, label_index),)
+        if row[0] == "1010" and row[-1] == "110": # rst
+                return (0,)
+        if row[0] == "1010" and row[-1] == "111": # hlt
+                return ()
+        return (min(index + 1, end),)
+
+def _nzp_live_out(lines, label_index):
+        '''For each instruction, whether a branch may read the NZP it leaves before it is set again.
+        Running off the end of the program counts as reading it.'''
+        end = len(lines)
+        successors = [_peephole_successors(lines, index, label_index) for index in range(end)]
+        live_in = [False] * (end + 1)
+        live_in[end] = True
+        live_out = [False] * end
+
+        changed = True
+        while changed:
+                changed = False
+                for index in range(end - 1, -1, -1):
+                        out = any(live_in[successor] for successor in successors[index])
+                        live_out[index] = out
+                        line = lines[index]
+                        value = line.reads_nzp() or (out and not line.sets_nzp())
+                        if value != live_in[index]:
+                                live_in[index] = value
+                                changed = True
+
+        return live_out
+
+def _layout_fixed_until(lines, label_index):
+        '''Index of the last instruction whose behaviour depends on where instructions are, or -1.'''
+        fixed = -1
+        for index, line in enumerate(lines):
+                row = line.row
+                if (row[0] == "1010" and row[-1] == "100") or row[0] in ("1101", "1110"):
+                        fixed = max(fixed, index)
+                        if row[0] != "1010" and not BINARY_PATTERN.match(row[-1]):
+                                fixed = max(fixed, label_index.get(row[-1], 0))
+                elif row[0] in ("0000", "1111") and not line.targets_label:
+                        fixed = max(fixed, index, min(_peephole_target(lines, index, label_index), len(lines) - 1))
+        return fixed
+
+def _fold_chain(lines, index, fixed):
+        '''(end, value) of the ldi at index followed by the foldable instructions up to end, with
+        the value they leave in its register, or None.'''
+        row = lines[index].row
+        if row[0] != "1100":
+                return None
+
+        register = row[1]
+        value = _field_value(row[2]) & 0xFFFF
+        end = index + 1
+        while end < len(lines) and end > fixed:
+                line = lines[end]
+                if line.labels or line.row[0] not in _FOLDS or line.row[1] != register:
+                        break
+                imm = _field_value(line.row[2])
+                if line.row[0] in _SHIFTS and not 0 <= imm < 16:
+                        break
+                value = _FOLDS[line.row[0]](value, imm) & 0xFFFF
+                end += 1
+
+        return (end, value) if end - index >= 2 else None
+
+def _peephole_pass(lines, report):
+        '''One pass of every rewrite over lines. Returns the optimized lines and whether anything changed.'''
+        label_index = {label: index for index, line in enumerate(lines) for label in line.labels}
+        live_out = _nzp_live_out(lines, label_index)
+        fixed = _layout_fixed_until(lines, label_index)
+        optimized = []
+        carried = [] # labels of removed instructions, for the instruction after them
+        changed = False
+
+        def remove(index, kind):
+                line = lines[index]
+                carried.extend(line.labels)
+                report["removed"].append(line.origin)
+                report["rewrites"].append((kind, line.origin, line.text, ""))
+
+        index = 0
+        while index < len(lines):
+                line = lines[index]
+                removable = fixed < index < len(lines) - 1
+
+                # Threading only changes offsets, so it is allowed anywhere an offset still reaches
+                target = _peephole_target(lines, index, label_index)
+                if line.targets_label and line.row[:2] != ["0000", "000"]:
+                        skipped, seen = [], {index}
+                        final_label, final = line.row[-1], target
+                        while final < len(lines) and final not in seen and lines[final].row[0] == "1111" and lines[final].targets_label and lines[final].row[-1] in label_index:
+                                seen.add(final)
+                                skipped.append(lines[final].origin)
+                                final_label = lines[final].row[-1]
+                                final = label_index[final_label]
+                        low, high = _BRANCH_REACH if line.row[0] == "0000" else _JUMP_REACH
+                        if final != target and low <= 2 * (final - (index + 1)) <= high:
+                                before = line.text
+                                line.row = line.row[:-1] + [final_label]
+                                line.text = line.text.rsplit(None, 1)[0] + " " + final_label
+                                report["threaded"].setdefault(line.origin, []).extend(skipped)
+                                report["rewrites"].append(("thread", line.origin, before, line.text))
+                                target = final
+                                changed = True
+
+                if removable and line.row[0] in ("0000", "1111") and (target == index + 1 or line.row[:2] == ["0000", "000"]):
+                        remove(index, "dead_jump")
+                        changed = True
+                        index += 1
+                        continue
+
+                if removable and line.only_sets_nzp() and not live_out[index]:
+                        remove(index, "dead_flags")
+                        changed = True
+                        index += 1
+                        continue
+
+                chain = _fold_chain(lines, index, fixed)
+                if chain is not None:
+                        end, value = chain
+                        signed = _signed16(value)
+                        needs_flags = live_out[end - 1]
+                        if -256 <= signed <= 255 and end - index > 1 + needs_flags:
+                                register = line.row[1]
+                                folded = [_peephole_line(carried + line.labels, ["1100", register, int_to_bits(signed, 9)], f"ldi $r{int(register, 2)} {signed}", line.origin)]
+                                if needs_flags:
+                                        folded.append(_peephole_line([], ["1010", register, register, "000", "000"], f"move $r{int(register, 2)} $r{int(register, 2)}", line.origin))
+                                carried = []
+                                before = "; ".join(lines[i].text for i in range(index, end))
+                                report["rewrites"].append(("fold", line.origin, before, "; ".join(f.text for f in folded)))
+                                report["removed"].extend(lines[i].origin for i in range(index + len(folded), end))
+                                optimized.extend(folded)
+                                changed = True
+                                index = end
+                                continue
+
+                line.labels = carried + line.labels
+                carried = []
+                optimized.append(line)
+                index += 1
+
+        return optimized, changed
+
+def optimize_table(translation_table, label_lut, asm_lines):
+        '''Peephole optimizes a first pass translation table before link_labels(). asm_lines are the
+        formatted program lines the table was translated from. Returns the optimized table, label
+        LUT and lines, and a report: instruction counts before and after, each rewrite as (kind,
+        original line number, text before, text after), the original lines removed, by original
+        line number the original lines of the jumps each threaded branch skips, and the original
+        line of each optimized instruction.'''
+        lines = []
+        labels_by_line = {}
+        for label, line_number in label_lut.items():
+                labels_by_line.setdefault(line_number, []).append(label)
+
+        for line_number, (row, text) in enumerate(zip(translation_table, asm_lines)):
+                if text.split(None, 1)[0].endswith(":"):
+                        text = text.split(None, 1)[1]
+                lines.append(_peephole_line(labels_by_line.get(line_number, []), list(row), text, line_number))
+
+        report = {"before": len(lines), "after": len(lines), "rewrites": [], "removed": [], "threaded": {}, "origins": []}
+
+        # Each pass can expose more rewrites, e.g. a thread leaving a jump to the next line
+        changed = True
+        while changed:
+                lines, changed = _peephole_pass(lines, report)
+
+        report["after"] = len(lines)
+        report["origins"] = [line.origin for line in lines]
+        label_lut = {label: index for index, line in enumerate(lines) for label in line.labels}
+        return [line.row for line in lines], label_lut, [line.source for line in lines], report
+
+def assemble(program_text, translation_file="ref/translation.txt", symbols=None, optimize=False, report=None, sources=None):
+        '''Assembles program text to a binary string. If symbols is a dict, each label is added to it
+        with its byte address, and if sources is a dict, each instruction's byte address is added to
+        it with its (line, column) in program_text, see source_locations(). optimize runs
+        optimize_table() on the program, and its report is added to report if that is a dict.'''
+        # Program text and table dumps are only built when DEBUG logging is on
+        debug = log_enabled("DEBUG")
+
+        if debug:
+                log(f"Assembly started with program text:\n{program_text}", level="DEBUG")
+        else:
+                log("Assembly started")
 
         formatted_text = format_program_text(program_text)
-        log(f"Program text formatted. Result:\n{formatted_text}")
-
-        translation_table, label_lut = first_pass_translate(formatted_text)
-        log(f"Translation first pass complete. First pass translation table:\n{translation_table}")
-        log(f"Label LUT:\n{label_lut}")
+        if debug:
+                log(f"Program text formatted. Result:\n{formatted_text}", level="DEBUG")
+
+        translation_table, label_lut = first_pass_translate(formatted_text, program_text)
+        if debug:
+                log(f"Translation first pass complete. First pass translation table:\n{translation_table}", level="DEBUG")
+                log(f"Label LUT:\n{label_lut}", level="DEBUG")
+
+        asm_lines = formatted_text.split("\n")
+        origins = range(len(asm_lines))
+        if optimize:
+                translation_table, label_lut, asm_lines, optimization = optimize_table(translation_table, label_lut, asm_lines)
+                origins = optimization["origins"]
+                log("Peephole optimization removed %d of %d instructions", optimization["before"] - optimization["after"], optimization["before"])
+                if report is not None:
+                        report.update(optimization)
 
         link_labels(translation_table, label_lut)
+        if symbols is not None:
+                symbols.update((label, 2 * line_number) for label, line_number in label_lut.items())
+        if sources is not None:
+                locations = source_locations(program_text)
+                sources.update((2 * index, locations[origin]) for index, origin in enumerate(origins) if origin < len(locations))
         log("Label linking complete. Merging translation table to binary...")
 
-        binary_string = merge_and_check_binary(translation_table)
-        log(f"Merge complete. Binary string is: {binary_string}")
+        binary_string = merge_and_check_binary(translation_table, program_text, origins)
+        if debug:
+                log(f"Merge complete. Binary string is: {binary_string}", level="DEBUG")
+        else:
+                log("Merge complete. %d instructions assembled", len(binary_string) // 16)
 
         # Helper code to generate a translation file for reference use & debugging
-        with open("ref/translation.txt", "w") as file:
-                asm_lines = formatted_text.split("\n")
-                for i in range(int(len(binary_string) / 16)):
-                        file.write(asm_lines[i] + "\n")
+        if translation_file is not None:
+                with open(translation_file, "w") as file:
+                        for i in range(int(len(binary_string) / 16)):
+                                file.write(asm_lines[i] + "\n")
+
+                                instruction = binary_string[i * 16:i * 16 + 16]
+
+                                file.write(f"{hex(int(instruction, 2))}: {instruction}\n")
+
+        return binary_string
+# Incremental assembly for live editing. Source lines are translated once per distinct content,
+# and after an edit only the edited instructions, the instruction after them (which picks up any
+# label-only lines before it) and references whose offsets may have changed are linked again.
+# A valid offset spans at most LINK_REACH instructions, so an edit that adds or removes
+# instructions only relinks references within LINK_REACH of it, plus broken references.
+LINK_REACH = 2050
+
+@lru_cache(maxsize=65536)
+def _cached_translation(text_line):
+        '''translate_line() as (label, translation tuple, error message or None).'''
+        try:
+                label, line_translation = translate_line(text_line)
+                return label, tuple(line_translation), None
+        except Exception as err:
+                return None, (), str(err) or type(err).__name__
+
+class _instruction:
+        '''One instruction line of an incremental_assembler program.'''
+        __slots__ = ("piece", "label", "fields", "target", "word", "error", "index", "line")
+
+        def __init__(self, piece):
+                self.piece = piece # formatted source line, without any label-only lines before it
+                self.label = None
+                self.fields = ()
+                self.target = None # referenced label, if any
+                self.word = None # 16-bit binary string once linked, None if it cannot be
+                self.error = None
+                self.index = -1 # position in the instruction list and source line, see _index_of()/_line_of()
+                self.line = -1
+
+class incremental_assembler:
+        '''Assembles a program line by line and keeps it assembled through edits.
+
+        set_text() loads a whole program. edit() replaces a range of source lines and returns
+        the resulting change to the instruction list. When there are no errors, binary() equals
+        assemble() of the same text.
+
+        Unknown labels differ: assemble() silently links them to the first instruction, as it
+        always has, but here they are errors, so the editor can point at the typo.'''
+
+        def __init__(self, program_text=""):
+                self.set_text(program_text)
+
+        def set_text(self, program_text):
+                '''Loads program_text, replacing the whole program.'''
+                self.lines = []
+                self.parsed = [] # per source line: None, a label-only string or an _instruction
+                self.instructions = []
+                self.definitions = {} # label -> instructions defining it
+                self.references = {} # label -> instructions referencing it
+                self.failing = set() # instructions that cannot be assembled
+
+                # Instructions before these positions and source lines have their index and line up
+                # to date. Edits that move instructions lower them, and stale lookups renumber from them
+                self._indexed = 0
+                self._lined = 0
+
+                return self.edit(0, 0, program_text.split("\n"))
+
+        def edit(self, start, end, new_lines):
+                '''Replaces source lines start to end (exclusive) with new_lines. Returns the change as
+                a dict: instructions from index start are replaced by the given removed count of old
+                instructions, words gives the new ones, and changed maps the indices of other
+                instructions whose words changed to their new words.'''
+                parsed = self.parsed
+                instructions = self.instructions
+                start = max(0, min(start, len(parsed)))
+                end = max(start, min(end, len(parsed)))
+
+                first = self._instruction_index(start)
+                old = [item for item in parsed[start:end] if type(item) == _instruction]
+                for instruction in old:
+                        self._forget(instruction)
+
+                new_items = [_parse_source_line(line) for line in new_lines]
+                self.lines[start:end] = new_lines
+                parsed[start:end] = new_items
+
+                new = [item for item in new_items if type(item) == _instruction]
+                instructions[first:first + len(old)] = new
+
+                # Later instructions moved if the counts differ, which leaves their index and line stale
+                for index, instruction in enumerate(new, first):
+                        instruction.index = index
+                for line_number, item in enumerate(new_items, start):
+                        if type(item) == _instruction:
+                                item.line = line_number
+                if len(new) != len(old):
+                        self._indexed = min(self._indexed, first + min(len(new), len(old)))
+                if len(new_items) != end - start:
+                        self._lined = min(self._lined, start + min(len(new_items), end - start))
+
+                # Translate the new instructions and the one after them, whose label prefix may have changed
+                retranslate = [(start + offset, item) for offset, item in enumerate(new_items) if type(item) == _instruction]
+                follower_line = self._next_instruction_line(start + len(new_items))
+                if follower_line is not None:
+                        retranslate.append((follower_line, parsed[follower_line]))
+
+                moved_labels = {instruction.label for instruction in old}
+                for line_number, instruction in retranslate:
+                        moved_labels.add(instruction.label)
+                        self._translate(instruction, line_number)
+                        moved_labels.add(instruction.label)
+                moved_labels.discard(None)
+
+                # Link everything that may have changed, with the indices already known
+                to_link = {instruction: first + index for index, instruction in enumerate(new)}
+                if follower_line is not None:
+                        to_link[parsed[follower_line]] = first + len(new)
+                for label in moved_labels:
+                        for instruction in self.references.get(label, ()):
+                                to_link.setdefault(instruction, None)
+
+                # Adding or removing instructions moves references that span the edit. Only those
+                # starting within reach of it can be in range before or after the edit
+                positions = {}
+                delta = len(new) - len(old)
+                if delta:
+                        reach = LINK_REACH + abs(delta)
+                        low = max(first - reach, 0)
+                        high = min(first + len(new) + reach, len(instructions))
+                        positions = {id(instruction): index for index, instruction in enumerate(instructions[low:high], low)}
+
+                        for index in range(low, high):
+                                instruction = instructions[index]
+                                if instruction.target is None or instruction in to_link:
+                                        continue
+
+                                target = self._resolve(instruction.target)
+                                target_index = positions.get(id(target)) if target is not None else None
+                                if target_index is not None and (index < first) != (target_index < first):
+                                        to_link[instruction] = index
+
+                changed = {}
+                for instruction, index in to_link.items():
+                        if index is None:
+                                index = positions.get(id(instruction))
+                        if index is None:
+                                index = self._index_of(instruction)
+
+                        old_word = instruction.word
+                        self._link(instruction, index, positions)
+                        if instruction.word != old_word and index not in range(first, first + len(new)):
+                                changed[index] = instruction.word
+
+                return {
+                        "start": first,
+                        "removed": len(old),
+                        "words": [instruction.word for instruction in new],
+                        "changed": changed,
+                }
+
+        def errors(self):
+                '''(source line number, message) for every line that cannot be assembled, in line order.
+                This includes references to unknown labels, which assemble() accepts.'''
+                errors = [(self._line_of(instruction) + 1, instruction.error) for instruction in self.failing]
+
+                # Label-only lines after the last instruction have nothing to label
+                line_number = len(self.parsed) - 1
+                while line_number >= 0 and type(self.parsed[line_number]) != _instruction:
+                        if self.parsed[line_number] is not None:
+                                errors.append((line_number + 1, f"Label {self.parsed[line_number]} has no instruction to label"))
+                        line_number -= 1
+
+                return sorted(errors)
+
+        def binary(self):
+                '''Binary string of the program, or None while it has errors.'''
+                if self.errors():
+                        return None
+                return "".join(instruction.word for instruction in self.instructions)
+
+        def _instruction_index(self, line_number):
+                '''Index of the first instruction at or after source line line_number.'''
+                line_number = self._next_instruction_line(line_number)
+                return len(self.instructions) if line_number is None else self._index_of(self.parsed[line_number])
+
+        def _index_of(self, instruction):
+                '''Position of instruction in the instruction list.'''
+                index = instruction.index
+                if not (0 <= index < len(self.instructions) and self.instructions[index] is instruction):
+                        for index in range(self._indexed, len(self.instructions)):
+                                self.instructions[index].index = index
+                        self._indexed = len(self.instructions)
+                return instruction.index
+
+        def _line_of(self, instruction):
+                '''Source line number of instruction.'''
+                line_number = instruction.line
+                if not (0 <= line_number < len(self.parsed) and self.parsed[line_number] is instruction):
+                        for line_number in range(self._lined, len(self.parsed)):
+                                item = self.parsed[line_number]
+                                if type(item) == _instruction:
+                                        item.line = line_number
+                        self._lined = len(self.parsed)
+                return instruction.line
+
+        def _next_instruction_line(self, line_number):
+                while line_number < len(self.parsed):
+                        if type(self.parsed[line_number]) == _instruction:
+                                return line_number
+                        line_number += 1
+                return None
+
+        def _forget(self, instruction):
+                if instruction.label is not None:
+                        self.definitions[instruction.label].remove(instruction)
+                if instruction.target is not None:
+                        self.references[instruction.target].discard(instruction)
+                self.failing.discard(instruction)
+
+        def _translate(self, instruction, line_number):
+                '''Translates instruction with the label-only lines before it, as format_program_text would join them.'''
+                self._forget(instruction)
+
+                prefix = []
+                previous = line_number - 1
+                while previous >= 0 and type(self.parsed[previous]) != _instruction:
+                        if self.parsed[previous] is not None:
+                                prefix.append(self.parsed[previous])
+                        previous -= 1
+                prefix.reverse()
+                prefix.append(instruction.piece)
+
+                label, fields, error = _cached_translation(" ".join(prefix))
+                instruction.label = label
+                instruction.fields = fields
+                instruction.error = error
+                instruction.target = fields[-1] if fields and not BINARY_PATTERN.match(fields[-1]) else None
+
+                if label is not None:
+                        self.definitions.setdefault(label, []).append(instruction)
+                if instruction.target is not None:
+                        self.references.setdefault(instruction.target, set()).add(instruction)
+
+        def _resolve(self, label):
+                '''Instruction a label refers to, the last one if it is defined more than once.'''
+                definitions = self.definitions.get(label)
+                if not definitions:
+                        return None
+                if len(definitions) == 1:
+                        return definitions[0]
+                return max(definitions, key=self._index_of)
+
+        def _link(self, instruction, index, positions):
+                fields = instruction.fields
+                word = None
+
+                # Lines that failed to translate keep their translation error
+                if not fields:
+                        pass
+                elif instruction.target is None:
+                        word = "".join(fields)
+                        instruction.error = None
+                else:
+                        target = self._resolve(instruction.target)
+                        if target is None:
+                                instruction.error = f"Unknown label {instruction.target}"
+                        else:
+                                target_index = positions.get(id(target))
+                                if target_index is None:
+                                        target_index = self._index_of(target)
 
-                        instruction = binary_string[i * 16:i * 16 + 16]
+                                word = "".join(fields[:-1]) + link_field(fields, index, target_index)
+                                instruction.error = None
 
-                        file.write(f"{hex(int(instruction, 2))}: {instruction}\n")
+                if word is not None and len(word) != 16:
+                        instruction.error = "Branch or jump target out of range" if instruction.target is not None else "Problem assembling instruction"
+                        word = None
 
-        return binary_string
\ No newline at end of file
+                instruction.word = word
+                if instruction.error is None:
+                        self.failing.discard(instruction)
+                else:
+                        self.failing.add(instruction)
+
+def _parse_source_line(line):
+        '''None for blank and comment lines, the label for label-only lines, else a new _instruction.'''
+        line = line.split("#")[0].strip()
+        if line == "":
+                return None
+        if line.endswith(":"):
+                return line
+        return _instruction(line)
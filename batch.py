@@ -0,0 +1,271 @@
+'''
+batch.py
+
+BRISC lockstep batch simulator. Runs one program on many machines at once, each with its own
+registers, PC, NZP and data memory, using NumPy arrays and masking for diverging branches/halts
+
+James Jenkins 2025
+'''
+
+from memory import create_memory
+from simulator import fast_processor
+
+from bitarray import bitarray
+import hashlib
+import numpy as np
+
+# NZP value for every 16-bit result: 0b100 negative, 0b010 zero, 0b001 positive
+_NZP = np.array([0b010] + [0b001] * 0x7FFF + [0b100] * 0x8000, dtype=np.int8)
+
+def _signed(values):
+        '''Interprets 16-bit register values as two's complement.'''
+        return (values ^ 0x8000) - 0x8000
+
+def _div(a, b):
+        '''Signed division truncating toward zero. b must be nonzero.'''
+        quotient = np.abs(a) // np.abs(b)
+        return np.where((a < 0) != (b < 0), -quotient, quotient)
+
+def _shift_amount(imm):
+        '''Shift amount from a sign-extended immediate, capped where every bit is shifted out.'''
+        return np.minimum(imm & 0x1FF, 16)
+
+class batch_processor:
+        '''N BRISC machines sharing one text memory, executed in lockstep.
+
+        Machine state is held in arrays with the machine index first: regs (N, 8), pc, ir, nzp,
+        cycle, run and faulted (N,), and data (N, memory size). A machine that divides by zero
+        stops with faulted set, where processor.start() would have raised ZeroDivisionError.'''
+
+        def __init__(self, text_memory, data_images, registers=None):
+                # Text memory is shared, so every address can be decoded up front
+                self.text = bytes(text_memory.tobytes()) if type(text_memory) is bitarray else bytes(text_memory)
+                padded = np.zeros(0x10001, dtype=np.int64)
+                padded[:len(self.text)] = np.frombuffer(self.text, dtype=np.uint8)[:0x10001]
+
+                # Instruction word at every byte address
+                self._words = padded[:-1] << 8 | padded[1:]
+
+                self._opcode = self._words >> 12
+                self._rs = (self._words >> 9) & 7
+                self._rt = (self._words >> 6) & 7
+                self._rd = (self._words >> 3) & 7
+                self._imm = ((self._words & 0x1FF) ^ 0x100) - 0x100
+                self._jmp = ((self._words & 0xFFF) ^ 0x800) - 0x800
+                self._key = (self._opcode << 3) | (self._words & 7)
+
+                # Per-machine data memory
+                self.data = np.array([bytearray(image.tobytes()) if type(image) is bitarray else bytearray(image) for image in data_images], dtype=np.uint8)
+                count = len(self.data)
+
+                # Per-machine registers
+                self.regs = np.zeros((count, 8), dtype=np.int64)
+                if registers is not None:
+                        self.regs[:] = np.asarray(registers, dtype=np.int64) & 0xFFFF
+
+                self.pc = np.zeros(count, dtype=np.int64)
+                self.ir = np.zeros(count, dtype=np.int64)
+                self.nzp = np.zeros(count, dtype=np.int8)
+                self.cycle = np.zeros(count, dtype=np.int64)
+                self.run = np.ones(count, dtype=bool)
+                self.faulted = np.zeros(count, dtype=bool)
+
+        def __len__(self):
+                return len(self.data)
+
+        def _read16(self, machines, addresses):
+                '''Reads a big-endian word at each machine's byte address. Bytes past the end read as zero.'''
+                size = self.data.shape[1]
+                high = np.where(addresses < size, self.data[machines, np.minimum(addresses, size - 1)], 0).astype(np.int64)
+                low = np.where(addresses + 1 < size, self.data[machines, np.minimum(addresses + 1, size - 1)], 0).astype(np.int64)
+                return high << 8 | low
+
+        def _write16(self, machines, addresses, values):
+                '''Writes a big-endian word at each machine's byte address. Bytes past the end are dropped.'''
+                size = self.data.shape[1]
+                in_range = addresses < size
+                self.data[machines[in_range], addresses[in_range]] = values[in_range] >> 8
+                in_range = addresses + 1 < size
+                self.data[machines[in_range], addresses[in_range] + 1] = values[in_range] & 0xFF
+
+        def _set_result(self, machines, destinations, result):
+                result &= 0xFFFF
+                self.regs[machines, destinations] = result
+                self.nzp[machines] = _NZP[result]
+
+        # Instruction handlers. Each takes the machines executing it and their fetch addresses.
+
+        def _op_branch(self, machines, at):
+                taken = (self._rs[at] & self.nzp[machines]) != 0
+                self.pc[machines[taken]] = (self.pc[machines[taken]] + self._imm[at[taken]]) & 0xFFFF
+
+        def _alu_r(self, machines, at, key):
+                a = self.regs[machines, self._rt[at]]
+                b = self.regs[machines, self._rd[at]]
+                destinations = self._rs[at]
+
+                if key == 0b0001011:
+                        zero = b == 0
+                        self._fault(machines[zero])
+                        machines, destinations, a, b = machines[~zero], destinations[~zero], a[~zero], b[~zero]
+
+                self._set_result(machines, destinations, _R_TYPE_OPS.get(key, lambda a, b: a * 0)(a, b))
+
+        def _alu_i(self, machines, at, opcode):
+                destinations = self._rs[at]
+                a = self.regs[machines, destinations]
+                imm = self._imm[at]
+
+                if opcode == 0b0110:
+                        zero = imm == 0
+                        self._fault(machines[zero])
+                        machines, destinations, a, imm = machines[~zero], destinations[~zero], a[~zero], imm[~zero]
+
+                self._set_result(machines, destinations, _I_TYPE_OPS[opcode](a, imm))
+
+        def _op_move(self, machines, at):
+                value = self.regs[machines, self._rt[at]]
+                self.regs[machines, self._rs[at]] = value
+                self.nzp[machines] = _NZP[value]
+
+        def _op_ldr(self, machines, at):
+                self.regs[machines, self._rs[at]] = self._read16(machines, self.regs[machines, self._rt[at]])
+
+        def _op_str(self, machines, at):
+                self._write16(machines, self.regs[machines, self._rs[at]], self.regs[machines, self._rt[at]])
+
+        def _op_clr(self, machines, at):
+                self.regs[machines, self._rs[at]] = 0
+
+        def _op_lpc(self, machines, at):
+                self.regs[machines, self._rs[at]] = self.pc[machines]
+
+        def _op_swp(self, machines, at):
+                rs, rt = self._rs[at], self._rt[at]
+                a, b = self.regs[machines, rs], self.regs[machines, rt]
+                self.regs[machines, rs] = b
+                self.regs[machines, rt] = a
+
+        def _op_rst(self, machines, at):
+                self.pc[machines] = 0
+
+        def _op_hlt(self, machines, at):
+                self.run[machines] = False
+
+        def _op_sti(self, machines, at):
+                self._write16(machines, self.regs[machines, self._rs[at]], self._imm[at] & 0xFFFF)
+
+        def _op_ldi(self, machines, at):
+                self.regs[machines, self._rs[at]] = self._imm[at] & 0xFFFF
+
+        def _op_save(self, machines, at):
+                base = (self.pc[machines] + self._jmp[at]) & 0xFFFF
+                for i in range(8):
+                        self._write16(machines, base + 2 * i, self.regs[machines, i])
+
+        def _op_rest(self, machines, at):
+                base = (self.pc[machines] + self._jmp[at]) & 0xFFFF
+                for i in range(8):
+                        self.regs[machines, i] = self._read16(machines, base + 2 * i)
+
+        def _op_jmp(self, machines, at):
+                self.pc[machines] = (self.pc[machines] + self._jmp[at]) & 0xFFFF
+
+        def _fault(self, machines):
+                self.faulted[machines] = True
+                self.run[machines] = False
+
+        def _dispatch(self, key, machines, at):
+                opcode, func = key >> 3, key & 7
+
+                if opcode == 0b0000:
+                        self._op_branch(machines, at)
+                elif opcode in (0b0001, 0b0010):
+                        self._alu_r(machines, at, key)
+                elif opcode <= 0b1001:
+                        self._alu_i(machines, at, opcode)
+                elif opcode == 0b1010:
+                        [self._op_move, self._op_ldr, self._op_str, self._op_clr, self._op_lpc, self._op_swp, self._op_rst, self._op_hlt][func](machines, at)
+                else:
+                        [self._op_sti, self._op_ldi, self._op_save, self._op_rest, self._op_jmp][opcode - 0b1011](machines, at)
+
+        def step(self):
+                '''Steps every running machine one instruction forward. Returns the number of machines stepped.'''
+                machines = np.flatnonzero(self.run)
+                if len(machines) == 0:
+                        return 0
+
+                # Fetch and increment PC
+                at = self.pc[machines]
+                self.ir[machines] = self._words[at]
+                self.pc[machines] = (at + 2) & 0xFFFF
+
+                # Execute each distinct instruction kind over the machines fetching it
+                keys = self._key[at]
+                first = keys[0]
+                if (keys == first).all():
+                        self._dispatch(first, machines, at)
+                else:
+                        for key in np.unique(keys):
+                                selected = keys == key
+                                self._dispatch(key, machines[selected], at[selected])
+
+                # Machines that faulted this step did not complete the instruction
+                self.cycle[machines] += ~self.faulted[machines]
+                return len(machines)
+
+        def start(self, max_cycles=None):
+                '''Runs until every machine halts or faults, or for at most max_cycles lockstep steps.'''
+                steps = 0
+                while self.run.any() and (max_cycles is None or steps < max_cycles):
+                        self.step()
+                        steps += 1
+
+        def machine(self, index):
+                '''Returns a fast_processor holding machine index's state.'''
+                proc = fast_processor()
+                proc._text = create_memory(len(self.text), self.text)
+                proc._data = create_memory(self.data.shape[1], self.data[index].tobytes())
+                proc._regs = [int(value) for value in self.regs[index]]
+                proc._pc = int(self.pc[index])
+                proc._ir = int(self.ir[index])
+                proc._nzp = int(self.nzp[index])
+                proc.cycle = int(self.cycle[index])
+                proc.run = bool(self.run[index])
+                return proc
+
+        def results(self):
+                '''Returns per-machine final state as a list of dicts. data_digest is the SHA-256 hex digest
+                of the machine's data memory, as in brisc.py's batch results.'''
+                return [{
+                        "registers": [int(value) for value in self.regs[i]],
+                        "pc": int(self.pc[i]),
+                        "nzp": int(self.nzp[i]),
+                        "cycle": int(self.cycle[i]),
+                        "halted": not self.run[i] and not self.faulted[i],
+                        "faulted": bool(self.faulted[i]),
+                        "data_digest": hashlib.sha256(self.data[i].tobytes()).hexdigest(),
+                } for i in range(len(self))]
+
+_R_TYPE_OPS = {
+        0b0001000: lambda a, b: a + b,
+        0b0001001: lambda a, b: a - b,
+        0b0001010: lambda a, b: _signed(a) * _signed(b),
+        0b0001011: lambda a, b: _div(_signed(a), _signed(b)),
+        0b0001100: lambda a, b: -a,
+        0b0010000: lambda a, b: ~a,
+        0b0010001: lambda a, b: a & b,
+        0b0010010: lambda a, b: a | b,
+        0b0010011: lambda a, b: a ^ b,
+        0b0010100: lambda a, b: ~(a | b),
+}
+
+_I_TYPE_OPS = {
+        0b0011: lambda a, imm: a + imm,
+        0b0100: lambda a, imm: a - imm,
+        0b0101: lambda a, imm: _signed(a) * imm,
+        0b0110: lambda a, imm: _div(_signed(a), imm),
+        0b0111: lambda a, imm: a << _shift_amount(imm),
+        0b1000: lambda a, imm: a >> _shift_amount(imm),
+        0b1001: lambda a, imm: _signed(a) >> _shift_amount(imm),
+}
@@ -0,0 +1,186 @@
+'''
+bench.py
+
+BRISC benchmark suite. Measures assembler lines/sec, simulator instructions/sec for step() and
+start() on each backend over a set of standard workloads, and /run page render time. Results are
+saved as JSON, and a saved result file can be used as a baseline to flag regressions:
+        python bench.py --output baseline.json
+        python bench.py --compare baseline.json          # exits with 1 on a regression
+
+James Jenkins 2025
+'''
+
+from brisc_logging import init_log
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import assembler
+from bench_assembler import bench as bench_assembler
+from brisc_object import pack_binary, read_data_image
+from simulator import create_processor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Workload programs, all run against the default data image
+WORKLOADS = {
+        "test_loop": os.path.join(ROOT, "ref", "test.asm"),
+        "bubble_sort": os.path.join(ROOT, "ref", "bench", "bubble_sort.asm"),
+        "multiply": os.path.join(ROOT, "ref", "bench", "multiply.asm"),
+        "memory_copy": os.path.join(ROOT, "ref", "bench", "memory_copy.asm"),
+        "branch_ladder": os.path.join(ROOT, "ref", "bench", "branch_ladder.asm"),
+}
+DATA_IMAGE = os.path.join(ROOT, "ref", "test_data.bo")
+
+# Simulator configurations: (backend, backend options, run with step() or start(), cycle cap per
+# run). The bitarray backend is capped so long workloads finish in reasonable time.
+SIMULATORS = {
+        "bitarray_step": ("bitarray", {}, "step", 20_000),
+        "int_step": ("int", {}, "step", None),
+        "int_start": ("int", {}, "start", None),
+        "jit_start": ("int", {"jit": True}, "start", None),
+}
+
+# Size of the generated program for the assembler benchmark
+ASSEMBLER_LINES = 10_000
+
+def metric(value, unit, higher_is_better):
+        '''One result entry of the JSON output.'''
+        return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+def load_workload(path):
+        '''Assembles a workload to its packed text image.'''
+        with open(path, "r") as file:
+                return pack_binary(assembler.assemble(file.read(), translation_file=None))
+
+def measure_simulator(text, data, backend, options, mode, max_cycles, min_seconds):
+        '''Instructions/sec running a program from reset, repeated until min_seconds of run time.'''
+        instructions = 0
+        elapsed = 0.0
+
+        while elapsed < min_seconds:
+                p = create_processor(backend, **options)
+                p.load_text(text)
+                p.load_data(data)
+
+                start = time.perf_counter()
+                if mode == "step":
+                        while p.run and (max_cycles is None or p.cycle < max_cycles):
+                                p.step()
+                else:
+                        p.start(max_cycles)
+                elapsed += time.perf_counter() - start
+                instructions += p.cycle
+
+        return instructions / elapsed
+
+def measure_render(program_text, min_seconds):
+        '''Milliseconds per /run reset and render, and per single step and render.'''
+        import app
+        client = app.app.test_client()
+        client.post("/edit", data={"program_text": program_text})
+
+        results = {}
+        for name, request in (("render.run_reset_ms", lambda: client.get("/run")), ("render.run_step_ms", lambda: client.post("/run", data={}))):
+                client.get("/run")
+                count = 0
+                start = time.perf_counter()
+                while time.perf_counter() - start < min_seconds:
+                        request()
+                        count += 1
+                results[name] = metric((time.perf_counter() - start) / count * 1000, "ms", False)
+
+        return results
+
+def run_benchmarks(workloads, simulators, min_seconds, repeat):
+        '''Runs the suite and returns its metrics by name.'''
+        results = {}
+
+        lines_per_second, _ = bench_assembler(ASSEMBLER_LINES, repeat)
+        results["assembler.lines_per_sec"] = metric(lines_per_second, "lines/s", True)
+
+        with read_data_image(DATA_IMAGE) as image:
+                data = bytes(image.data)
+
+        for workload in workloads:
+                text = load_workload(WORKLOADS[workload])
+                for simulator in simulators:
+                        backend, options, mode, max_cycles = SIMULATORS[simulator]
+                        ips = max(measure_simulator(text, data, backend, options, mode, max_cycles, min_seconds) for _ in range(repeat))
+                        results[f"sim.{workload}.{simulator}.ips"] = metric(ips, "instructions/s", True)
+                        print(f"{workload:>14} {simulator:<14} {ips:14,.0f} instructions/s", file=sys.stderr)
+
+        with open(WORKLOADS["test_loop"], "r") as file:
+                results.update(measure_render(file.read(), min_seconds))
+
+        return results
+
+def compare(results, baseline, threshold):
+        '''Prints each metric against the baseline and returns the names of those that got worse
+        by more than threshold (a fraction of the baseline value).'''
+        regressions = []
+        print(f"{"metric":<40} {"baseline":>14} {"current":>14} {"change":>8}")
+
+        for name, current in results.items():
+                if name not in baseline:
+                        print(f"{name:<40} {"-":>14} {current["value"]:>14,.2f} {"new":>8}")
+                        continue
+
+                old = baseline[name]["value"]
+                change = (current["value"] - old) / old if old else 0.0
+                worse = -change if current["higher_is_better"] else change
+                flag = " REGRESSION" if worse > threshold else ""
+                if flag:
+                        regressions.append(name)
+                print(f"{name:<40} {old:>14,.2f} {current["value"]:>14,.2f} {change:>+8.1%}{flag}")
+
+        return regressions
+
+def parse_args(argv):
+        parser = argparse.ArgumentParser(description="Run the BRISC benchmark suite")
+        parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS), help="workloads to run (default: all)")
+        parser.add_argument("--simulators", nargs="+", choices=SIMULATORS, default=list(SIMULATORS), help="simulator configurations to run (default: all)")
+        parser.add_argument("--seconds", type=float, default=0.5, help="minimum run time per measurement (default: %(default)s)")
+        parser.add_argument("--repeat", type=int, default=3, help="measurements per benchmark, the best is kept (default: %(default)s)")
+        parser.add_argument("--output", help="JSON file to save the results to")
+        parser.add_argument("--compare", help="baseline JSON results to check for regressions")
+        parser.add_argument("--threshold", type=float, default=0.10, help="slowdown fraction counted as a regression (default: %(default)s)")
+        return parser.parse_args(argv)
+
+def main():
+        args = parse_args(sys.argv[1:])
+
+        # app configures its own log when first imported, so import it for measure_render() before
+        # configuring ours
+        import app
+        init_log(logfile="log/bench.log", quiet=True, level="INFO")
+
+        results = run_benchmarks(args.workloads, args.simulators, args.seconds, args.repeat)
+        report = {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+        }
+
+        if args.output:
+                with open(args.output, "w") as file:
+                        json.dump(report, file, indent=8)
+
+        if args.compare:
+                with open(args.compare, "r") as file:
+                        baseline = json.load(file)["results"]
+                regressions = compare(results, baseline, args.threshold)
+                if regressions:
+                        print(f"{len(regressions)} regressions beyond {args.threshold:.0%}: {", ".join(regressions)}")
+                        sys.exit(1)
+        else:
+                for name, result in results.items():
+                        print(f"{name:<40} {result["value"]:>14,.2f} {result["unit"]}")
+
+if __name__ == "__main__":
+        main()
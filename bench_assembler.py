@@ -0,0 +1,72 @@
+'''
+bench_assembler.py
+
+BRISC assembler benchmark. Assembles generated programs of increasing size and reports
+lines/sec, which should stay roughly flat as programs grow
+
+James Jenkins 2025
+'''
+
+from assembler import assemble
+
+import argparse
+import random
+import time
+
+def generate_program(num_lines, seed=0):
+        '''Generates a num_lines line program mixing every instruction type, with a label every
+        16 lines and branches/jumps to random labels within their offset range.'''
+        rng = random.Random(seed)
+        num_labels = max(num_lines // 16, 1)
+        lines = []
+
+        def nearby_label(line_number, distance):
+                here = line_number // 16
+                return f"L{rng.randrange(max(here - distance, 0), min(here + distance, num_labels - 1) + 1)}"
+
+        for line_number in range(num_lines):
+                label = f"L{line_number // 16}: " if line_number % 16 == 0 else ""
+                kind = rng.randrange(5)
+
+                if kind == 0:
+                        instruction = f"{rng.choice(["addr", "subr", "and", "or", "xor"])} $r{rng.randrange(8)} $r{rng.randrange(8)} $r{rng.randrange(8)}"
+                elif kind == 1:
+                        instruction = f"{rng.choice(["addi", "subi", "ldi", "sl", "srl"])} $r{rng.randrange(8)} {rng.randrange(64)}"
+                elif kind == 2:
+                        instruction = f"{rng.choice(["brn", "brz", "brp", "brnz", "brzp"])} {nearby_label(line_number, 6)}"
+                elif kind == 3:
+                        instruction = f"jmp {nearby_label(line_number, 60)}"
+                else:
+                        instruction = f"move $r{rng.randrange(8)} $r{rng.randrange(8)}    # comment"
+
+                lines.append(label + instruction)
+
+        lines.append("hlt")
+        return "\n".join(lines)
+
+def bench(num_lines, repeat=3):
+        '''Best of repeat lines/sec for assembling a num_lines line program.'''
+        program_text = generate_program(num_lines)
+        best = float("inf")
+
+        for _ in range(repeat):
+                start = time.perf_counter()
+                assemble(program_text, translation_file=None)
+                best = min(best, time.perf_counter() - start)
+
+        return num_lines / best, best
+
+def parse_args():
+        parser = argparse.ArgumentParser(description="Benchmark the BRISC assembler")
+        parser.add_argument("sizes", nargs="*", type=int, default=[10_000, 100_000], help="program sizes in lines")
+        parser.add_argument("--repeat", type=int, default=3, help="runs per size, the best is reported")
+        return parser.parse_args()
+
+def main():
+        args = parse_args()
+        for num_lines in args.sizes:
+                lines_per_second, seconds = bench(num_lines, args.repeat)
+                print(f"{num_lines:>9} lines: {seconds:8.3f} s, {lines_per_second:12,.0f} lines/sec")
+
+if __name__ == "__main__":
+        main()
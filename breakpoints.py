@@ -0,0 +1,265 @@
+'''
+breakpoints.py
+
+BRISC breakpoints, watchpoints and run-until conditions. A stop_conditions set is given to a
+processor as its stops, and start() then stops before executing an instruction at a breakpoint,
+or after an instruction that writes a watched register or data memory byte or makes a condition
+true. Conditions are written as an operand, a comparison and a value:
+        $r5 == 0x20         cycle > 1000         mem[0x40] != 0         pc >= LOOP         nzp == 2
+
+Everything is precomputed into sets and a bitmap, and each instruction word is classified once
+by whether it could trigger a watchpoint or condition, so start() only checks those instructions.
+
+James Jenkins 2025
+'''
+
+import operator
+import re
+
+from simulator import _read16
+
+# Comparisons a condition can use
+COMPARISONS = {
+        "==": operator.eq,
+        "!=": operator.ne,
+        "<=": operator.le,
+        ">=": operator.ge,
+        "<": operator.lt,
+        ">": operator.gt,
+}
+
+# flags value for instruction words not yet classified
+UNCLASSIFIED = 2
+
+# Operand kinds
+_REGISTER, _MEMORY, _PC, _NZP, _CYCLE = range(5)
+
+_CONDITION = re.compile(r"^\s*(\S+?)\s*(==|!=|<=|>=|<|>)\s*(\S+)\s*$")
+_REGISTER_NAME = re.compile(r"^\$?r([0-7])$", re.IGNORECASE)
+_MEMORY_OPERAND = re.compile(r"^mem\[(.+)\]$", re.IGNORECASE)
+
+def parse_value(text, symbols=None):
+        '''A decimal, 0x or 0b prefixed number, or a label from symbols.'''
+        text = text.strip()
+        if symbols and text in symbols:
+                return symbols[text]
+
+        try:
+                return int(text, 0)
+        except ValueError:
+                raise ValueError(f"'{text}' is not a number{" or known label" if symbols is not None else ""}") from None
+
+def parse_location(text, symbols=None):
+        '''Byte address of a breakpoint or memory watchpoint, given as a number or label.'''
+        address = parse_value(text, symbols)
+        if not 0 <= address <= 0xFFFF:
+                raise ValueError(f"Address {text} is outside the 16-bit address space")
+        return address
+
+def parse_condition(text, symbols=None):
+        '''Parses a condition to (operand kind, register or address, comparison, value, text).'''
+        match = _CONDITION.match(text)
+        if match is None:
+                raise ValueError(f"Condition '{text}' is not of the form <operand> <comparison> <value>")
+        operand, comparison, value = match.groups()
+
+        register = _REGISTER_NAME.match(operand)
+        memory = _MEMORY_OPERAND.match(operand)
+        if register is not None:
+                kind, index = _REGISTER, int(register.group(1))
+        elif memory is not None:
+                kind, index = _MEMORY, parse_location(memory.group(1), symbols)
+        elif operand.lower() in ("pc", "nzp", "cycle"):
+                kind, index = {"pc": _PC, "nzp": _NZP, "cycle": _CYCLE}[operand.lower()], 0
+        else:
+                raise ValueError(f"Unknown condition operand '{operand}', expected $r0-$r7, mem[address], pc, nzp or cycle")
+
+        # Registers, memory and PC hold 16-bit values, so negative values compare as two's complement
+        value = parse_value(value, symbols)
+        if kind != _CYCLE:
+                value &= 0xFFFF
+
+        return (kind, index, COMPARISONS[comparison], value, text.strip())
+
+def split_list(text):
+        '''Splits a comma or semicolon separated list from a form field or command line.'''
+        return [item.strip() for item in re.split(r"[,;]", text or "") if item.strip()]
+
+def registers_written(d):
+        '''Bitmask of the registers a decoded instruction writes.'''
+        if d.write_dst_reg:
+                return 1 << d.rs
+        if d.opcode == 0b1010 and d.func == 0b101:
+                return 1 << d.rs | 1 << d.rt
+        if d.opcode == 0b1110:
+                return 0xFF
+        return 0
+
+def _writes_memory(d):
+        return d.write_dst_mem or d.opcode == 0b1101
+
+def _sets_nzp(d):
+        return 0b0001 <= d.opcode <= 0b1001 or (d.opcode == 0b1010 and d.func == 0b000)
+
+class stop_conditions:
+        '''Breakpoints on PCs, watchpoints on registers and data memory bytes, and conditions, each
+        given as strings (see parse_location(), parse_condition()) resolved against symbols.
+
+        A breakpoint stops before the instruction at its PC executes. Watchpoints stop after any
+        instruction writing the register or byte, even with the value it already held. Conditions
+        are checked after each instruction that writes their operand, so one that is already true
+        stops the next time its operand is written; cycle conditions stop at the first cycle they
+        hold, and pc == X is a breakpoint. A run resumed from a stop does not stop again at the
+        same cycle, so it steps over the breakpoint it stopped at; resume() does the same for a
+        run started any other way.
+
+        After each start(), hit describes why it stopped, or is empty if it did not.'''
+
+        def __init__(self, breakpoints=(), watch=(), conditions=(), symbols=None):
+                # Breakpoint PCs
+                self.pcs = set()
+
+                # Watched registers, as a bitmask, and watched data memory bytes, as a bitmap
+                self.registers = 0
+                self.memory = bytearray(0x10000)
+                self.watching_memory = False
+
+                # Conditions checked after instructions writing their operand, and (first cycle at
+                # which it holds, text) for cycle conditions, which need no checking
+                self.conditions = []
+                self.cycle_stops = []
+
+                # Whether conditions depend on registers (bitmask), memory, NZP, or change every step
+                self._condition_registers = 0
+                self._condition_memory = False
+                self._condition_nzp = False
+                self._every_step = False
+
+                for location in breakpoints:
+                        self.pcs.add(parse_location(location, symbols))
+
+                for item in watch:
+                        register = _REGISTER_NAME.match(item.strip())
+                        if register is not None:
+                                self.registers |= 1 << int(register.group(1))
+                        else:
+                                self.memory[parse_location(item, symbols)] = 1
+                                self.watching_memory = True
+
+                for text in conditions:
+                        self._add_condition(parse_condition(text, symbols))
+
+                # By instruction word: whether it could trigger a watchpoint or condition, or
+                # UNCLASSIFIED until classify() has seen it
+                self.flags = bytearray([UNCLASSIFIED]) * 0x10000
+
+                self.hit = ""
+                self.resume_cycle = None
+
+        def _add_condition(self, condition):
+                kind, index, compare, value, text = condition
+
+                if kind == _PC and compare is operator.eq:
+                        self.pcs.add(value)
+                        return
+
+                if kind == _CYCLE:
+                        # Only cycles counting up from the current one need checking
+                        first = {operator.eq: value, operator.ge: value, operator.gt: value + 1}.get(compare)
+                        if first is not None:
+                                self.cycle_stops.append((first, text))
+                                self.cycle_stops.sort()
+                                return
+
+                if kind == _REGISTER:
+                        self._condition_registers |= 1 << index
+                elif kind == _MEMORY:
+                        self._condition_memory = True
+                elif kind == _NZP:
+                        self._condition_nzp = True
+                else:
+                        self._every_step = True
+
+                self.conditions.append(condition)
+
+        @property
+        def empty(self):
+                return not (self.pcs or self.registers or self.watching_memory or self.conditions or self.cycle_stops)
+
+        def next_cycle_stop(self, cycle):
+                '''(cycle, text) of the first cycle condition still ahead of cycle, or None.'''
+                for stop in self.cycle_stops:
+                        if stop[0] > cycle:
+                                return stop
+                return None
+
+        def classify(self, d):
+                '''Whether instruction d could trigger a watchpoint or condition, cached by word.'''
+                written = registers_written(d)
+                flag = bool(
+                        self._every_step
+                        or written & (self.registers | self._condition_registers)
+                        or (_writes_memory(d) and (self.watching_memory or self._condition_memory))
+                        or (_sets_nzp(d) and self._condition_nzp)
+                )
+                self.flags[d.word] = flag
+                return flag
+
+        @property
+        def checking(self):
+                '''Whether any instruction could need checking after it executes.'''
+                return bool(self.registers or self.watching_memory or self.conditions)
+
+        def resume(self, p):
+                '''Lets the next start() run past a breakpoint at p's current PC, as a run started by
+                hand from a breakpoint should.'''
+                self.resume_cycle = p.cycle
+
+        def stop(self, p, reason):
+                self.hit = reason
+                self.resume_cycle = p.cycle
+                return True
+
+        def check(self, p, d, address):
+                '''After flagged instruction d has executed, with address its data memory address
+                (see effective_address()), stops if it triggered a watchpoint or condition.'''
+                written = registers_written(d) & self.registers
+                if written:
+                        index = written.bit_length() - 1
+                        return self.stop(p, f"watchpoint on $r{index} written at cycle {p.cycle}")
+
+                if address >= 0 and self.watching_memory and _writes_memory(d):
+                        size = 16 if d.opcode == 0b1101 else 2
+                        for byte in range(address, min(address + size, 0x10000)):
+                                if self.memory[byte]:
+                                        return self.stop(p, f"watchpoint on 0x{byte:04X} written at cycle {p.cycle}")
+
+                # Only conditions on what d wrote, or on something that changes every step, can have
+                # become true
+                registers = registers_written(d)
+                first = last = -1
+                if address >= 0 and _writes_memory(d):
+                        first, last = address, address + (16 if d.opcode == 0b1101 else 2) - 1
+
+                for kind, index, compare, value, text in self.conditions:
+                        if kind == _REGISTER:
+                                if not registers >> index & 1:
+                                        continue
+                                current = p._regs[index]
+                        elif kind == _MEMORY:
+                                if not (first <= index + 1 and index <= last):
+                                        continue
+                                current = _read16(p._data, index)
+                        elif kind == _NZP:
+                                if not _sets_nzp(d):
+                                        continue
+                                current = p._nzp
+                        elif kind == _PC:
+                                current = p._pc
+                        else:
+                                current = p.cycle
+
+                        if compare(current, value):
+                                return self.stop(p, f"{text} at cycle {p.cycle}")
+
+                return False
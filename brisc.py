@@ -1,25 +1,227 @@
 '''
 brisc.py
 
-BRISC (Brad's RISC) top level file for sample program runs
+BRISC (Brad's RISC) top level file for sample program runs and batch runs
+
+Run with no arguments for the sample program, or with .asm or packed object files to batch run them:
+        python brisc.py submissions/*.asm --max-cycles 1000000 --output results.jsonl
+        python brisc.py program.asm --data images/*.bin --jobs 8
+        python brisc.py program.asm --memory-size 0x10000    # full 16-bit address space
+        python brisc.py program.asm --break LOOP --stop-when "$r5 == 0x20"   # see breakpoints.py
+        python brisc.py program.asm --emit          # writes program.bo, see brisc_object.py
+        python brisc.py program.asm --optimize      # peephole optimized, see optimize.py
 
 James Jenkins 2025
 '''
 
-from brisc_logging import init_log, log
+from brisc_logging import LOG_LEVELS, init_log, log
 
 from bitarray import bitarray
+from bitarray.util import ba2int
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
 
 import assembler
-from simulator import processor
+from breakpoints import stop_conditions
+from brisc_object import DATA, build_object, pack_binary, parse_object, read_data_image, read_object, write_object
+from memory import ADDRESS_SPACE, DEFAULT_MEMORY_SIZE
+from simulator import processor, create_processor, BACKENDS
+
+# Data memory image for the sample program and for runs without --data
+DEFAULT_DATA_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ref", "test_data.bo")
 
 # Simply grabs the assembly text from a file and returns it
 def get_asm_from_file(filename):
         with open(filename, "r") as file:
                 return file.read()
 
+def default_data_memory():
+        '''Returns the data memory image used by the sample program.'''
+        return get_data_from_file(DEFAULT_DATA_IMAGE)
+
+def get_data_from_file(filename):
+        '''Loads a data memory image file, an object file data section or a raw image, as a 256-byte bitarray.'''
+        data_mem = bytearray(256)
+        with read_data_image(filename) as image:
+                for name, (address, view) in image.sections.items():
+                        if name == DATA:
+                                size = min(len(view), max(256 - address, 0))
+                                data_mem[address:address + size] = view[:size]
+
+        bits = bitarray()
+        bits.frombytes(bytes(data_mem))
+        return bits
+
+def load_program(program_file, optimize=False):
+        '''Loads a program as an object_file: .asm files are assembled, peephole optimized if optimize
+        is set, and anything else is mapped as a packed object or bare text image.'''
+        if not program_file.endswith(".asm"):
+                return read_object(program_file)
+
+        symbols = {}
+        binary = assembler.assemble(get_asm_from_file(program_file), translation_file=None, symbols=symbols, optimize=optimize)
+        return parse_object(build_object(pack_binary(binary), symbols=symbols))
+
+def load_program_and_data(proc, program_file, data_file=None):
+        '''Loads a program into proc, and data_file into its data memory, or DEFAULT_DATA_IMAGE unless
+        the program brings its own data section.'''
+        with load_program(program_file) as program:
+                program.load(proc)
+                if data_file is not None or DATA not in program.sections:
+                        with read_data_image(data_file or DEFAULT_DATA_IMAGE) as image:
+                                image.load_data(proc)
+
+def add_program_arguments(parser, budget="cycle budget"):
+        '''Adds the program, --data, --max-cycles and --memory-size arguments of the tools that run one
+        program under a model (profiler.py, cache.py, pipeline.py), for load_program_and_data().'''
+        parser.add_argument("program", help=".asm file or packed object file")
+        parser.add_argument("--data", help="data memory image (default: ref/test_data.bo unless the program has a data section)")
+        parser.add_argument("--max-cycles", type=int, default=10_000_000, help=f"{budget} (default: %(default)s)")
+        parser.add_argument("--memory-size", type=memory_size, default=DEFAULT_MEMORY_SIZE, help="bytes of data and text memory, up to 0x10000 (default: %(default)s)")
+
+def emit(args):
+        '''Assembles each program to a packed object file beside it, with the first --data image as its data section.'''
+        data = None
+        if args.data:
+                with read_data_image(args.data[0]) as image:
+                        data = bytes(image.data)
+
+        for program_file in args.programs:
+                symbols = {}
+                binary = assembler.assemble(get_asm_from_file(program_file), translation_file=None, symbols=symbols, optimize=args.optimize)
+                object_path = os.path.splitext(program_file)[0] + ".bo"
+                write_object(object_path, pack_binary(binary), data, symbols=symbols)
+                print(f"{program_file} -> {object_path} ({len(binary) // 8} bytes of text, {len(symbols)} symbols)")
+
+# Batch runs. Each worker process loads each program and data image once and reuses them for
+# every job it is given.
+_programs = {}
+_data_images = {}
+_optimize = False
+
+def _init_worker(logfile, optimize=False):
+        global _optimize
+        init_log(logfile=logfile, quiet=True, level="INFO")
+        _optimize = optimize
+
+def _load_program_cached(program_file):
+        if program_file not in _programs:
+                _programs[program_file] = load_program(program_file, _optimize)
+        return _programs[program_file]
+
+def _load_data_cached(data_file):
+        if data_file not in _data_images:
+                _data_images[data_file] = read_data_image(data_file)
+        return _data_images[data_file]
+
+def run_job(job):
+        '''Runs one (program file, data file, backend, max cycles, memory size, stops) job and returns
+        its result record. stops is None or (breakpoints, watchpoints, conditions), see breakpoints.py.'''
+        program_file, data_file, backend, max_cycles, memory_size, stops = job
+        result = {"program": program_file, "data": data_file}
+        start_time = time.perf_counter()
+
+        try:
+                program = _load_program_cached(program_file)
+        except (Exception, SystemExit) as err:
+                result.update(status="assembly_error", error=f"{type(err).__name__}: {err}")
+                return result
+
+        proc = create_processor(backend, jit=True, memory_size=memory_size) if backend == "int" else create_processor(backend, memory_size=memory_size)
+
+        # Sections are copied straight from the mapped files into processor memory
+        program.load(proc)
+        if data_file is not None or DATA not in program.sections:
+                _load_data_cached(DEFAULT_DATA_IMAGE if data_file is None else data_file).load_data(proc)
+
+        # Labels in breakpoints and conditions are resolved against each program's own symbols
+        if stops is not None:
+                try:
+                        proc.stops = stop_conditions(*stops, symbols=program.symbols)
+                except ValueError as err:
+                        result.update(status="stop_error", error=str(err))
+                        return result
+
+        try:
+                proc.start(max_cycles=max_cycles)
+                result["status"] = "halted" if not proc.run else "cycle_budget"
+                if stops is not None and proc.stops.hit:
+                        result.update(status="stopped", stop=proc.stops.hit)
+        except Exception as err:
+                result.update(status="runtime_error", error=f"{type(err).__name__}: {err}")
+
+        data_bytes = proc.data_memory.tobytes()
+        result.update(
+                cycles=proc.cycle,
+                pc=ba2int(proc.pc),
+                registers=[ba2int(register) for register in proc.register_file],
+                data_digest=hashlib.sha256(data_bytes).hexdigest(),
+                wall_time=time.perf_counter() - start_time,
+        )
+        return result
+
+def batch(args):
+        '''Runs every program against every data image across a process pool, writing JSON lines.'''
+        stops = (args.breakpoints, args.watch, args.conditions) if args.breakpoints or args.watch or args.conditions else None
+        jobs = [(program, data, args.backend, args.max_cycles, args.memory_size, stops) for program, data in itertools.product(args.programs, args.data or [None])]
+
+        output = sys.stdout if args.output == "-" else open(args.output, "w")
+        os.makedirs(os.path.dirname(args.log) or ".", exist_ok=True)
+
+        try:
+                with multiprocessing.Pool(args.jobs, initializer=_init_worker, initargs=(args.log, args.optimize)) as pool:
+                        for result in pool.imap(run_job, jobs, chunksize=max(1, len(jobs) // (4 * (args.jobs or os.cpu_count())))):
+                                output.write(json.dumps(result) + "\n")
+        finally:
+                if output is not sys.stdout:
+                        output.close()
+
+def memory_size(value):
+        '''--memory-size argument: a decimal or 0x prefixed byte count within the 16-bit address space.'''
+        size = int(value, 0)
+        if not 0 < size <= ADDRESS_SPACE:
+                raise argparse.ArgumentTypeError(f"{value} is outside the 16-bit address space (at most 0x10000)")
+        return size
+
+def parse_args(argv):
+        parser = argparse.ArgumentParser(description="Assemble and run BRISC programs. With no programs, runs ref/test.asm.")
+        parser.add_argument("programs", nargs="*", help=".asm files or packed object files to batch run")
+        parser.add_argument("--data", nargs="+", help="data memory images, object files or raw binary; every program runs against every image")
+        parser.add_argument("--emit", action="store_true", help="assemble the programs to .bo object files instead of running them")
+        parser.add_argument("--optimize", action="store_true", help="peephole optimize .asm programs as they are assembled")
+        parser.add_argument("--max-cycles", type=int, default=10_000_000, help="per-run cycle budget (default: %(default)s)")
+        parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+        parser.add_argument("--backend", choices=BACKENDS, default="int", help="simulator backend (default: %(default)s)")
+        parser.add_argument("--memory-size", type=memory_size, default=DEFAULT_MEMORY_SIZE, help="bytes of data and text memory, up to 0x10000 (default: %(default)s)")
+        parser.add_argument("--break", dest="breakpoints", nargs="+", default=[], metavar="LOCATION", help="stop before the instruction at these PCs or labels")
+        parser.add_argument("--watch", nargs="+", default=[], metavar="LOCATION", help="stop after writes to these registers ($r0-$r7) or data memory addresses")
+        parser.add_argument("--stop-when", dest="conditions", nargs="+", default=[], metavar="CONDITION", help="stop once a condition such as \"$r5 == 0x20\" or \"cycle > 1000\" holds")
+        parser.add_argument("--output", default="-", help="JSON lines output file (default: stdout)")
+        parser.add_argument("--log", default="log/batch.log", help="log file for batch workers (default: %(default)s)")
+        parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO", help="console log level of the sample run; DEBUG prints every fetched instruction (default: %(default)s)")
+        args = parser.parse_args(argv)
+
+        if (args.breakpoints or args.watch or args.conditions) and args.backend != "int":
+                parser.error("--break, --watch and --stop-when need the int backend")
+        return args
+
 def main():
-        init_log(logfile="log/assembly.log", quiet = True)
+        args = parse_args(sys.argv[1:])
+        if args.programs and args.emit:
+                emit(args)
+                return
+        if args.programs:
+                batch(args)
+                return
+
+        init_log(logfile="log/assembly.log", quiet = True, level="DEBUG")
 
         # Load test.asm for debugging
         program_text = get_asm_from_file("ref/test.asm")
@@ -27,7 +229,7 @@ def main():
         # Assemble test.asm to binary
         binary = assembler.assemble(program_text)
 
-        init_log(logfile="log/memory.log", quiet = False)
+        init_log(logfile="log/memory.log", quiet = False, level=args.log_level)
 
         # Create processor instance
         proc = processor()
@@ -35,20 +237,10 @@ def main():
         # Initialize memory file/registers (0s, then initial contents)
 
         # Data memory
-        data_mem = bitarray(256 * 8)
-        data_mem[0x0010 * 8:0x0010 * 8 + 16] = bitarray("0000_0001_0000_0001")
-        data_mem[0x0010 * 8 + 16:0x0010 * 8 + 32] = bitarray("0000_0001_0001_0000")
-        data_mem[0x0010 * 8 + 32:0x0010 * 8 + 48] = bitarray("0000_0000_0001_0001")
-        data_mem[0x0010 * 8 + 48:0x0010 * 8 + 64] = bitarray("0000_0000_1111_0000")
-        data_mem[0x0010 * 8 + 64:0x0010 * 8 + 80] = bitarray("0000_0000_1111_1111")
-
-        proc.data_memory = data_mem
+        proc.data_memory = default_data_memory()
 
         # Load binary to program memory
-        text_mem = bitarray(256 * 8)
-        text_mem[0:] = bitarray(binary)
-
-        proc.text_memory = text_mem
+        proc.load_text(pack_binary(binary))
 
         # Start simulator
         proc.start()
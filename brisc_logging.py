@@ -3,38 +3,189 @@ logging.py
 
 BRISC logging function file
 
+Messages below the configured level, INFO unless init_log() is given another, are dropped before
+any formatting is done. Pass format arguments after the text to defer formatting until the
+message is known to be written, and the level by keyword:
+        log("Cycle %d instruction = %s", cycle, ir, level="DEBUG")
+
+Log lines are buffered on a persistent file handle and flushed when the buffer fills, when
+flush_interval seconds have passed, on init_log()/close_log() and at exit. With background set,
+writes are handed to a writer thread instead.
+
 James Jenkins 2025
 '''
 
-import datetime
-import inspect
+import atexit
 import os
+import queue
+import sys
+import threading
+import time
+
+LOG_LEVELS = {
+        "DEBUG": 10,
+        "INFO": 20,
+        "WARNING": 30,
+        "ERROR": 40,
+}
+
+# Nothing is written until init_log() is called
+LOG_THRESHOLD = LOG_LEVELS["ERROR"] + 1
+DEFAULT_LOG_LEVEL = "INFO"
+ENABLE_QUIET_LOGGING = True
+WRITER = None
+
+class buffered_writer:
+        '''Persistent log file handle that writes in batches. Safe to share between threads.'''
+
+        def __init__(self, logfile, buffer_size, flush_interval):
+                self.file = open(logfile, "a")
+                self.buffer = []
+                self.buffered = 0
+                self.buffer_size = buffer_size
+                self.flush_interval = flush_interval
+                self.last_flush = time.monotonic()
+                self.lock = threading.Lock() # held while the buffer is changed or written out
+
+        def write(self, string):
+                with self.lock:
+                        self.buffer.append(string)
+                        self.buffered += len(string)
+
+                        if self.buffered >= self.buffer_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                                self._flush()
+
+        def flush(self):
+                with self.lock:
+                        self._flush()
+
+        def _flush(self):
+                if self.buffer:
+                        self.file.write("".join(self.buffer))
+                        self.file.flush()
+                        self.buffer.clear()
+                        self.buffered = 0
+                self.last_flush = time.monotonic()
+
+        def close(self):
+                with self.lock:
+                        self._flush()
+                        self.file.close()
+
+class background_writer:
+        '''Hands log lines to a daemon thread, which writes them through a buffered_writer.'''
+
+        def __init__(self, logfile, buffer_size, flush_interval):
+                self.writer = buffered_writer(logfile, buffer_size, flush_interval)
+                self.queue = queue.SimpleQueue()
+                self.thread = threading.Thread(target=self._run, name="brisc-log-writer", daemon=True)
+                self.thread.start()
+
+        def _run(self):
+                while True:
+                        try:
+                                string = self.queue.get(timeout=self.writer.flush_interval)
+                        except queue.Empty:
+                                self.writer.flush()
+                                continue
+
+                        if string is None:
+                                break
+
+                        # An empty string is a flush request
+                        if string:
+                                self.writer.write(string)
+                        else:
+                                self.writer.flush()
+
+                self.writer.close()
 
-def init_log(logfile="run.log", quiet=True, default_level="INFO"):
+        def write(self, string):
+                self.queue.put(string)
+
+        def flush(self):
+                self.queue.put("")
+
+        def close(self):
+                self.queue.put(None)
+                self.thread.join()
+
+def init_log(logfile="run.log", quiet=True, default_level="INFO", level="INFO", buffer_size=64 * 1024, flush_interval=1.0, background=False):
         global LOGFILE
         global ENABLE_QUIET_LOGGING
         global DEFAULT_LOG_LEVEL
+        global LOG_THRESHOLD
+        global WRITER
+
+        close_log()
 
         LOGFILE = logfile
         ENABLE_QUIET_LOGGING = quiet
         DEFAULT_LOG_LEVEL = default_level
+        LOG_THRESHOLD = LOG_LEVELS[level.upper()]
+
+        # Unbuffered console logging keeps file and console output in step
+        if not quiet:
+                buffer_size = 0
+
+        os.makedirs(os.path.dirname(logfile) or ".", exist_ok=True)
+
+        WRITER = (background_writer if background else buffered_writer)(logfile, buffer_size, flush_interval)
+
+def close_log():
+        '''Flushes and closes the current log file.'''
+        global WRITER
+
+        if WRITER is not None:
+                WRITER.close()
+                WRITER = None
+
+def flush_log():
+        '''Writes out any buffered log lines.'''
+        if WRITER is not None:
+                WRITER.flush()
+
+atexit.register(close_log)
+
+def log_enabled(level=None):
+        '''True if a message at level would be written. Guard expensive log arguments with this.'''
+        return LOG_LEVELS.get((level or DEFAULT_LOG_LEVEL).upper(), LOG_LEVELS["INFO"]) >= LOG_THRESHOLD
+
+# Timestamps only change once a second, so the formatted string is reused until then
+_timestamp_second = None
+_timestamp = ""
+
+def _get_timestamp():
+        global _timestamp_second
+        global _timestamp
+
+        now = time.time()
+        if int(now) != _timestamp_second:
+                _timestamp_second = int(now)
+                _timestamp = time.strftime(r"%Y-%m-%d %H:%M:%S", time.localtime(now))
+
+        return _timestamp
+
+def log(text, *args, level=None):
+        if level == None:
+                level = DEFAULT_LOG_LEVEL
+        else:
+                level = level.upper()
 
-def log(text, level=None):
-        with open (LOGFILE, "a") as logfile:
-                timestamp = datetime.datetime.now().strftime(r"%Y-%m-%d %H:%M:%S")
-                filename = os.path.basename(inspect.stack()[1].filename)
+        if LOG_LEVELS.get(level, LOG_LEVELS["INFO"]) < LOG_THRESHOLD or WRITER is None:
+                return
 
-                if level == None:
-                        level = DEFAULT_LOG_LEVEL
-                else:
-                        level = level.upper()
+        if args:
+                text = text % args
 
-                logstring = f"[{timestamp}] [{level}] [{filename}] {text}"
+        timestamp = _get_timestamp()
+        filename = os.path.basename(sys._getframe(1).f_code.co_filename)
 
-                logstring = logstring.replace("\n", "\n | -->\t") + "\n"
+        logstring = f"[{timestamp}] [{level}] [{filename}] {text}"
 
-                logfile.write(logstring)
+        logstring = logstring.replace("\n", "\n | -->\t") + "\n"
 
-                if not ENABLE_QUIET_LOGGING:
-                        print(logstring[:-1])
+        WRITER.write(logstring)
 
+        if not ENABLE_QUIET_LOGGING:
+                print(logstring[:-1])
@@ -0,0 +1,160 @@
+'''
+brisc_object.py
+
+BRISC packed object files. A program is stored as its raw big-endian instruction bytes, either
+bare or behind a header giving the entry point, the sections to load and a symbol table. Data
+memory images use the same format with a data section, and bare files load as raw images.
+Files are mapped with mmap and sections are handed out as memoryviews, which processors copy
+straight into their memory with load_text()/load_data()
+
+James Jenkins 2025
+'''
+
+from bitarray.util import int2ba
+
+import mmap
+import struct
+
+# File header: magic, version, entry point, section count, symbol count, reserved
+HEADER = struct.Struct("<4sHHHHI")
+MAGIC = b"BROB"
+VERSION = 1
+
+# Section table entry: name, load address, reserved, file offset, size in bytes
+SECTION = struct.Struct("<4sHHII")
+TEXT = b"text"
+DATA = b"data"
+
+# Symbol table entry: byte address, name length, followed by the UTF-8 name
+SYMBOL = struct.Struct("<HH")
+
+def pack_binary(binary_string):
+        '''Packs an assembler binary string ('0'/'1' characters) into bytes.'''
+        if not binary_string:
+                return b""
+        return int(binary_string, 2).to_bytes((len(binary_string) + 7) // 8, "big")
+
+def unpack_binary(image):
+        '''Unpacks bytes to a binary string, the inverse of pack_binary().'''
+        return "".join(format(byte, "08b") for byte in bytes(image))
+
+class object_file:
+        '''Loaded object: entry point, sections by name as (load address, memoryview) and symbols
+        by name. Keeps its file mapped until close().'''
+
+        def __init__(self, sections, entry=0, symbols=None, mapping=None):
+                self.sections = sections
+                self.entry = entry
+                self.symbols = symbols if symbols is not None else {}
+                self._mapping = mapping
+
+        @property
+        def text(self):
+                '''Text section bytes, empty if there is none.'''
+                return self.sections.get(TEXT, (0, memoryview(b"")))[1]
+
+        @property
+        def data(self):
+                '''Data section bytes, empty if there is none.'''
+                return self.sections.get(DATA, (0, memoryview(b"")))[1]
+
+        def load(self, p):
+                '''Copies the sections into processor p's memories and sets PC to the entry point.'''
+                if TEXT in self.sections:
+                        address, view = self.sections[TEXT]
+                        p.load_text(view, address)
+                self.load_data(p)
+                p.pc = int2ba(self.entry, 16)
+
+        def load_data(self, p):
+                '''Copies just the data section, if any, into processor p's data memory.'''
+                if DATA in self.sections:
+                        address, view = self.sections[DATA]
+                        p.load_data(view, address)
+
+        def close(self):
+                '''Releases the section views and unmaps the file. Views sliced from the sections must
+                be released first.'''
+                for _, view in self.sections.values():
+                        view.release()
+                self.sections = {}
+
+                if self._mapping is not None:
+                        self._mapping.close()
+                        self._mapping = None
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *exc_info):
+                self.close()
+
+def build_object(text=None, data=None, entry=0, symbols=None, text_address=0, data_address=0):
+        '''Builds object file bytes from a packed text image and/or a data image, plus symbols.'''
+        sections = []
+        if text is not None:
+                sections.append((TEXT, text_address, bytes(text)))
+        if data is not None:
+                sections.append((DATA, data_address, bytes(data)))
+        symbols = symbols or {}
+
+        encoded_symbols = b"".join(SYMBOL.pack(address & 0xFFFF, len(name.encode())) + name.encode() for name, address in symbols.items())
+        offset = HEADER.size + SECTION.size * len(sections) + len(encoded_symbols)
+
+        parts = [HEADER.pack(MAGIC, VERSION, entry, len(sections), len(symbols), 0)]
+        for name, address, image in sections:
+                parts.append(SECTION.pack(name, address, 0, offset, len(image)))
+                offset += len(image)
+        parts.append(encoded_symbols)
+        parts.extend(image for _, _, image in sections)
+
+        return b"".join(parts)
+
+def write_object(path, text=None, data=None, entry=0, symbols=None, text_address=0, data_address=0):
+        '''Writes an object file, see build_object().'''
+        with open(path, "wb") as file:
+                file.write(build_object(text, data, entry, symbols, text_address, data_address))
+
+def parse_object(buffer, default_section=TEXT, mapping=None):
+        '''Reads an object from a bytes-like buffer without copying its sections. A buffer without
+        the object header is a bare image of default_section at address 0.'''
+        view = memoryview(buffer)
+        if len(view) < HEADER.size or bytes(view[:4]) != MAGIC:
+                return object_file({default_section: (0, view)}, mapping=mapping)
+
+        magic, version, entry, num_sections, num_symbols, _ = HEADER.unpack_from(view)
+        if version != VERSION:
+                raise ValueError(f"Unsupported BRISC object version {version}")
+
+        sections = {}
+        offset = HEADER.size
+        for _ in range(num_sections):
+                name, address, _, start, size = SECTION.unpack_from(view, offset)
+                if start + size > len(view):
+                        raise ValueError(f"BRISC object section {name.decode()} runs past the end of the file")
+                sections[name] = (address, view[start:start + size])
+                offset += SECTION.size
+
+        symbols = {}
+        for _ in range(num_symbols):
+                address, length = SYMBOL.unpack_from(view, offset)
+                offset += SYMBOL.size
+                symbols[bytes(view[offset:offset + length]).decode()] = address
+                offset += length
+
+        return object_file(sections, entry, symbols, mapping)
+
+def read_object(path, default_section=TEXT):
+        '''Maps an object file, or a bare image of default_section, see parse_object().'''
+        with open(path, "rb") as file:
+                try:
+                        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                        # Empty files cannot be mapped
+                        return parse_object(b"", default_section)
+
+        return parse_object(mapping, default_section, mapping)
+
+def read_data_image(path):
+        '''Maps a data memory image: an object file's data section or a bare raw image.'''
+        return read_object(path, default_section=DATA)
@@ -0,0 +1,126 @@
+'''
+brisc_trace.py
+
+BRISC binary execution trace. A trace_recorder hook appends one fixed-width record per cycle to
+a preallocated memory-mapped file, or to an anonymous ring buffer, and read_trace() exposes a
+trace file as a NumPy structured array. source_lines() maps records back to program source lines
+
+James Jenkins 2025
+'''
+
+from simulator import _read16
+
+import mmap
+import struct
+
+import numpy as np
+
+# Record layout: cycle, PC of the instruction, IR, destination register (-1 for none), NZP after,
+# destination register value after, data memory address (-1 for none), data memory word at that
+# address after the instruction
+RECORD = struct.Struct("<QHHbBHiH")
+TRACE_DTYPE = np.dtype([
+        ("cycle", "<u8"),
+        ("pc", "<u2"),
+        ("ir", "<u2"),
+        ("dst", "i1"),
+        ("nzp", "u1"),
+        ("value", "<u2"),
+        ("address", "<i4"),
+        ("mem_value", "<u2"),
+])
+
+# File header: magic, version, record size, flags, capacity in records, records written
+HEADER = struct.Struct("<4sHHIQQ4x")
+MAGIC = b"BRTR"
+VERSION = 1
+FLAG_RING = 1
+
+class trace_recorder:
+        '''Processor hook recording one trace record per executed instruction.
+
+        Records go to a file of capacity records preallocated at path, or to anonymous memory if
+        path is None. When full, a ring recorder overwrites its oldest records and keeps the last
+        capacity; otherwise further records are counted in dropped and not stored.'''
+
+        def __init__(self, path=None, capacity=1 << 20, ring=False):
+                self.path = path
+                self.capacity = capacity
+                self.ring = ring
+                self.count = 0
+                self.dropped = 0
+
+                size = HEADER.size + capacity * RECORD.size
+                if path is None:
+                        self.file = None
+                        self.buffer = mmap.mmap(-1, size)
+                else:
+                        self.file = open(path, "w+b")
+                        self.file.truncate(size)
+                        self.buffer = mmap.mmap(self.file.fileno(), size)
+
+                self._write_header()
+
+        def _write_header(self):
+                HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, RECORD.size, FLAG_RING if self.ring else 0, self.capacity, self.count)
+
+        def after_step(self, p, pc, d, address):
+                index = self.count
+                if index >= self.capacity:
+                        if not self.ring:
+                                self.dropped += 1
+                                return
+                        index %= self.capacity
+
+                dst = d.rs if d.write_dst_reg or (d.opcode == 0b1010 and d.func == 0b101) else -1
+                RECORD.pack_into(self.buffer, HEADER.size + index * RECORD.size,
+                        p.cycle - 1, pc, d.word, dst, p._nzp,
+                        p._regs[dst] if dst >= 0 else 0,
+                        address, _read16(p._data, address) if address >= 0 else 0)
+                self.count += 1
+
+        def records(self):
+                '''Returns a copy of the recorded trace as a structured array, oldest record first.'''
+                self._write_header()
+                return _ordered(np.frombuffer(self.buffer, dtype=TRACE_DTYPE, count=min(self.count, self.capacity), offset=HEADER.size), self.count, self.capacity, self.ring).copy()
+
+        def close(self):
+                '''Writes the header and releases the mapping.'''
+                if self.buffer.closed:
+                        return
+
+                self._write_header()
+                self.buffer.flush()
+                self.buffer.close()
+                if self.file is not None:
+                        self.file.close()
+
+def _ordered(records, count, capacity, ring):
+        '''Rotates a wrapped ring buffer so the oldest record comes first.'''
+        if ring and count > capacity:
+                return np.roll(records, -(count % capacity))
+        return records
+
+def read_trace(path):
+        '''Maps a trace file written by trace_recorder as a structured array, oldest record first.
+        Unwrapped traces are mapped read-only without copying.'''
+        with open(path, "rb") as file:
+                magic, version, record_size, flags, capacity, count = HEADER.unpack(file.read(HEADER.size))
+
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                raise ValueError(f"{path} is not a version {VERSION} BRISC trace")
+
+        stored = min(count, capacity)
+        if stored == 0:
+                return np.zeros(0, dtype=TRACE_DTYPE)
+
+        records = np.memmap(path, dtype=TRACE_DTYPE, mode="r", offset=HEADER.size, shape=(stored,))
+        return _ordered(records, count, capacity, flags & FLAG_RING)
+
+def source_lines(records, sources):
+        '''Source line of each record's instruction, from an assemble() sources map, or 0 where the
+        PC has none.'''
+        lines = np.zeros(0x10000, dtype=np.uint32)
+        for pc, (line, _) in sources.items():
+                lines[pc] = line
+        return lines[records["pc"]]
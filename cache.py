@@ -0,0 +1,304 @@
+'''
+cache.py
+
+BRISC cache model. A cache_model hook follows the functional simulator and replays every
+instruction fetch through an instruction cache and every load and store through a data cache,
+each configurable in size, line size, associativity, replacement policy and write policy. It
+counts hits, misses, evictions and write-backs per run and per PC, and estimates the memory
+stall cycles they would cost. Run as a script to compare the memory behaviour of programs:
+        python cache.py program.asm --dcache-size 64 --associativity 1
+
+James Jenkins 2025
+'''
+
+from brisc_logging import init_log
+
+from array import array
+import argparse
+import random
+import sys
+
+from assembler import numbered_listing
+from brisc import add_program_arguments, get_asm_from_file, load_program_and_data
+from simulator import create_processor
+
+REPLACEMENT = ("lru", "fifo", "random")
+WRITE_POLICIES = ("write_back", "write_through")
+
+# Bytes accessed by each data memory instruction key, (opcode << 3) | func, and whether it is a
+# store. save and rest move all 8 registers
+_WORD, _REGISTERS = 2, 16
+_SIZES = [_WORD] * 128
+_STORES = [False] * 128
+for _func in range(8):
+        _SIZES[(0b1101 << 3) | _func] = _SIZES[(0b1110 << 3) | _func] = _REGISTERS
+        _STORES[(0b1011 << 3) | _func] = _STORES[(0b1101 << 3) | _func] = True
+_STORES[(0b1010 << 3) | 0b010] = True
+
+def _power_of_two(value):
+        return value > 0 and value & (value - 1) == 0
+
+class cache:
+        '''One cache of size bytes in line_size byte lines, associativity ways per set.
+
+        replacement picks the way evicted from a full set: least recently used, first in first
+        out, or random (seeded, so runs repeat). write_back caches allocate lines on a write miss
+        and write dirty lines back when evicted. write_through caches send every write to memory
+        and do not allocate on a write miss. Each line fill, write-back and write-through write is
+        estimated to stall for miss_penalty cycles; there is no write buffer.
+
+        hits and misses count accesses by the PC of the instruction making them.'''
+
+        def __init__(self, size=1024, line_size=8, associativity=2, replacement="lru", write_policy="write_back", miss_penalty=10):
+                if not (_power_of_two(size) and _power_of_two(line_size) and _power_of_two(associativity)):
+                        raise ValueError("Cache size, line size and associativity must be powers of two")
+                if line_size * associativity > size:
+                        raise ValueError(f"A {size} byte cache cannot hold {associativity} ways of {line_size} byte lines")
+                if replacement not in REPLACEMENT:
+                        raise ValueError(f"Unknown replacement policy {replacement}")
+                if write_policy not in WRITE_POLICIES:
+                        raise ValueError(f"Unknown write policy {write_policy}")
+
+                self.size = size
+                self.line_size = line_size
+                self.associativity = associativity
+                self.replacement = replacement
+                self.write_policy = write_policy
+                self.miss_penalty = miss_penalty
+
+                self.line_bits = line_size.bit_length() - 1
+                self.set_mask = size // (line_size * associativity) - 1
+
+                # Line numbers (address >> line_bits) held in each set. Most recently used first
+                # under lru, most recently filled first otherwise
+                self.sets = [[] for _ in range(self.set_mask + 1)]
+                self.dirty = set()
+                self._lru = replacement == "lru"
+                self._write_back = write_policy == "write_back"
+                self._random = random.Random(0)
+
+                self.accesses = 0
+                self.misses = 0
+                self.fills = 0
+                self.evictions = 0
+                self.writebacks = 0
+                self.memory_writes = 0
+                self.pc_accesses = array("I", bytes(4 * 0x10000))
+                self.pc_misses = array("I", bytes(4 * 0x10000))
+
+        @property
+        def hits(self):
+                return self.accesses - self.misses
+
+        @property
+        def hit_rate(self):
+                return self.hits / self.accesses if self.accesses else 0.0
+
+        @property
+        def stall_cycles(self):
+                '''Estimated cycles spent waiting on memory.'''
+                return (self.fills + self.writebacks + self.memory_writes) * self.miss_penalty
+
+        def access(self, address, num_bytes, pc, write=False):
+                '''Looks up every line the num_bytes at address touch, on behalf of the instruction
+                at pc. Returns the number of those lines that missed.'''
+                first = address >> self.line_bits
+                last = (address + num_bytes - 1) >> self.line_bits
+                missed = 0
+
+                for line in range(first, last + 1):
+                        self.accesses += 1
+                        self.pc_accesses[pc] += 1
+                        ways = self.sets[line & self.set_mask]
+
+                        # Most accesses hit the line used last, which needs no reordering
+                        if ways and ways[0] == line:
+                                hit = True
+                        elif line in ways:
+                                hit = True
+                                if self._lru:
+                                        ways.remove(line)
+                                        ways.insert(0, line)
+                        else:
+                                hit = False
+
+                        if not hit:
+                                self.misses += 1
+                                self.pc_misses[pc] += 1
+                                missed += 1
+                                # A write-through write miss goes to memory without filling the line
+                                if not write or self._write_back:
+                                        self._fill(ways, line)
+
+                        if write:
+                                if self._write_back:
+                                        self.dirty.add(line)
+                                else:
+                                        self.memory_writes += 1
+
+                return missed
+
+        def _fill(self, ways, line):
+                self.fills += 1
+                if len(ways) == self.associativity:
+                        victim = ways.pop(self._random.randrange(len(ways)) if self.replacement == "random" else -1)
+                        self.evictions += 1
+                        if victim in self.dirty:
+                                self.dirty.discard(victim)
+                                self.writebacks += 1
+                ways.insert(0, line)
+
+        def flush(self):
+                '''Writes back every dirty line, as at the end of a run, and empties the cache.'''
+                self.writebacks += len(self.dirty)
+                self.dirty.clear()
+                for ways in self.sets:
+                        ways.clear()
+
+        def stats(self):
+                return {
+                        "accesses": self.accesses,
+                        "hits": self.hits,
+                        "misses": self.misses,
+                        "fills": self.fills,
+                        "hit_rate": self.hit_rate,
+                        "evictions": self.evictions,
+                        "writebacks": self.writebacks,
+                        "memory_writes": self.memory_writes,
+                        "stall_cycles": self.stall_cycles,
+                }
+
+        def describe(self):
+                ways = "direct mapped" if self.associativity == 1 else f"{self.associativity}-way"
+                return f"{self.size} bytes, {self.line_size} byte lines, {ways}, {self.replacement}, {self.write_policy.replace("_", "-")}"
+
+        def worst_pcs(self, top=None):
+                '''(PC, accesses, misses) of the instructions missing most, worst first.'''
+                worst = sorted(((misses, pc) for pc, misses in enumerate(self.pc_misses) if misses), reverse=True)
+                return [(pc, self.pc_accesses[pc], misses) for misses, pc in worst[:top]]
+
+class cache_model:
+        '''Processor hook driving an instruction cache and a data cache. Attaches itself on
+        creation. Either cache may be None to leave that side uncached.'''
+
+        def __init__(self, p, icache=None, dcache=None):
+                self.p = p
+                self.icache = icache
+                self.dcache = dcache
+                self.instructions = 0
+
+                p.add_hook(self)
+
+        def detach(self):
+                '''Stops observing and releases the processor.'''
+                self.p.remove_hook(self)
+
+        def after_step(self, p, pc, d, address):
+                self.instructions += 1
+
+                icache = self.icache
+                if icache is not None:
+                        # Inline hit check for the common case of fetching from the line used last
+                        ways = icache.sets[(pc >> icache.line_bits) & icache.set_mask]
+                        if ways and ways[0] == pc >> icache.line_bits:
+                                icache.accesses += 1
+                                icache.pc_accesses[pc] += 1
+                        else:
+                                icache.access(pc, 2, pc)
+
+                dcache = self.dcache
+                if address >= 0 and dcache is not None:
+                        key = (d.opcode << 3) | d.func
+                        size = _SIZES[key]
+                        line = address >> dcache.line_bits
+                        ways = dcache.sets[line & dcache.set_mask]
+                        if ways and ways[0] == line and (address + size - 1) >> dcache.line_bits == line and not _STORES[key]:
+                                dcache.accesses += 1
+                                dcache.pc_accesses[pc] += 1
+                        else:
+                                dcache.access(address, size, pc, _STORES[key])
+
+        @property
+        def stall_cycles(self):
+                return sum(c.stall_cycles for c in (self.icache, self.dcache) if c is not None)
+
+        def finish(self):
+                '''Flushes dirty data lines so their write-backs are counted.'''
+                if self.dcache is not None:
+                        self.dcache.flush()
+
+        def stats(self):
+                return {
+                        "instructions": self.instructions,
+                        "stall_cycles": self.stall_cycles,
+                        "icache": self.icache.stats() if self.icache is not None else None,
+                        "dcache": self.dcache.stats() if self.dcache is not None else None,
+                }
+
+        def report(self, listing=None, top=10):
+                '''Plain text report. listing gives the source line of each instruction, by index, see numbered_listing().'''
+                lines = [
+                        f"{self.instructions} instructions, an estimated {self.stall_cycles} memory stall cycles "
+                        f"({(self.instructions + self.stall_cycles) / (self.instructions or 1):.3f} cycles per instruction)",
+                ]
+
+                for name, c in (("Instruction cache", self.icache), ("Data cache", self.dcache)):
+                        if c is None:
+                                continue
+                        lines += [
+                                "",
+                                f"{name}: {c.describe()}",
+                                f"  accesses {c.accesses:>12}",
+                                f"  hits     {c.hits:>12} {c.hit_rate:8.2%}",
+                                f"  misses   {c.misses:>12}",
+                                f"  filled   {c.fills:>12}",
+                                f"  evicted  {c.evictions:>12}",
+                                f"  written  {c.writebacks + c.memory_writes:>12}",
+                                f"  stalls   {c.stall_cycles:>12}",
+                                f"  Worst {top} PCs:",
+                        ]
+                        for pc, accesses, misses in c.worst_pcs(top):
+                                source = listing[pc // 2].strip() if listing is not None and pc % 2 == 0 and pc // 2 < len(listing) else ""
+                                lines.append(f"    0x{pc:04X} {misses:>10} misses / {accesses:<10}  {source}")
+
+                return "\n".join(lines)
+
+def parse_args(argv):
+        parser = argparse.ArgumentParser(description="Run a BRISC program through an instruction and data cache model")
+        add_program_arguments(parser, "instruction budget")
+        parser.add_argument("--icache-size", type=int, default=256, help="instruction cache bytes, 0 for none (default: %(default)s)")
+        parser.add_argument("--dcache-size", type=int, default=256, help="data cache bytes, 0 for none (default: %(default)s)")
+        parser.add_argument("--line-size", type=int, default=8, help="bytes per line (default: %(default)s)")
+        parser.add_argument("--associativity", type=int, default=2, help="ways per set, 1 for direct mapped (default: %(default)s)")
+        parser.add_argument("--replacement", choices=REPLACEMENT, default="lru", help="replacement policy (default: %(default)s)")
+        parser.add_argument("--write-policy", choices=WRITE_POLICIES, default="write_back", help="data cache write policy (default: %(default)s)")
+        parser.add_argument("--miss-penalty", type=int, default=10, help="stall cycles per line fill or memory write (default: %(default)s)")
+        parser.add_argument("--top", type=int, default=10, help="worst PCs to list per cache (default: %(default)s)")
+        return parser.parse_args(argv)
+
+def main():
+        args = parse_args(sys.argv[1:])
+        init_log(logfile="log/cache.log", quiet=True, level="INFO")
+
+        def build(size, write_policy="write_back"):
+                if not size:
+                        return None
+                try:
+                        return cache(size, args.line_size, args.associativity, args.replacement, write_policy, args.miss_penalty)
+                except ValueError as e:
+                        sys.exit(f"cache.py: {e}")
+
+        proc = create_processor("int", memory_size=args.memory_size)
+        model = cache_model(proc, build(args.icache_size), build(args.dcache_size, args.write_policy))
+
+        load_program_and_data(proc, args.program, args.data)
+
+        proc.start(max_cycles=args.max_cycles)
+        model.finish()
+
+        listing = numbered_listing(get_asm_from_file(args.program)) if args.program.endswith(".asm") else None
+        print(f"{args.program}: {"halted" if not proc.run else "stopped at the instruction budget"} after {proc.cycle} instructions")
+        print(model.report(listing, args.top))
+
+if __name__ == "__main__":
+        main()
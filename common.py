@@ -1,6 +1,12 @@
 from bitarray import bitarray
 from bitarray.util import ba2int, ba2hex
 
+from memory import paged_memory
+
+from array import array
+from functools import lru_cache
+import sys
+
 def int_to_bits(integer, length):
         '''Helper function to create a bit string of required length from an integer.'''
         if integer < 0:
@@ -25,41 +31,117 @@ def pretty_print_16(number):
 
         return string
 
-def format_memory(memory, columns):
-        '''Formats a large memory bitarray into an HTML table with 16-bits/cell and columns columns.'''
-        string = "<table><tr><th>Address:</th>"
-
-        for column in range(columns):
-                string += f"<th>+0x{format(column * 2, f"04x").upper()}</th>"
-
-        for i in range(0, len(memory), 16):
-                row_index = i % (columns * 16)
-                if row_index == 0:
-                        string += f"</tr><tr><th>0x{format(int(i / 8), f"04x").upper()}</th>"
-
-                value = memory[i:i + 16]
-                is_zero = value == bitarray(16)
-                string += f"<td>{"" if is_zero else "<b>"}{pretty_print_16(value)}{"" if is_zero else "</b>"}</td>"
-
-        string += "</tr></table>"
-
-        return string
+def format_memory_cell(value):
+        '''Formats a 16-bit bitarray or bit string as memory table cell contents, bold if nonzero.'''
+        is_zero = "1" not in (value if type(value) == str else value.to01())
+        return f"{"" if is_zero else "<b>"}{pretty_print_16(value)}{"" if is_zero else "</b>"}"
+
+# Cells repeat heavily (mostly zero words), so rendered cells are cached by word value
+@lru_cache(maxsize=4096)
+def format_memory_word(word):
+        '''Formats a 16-bit word as memory table cell contents, bold if nonzero.'''
+        return format_memory_cell(format(word, "016b"))
+
+@lru_cache(maxsize=4096)
+def _report_cells(word):
+        '''Hex and binary report table cells for a 16-bit word, bold if nonzero.'''
+        string = pretty_print_16(format(word, "016b"))
+        if word == 0:
+                return f"<td>{string[:6]}</td><td>{string[8:]}</td>"
+        return f"<td><b>{string[:6]}</b></td><td><b>{string[8:]}</b></td>"
+
+def memory_words(memory):
+        '''Converts a memory bitarray or bytes-like object to its big-endian 16-bit words in one pass.
+        A trailing partial word is left out.'''
+        data = memory.tobytes() if type(memory) == bitarray else bytes(memory)
+        num_words = len(memory) // 16 if type(memory) == bitarray else len(data) // 2
+
+        words = array("H", data[:num_words * 2])
+        if sys.byteorder == "little":
+                words.byteswap()
+
+        return words
+
+def _partial_word(memory, num_words):
+        '''Trailing bits of a memory that do not fill a 16-bit word, as a bitarray, or None.'''
+        if type(memory) == bitarray:
+                return memory[num_words * 16:] if len(memory) % 16 else None
+        if len(memory) % 2:
+                partial = bitarray()
+                partial.frombytes(bytes(memory[num_words * 2:]))
+                return partial
+        return None
+
+def _partial_cell(partial):
+        '''Memory table cell contents for a trailing partial word. Always bold, as a partial word never
+        compared equal to a zero 16-bit word.'''
+        return f"<b>{pretty_print_16(partial)}</b>"
+
+def format_memory(memory, columns, id_prefix=None):
+        '''Formats a large memory bitarray into an HTML table with 16-bits/cell and columns columns.
+        With id_prefix, each cell gets an id of id_prefix followed by its byte address. A paged_memory
+        only gets rows for its allocated pages, with a single row standing in for each run of
+        unallocated ones.'''
+        parts = ["<table><tr><th>Address:</th>"]
+        parts.extend(f"<th>+0x{format(column * 2, f"04x").upper()}</th>" for column in range(columns))
+
+        if type(memory) == paged_memory:
+                address = 0
+                for base, page in memory.allocated():
+                        if base > address:
+                                _format_unallocated_row(parts, address, base, columns)
+                        _format_memory_rows(parts, _cell_values(page), base, columns, id_prefix)
+                        address = base + len(page)
+
+                if address < len(memory):
+                        _format_unallocated_row(parts, address, len(memory), columns)
+        else:
+                _format_memory_rows(parts, _cell_values(memory), 0, columns, id_prefix)
+
+        parts.append("</tr></table>")
+
+        return "".join(parts)
+
+def _cell_values(memory):
+        '''A memory's words, followed by its trailing partial word if it has one.'''
+        words = memory_words(memory)
+        partial = _partial_word(memory, len(words))
+        return list(words) if partial is None else list(words) + [partial]
+
+def _format_memory_rows(parts, values, base, columns, id_prefix):
+        '''Appends table rows for words (ints, or a trailing partial bitarray) starting at byte address base.'''
+        for index, word in enumerate(values):
+                address = base + index * 2
+                if index % columns == 0:
+                        parts.append(f"</tr><tr><th>0x{format(address, f"04x").upper()}</th>")
+
+                cell_id = "" if id_prefix is None else f" id=\"{id_prefix}{address}\""
+                cell = format_memory_word(word) if type(word) == int else _partial_cell(word)
+                parts.append(f"<td{cell_id}>{cell}</td>")
+
+def _format_unallocated_row(parts, start, end, columns):
+        '''Appends the row standing in for unallocated memory from byte address start up to end.'''
+        parts.append(f"</tr><tr><th>0x{format(start, f"04x").upper()}</th>")
+        parts.append(f"<td colspan=\"{columns}\">0x{format(start, f"04x").upper()}-0x{format(end - 1, f"04x").upper()} unallocated, reads as 0x0000</td>")
 
 
 def format_memory_report(memory):
-        string = "<table><tr class=\"report_color\"><th>Address</th><th>Hex Value</th><th>Binary Value</th></tr>"
+        parts = ["<table><tr class=\"report_color\"><th>Address</th><th>Hex Value</th><th>Binary Value</th></tr>"]
 
-        for i in range(0, len(memory), 16):
-                string += f"<tr><th>0x{format(int(i / 8), f"04x").upper()}</th>"
+        words = memory_words(memory)
+        for index, word in enumerate(words):
+                parts.append(f"<tr><th>0x{format(index * 2, f"04x").upper()}</th>{_report_cells(word)}</tr>")
 
-                value = memory[i:i + 16]
-                is_zero = value == bitarray(16)
-                string += f"<td>{"" if is_zero else "<b>"}{pretty_print_16(value)[:6]}{"" if is_zero else "</b>"}</td><td>{"" if is_zero else "<b>"}{pretty_print_16(value)[8:]}{"" if is_zero else "</b>"}</td></tr>"
+        # Trailing partial word, formatted the slow way
+        partial = _partial_word(memory, len(words))
+        if partial is not None:
+                is_zero = partial == bitarray(16)
+                parts.append(f"<tr><th>0x{format(len(words) * 2, f"04x").upper()}</th>")
+                parts.append(f"<td>{"" if is_zero else "<b>"}{pretty_print_16(partial)[:6]}{"" if is_zero else "</b>"}</td><td>{"" if is_zero else "<b>"}{pretty_print_16(partial)[8:]}{"" if is_zero else "</b>"}</td></tr>")
 
+        parts.append("</table>")
 
-        string += "</table>"
-
-        return string
+        return "".join(parts)
 
 def format_registers_report(register_file):
         string = "<table><tr class=\"report_color\"><th>Register</th><th>Hex Value</th><th>Binary Value</th></tr>"
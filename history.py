@@ -0,0 +1,183 @@
+'''
+history.py
+
+BRISC time travel. A history hook keeps an undo journal of the last few thousand instructions'
+register/memory/PC/NZP writes, plus periodic checkpoints of the whole machine, so a processor can
+step back N cycles or go to any cycle since the history was attached
+
+James Jenkins 2025
+'''
+
+from memory import restore_memory, snapshot_memory
+
+from collections import deque
+import time
+
+# Cycles run between checks of goto()'s time budget
+BUDGET_CHECK_CYCLES = 4096
+
+class checkpoint:
+        '''Full copy of a fast_processor's architectural state. Paged data memory only copies its
+        allocated pages.'''
+        __slots__ = ("cycle", "regs", "pc", "ir", "nzp", "run", "data")
+
+        def __init__(self, p):
+                self.cycle = p.cycle
+                self.regs = tuple(p._regs)
+                self.pc = p._pc
+                self.ir = p._ir
+                self.nzp = p._nzp
+                self.run = p.run
+                self.data = snapshot_memory(p._data)
+
+        def restore(self, p):
+                p.cycle = self.cycle
+                p._regs[:] = self.regs
+                p._pc = self.pc
+                p._ir = self.ir
+                p._nzp = self.nzp
+                p.run = self.run
+                restore_memory(p._data, self.data)
+
+                if p.shared_memory:
+                        p.invalidate_all()
+
+class history:
+        '''Time travel for a fast_processor. Attaches itself as a hook on creation.
+
+        Going back within the last journal_limit cycles undoes journal entries directly. Going
+        further restores the nearest earlier checkpoint and replays forward. A checkpoint is taken
+        every checkpoint_interval cycles. When max_checkpoints is exceeded, every other checkpoint
+        is dropped and the interval doubles, so memory stays bounded on long runs at the cost of
+        longer replays.'''
+
+        def __init__(self, p, checkpoint_interval=1024, max_checkpoints=64, journal_limit=4096):
+                self.p = p
+                self.checkpoint_interval = checkpoint_interval
+                self.max_checkpoints = max_checkpoints
+
+                # Undo entries: (pc, ir, nzp, regs, run, memory address, old memory bytes)
+                self.journal = deque(maxlen=journal_limit)
+                self.checkpoints = [checkpoint(p)]
+                self._prev_ir = p._ir
+                self.reached = p.cycle # furthest cycle run, beyond which going forward is not a replay
+
+                p.add_hook(self)
+
+        def detach(self):
+                '''Stops recording and releases the processor.'''
+                self.p.remove_hook(self)
+
+        def attach(self):
+                '''Resumes recording after detach(). Call record() first if the processor ran meanwhile.'''
+                self.p.add_hook(self)
+
+        def record(self):
+                '''Checkpoints the processor's current state, e.g. before and after running it detached
+                so it can take its fast path. The journal cannot undo across such a run, so it is
+                cleared, and going back into the run replays it from the checkpoint before.'''
+                p = self.p
+                self.checkpoints = [saved for saved in self.checkpoints if saved.cycle < p.cycle]
+                self.journal.clear()
+                self._prev_ir = p._ir
+                self._add_checkpoint()
+
+        @property
+        def earliest_cycle(self):
+                '''Earliest cycle that can be returned to.'''
+                return self.checkpoints[0].cycle
+
+        def before_step(self, p, pc, d, address):
+                old = b""
+                if address >= 0 and (d.write_dst_mem or d.opcode == 0b1101):
+                        size = 16 if d.opcode == 0b1101 else 2
+                        old = bytes(p._data[address:address + size])
+
+                self.journal.append((pc, self._prev_ir, p._nzp, tuple(p._regs), p.run, address, old))
+
+        def after_step(self, p, pc, d, address):
+                self._prev_ir = d.word
+
+                if p.cycle - self.checkpoints[-1].cycle >= self.checkpoint_interval:
+                        self._add_checkpoint()
+
+        def _add_checkpoint(self):
+                self.checkpoints.append(checkpoint(self.p))
+
+                if len(self.checkpoints) > self.max_checkpoints:
+                        self.checkpoints = self.checkpoints[::2]
+                        self.checkpoint_interval *= 2
+
+        def _undo(self):
+                p = self.p
+                pc, ir, nzp, regs, run, address, old = self.journal.pop()
+
+                p._pc = pc
+                p._ir = ir
+                p._nzp = nzp
+                p._regs[:] = regs
+                p.run = run
+                p.cycle -= 1
+                self._prev_ir = ir
+
+                if old:
+                        p._data[address:address + len(old)] = old
+                        if p.shared_memory:
+                                p.invalidate_text(address, len(old))
+
+        def step_back(self, n=1):
+                '''Steps the processor back n cycles, stopping at earliest_cycle.'''
+                self.goto(max(self.p.cycle - n, self.earliest_cycle))
+
+        def goto(self, cycle, max_seconds=None):
+                '''Moves the processor to cycle. Going forward runs the processor, stopping early at halt,
+                or short of cycle once max_seconds have been spent running. Returns False if it stopped
+                short. Other hooks do not see cycles that are run again, so a dirty_tracker needs
+                mark_all() afterwards.'''
+                p = self.p
+                if cycle < self.earliest_cycle:
+                        raise ValueError(f"Cycle {cycle} is before the earliest recorded cycle {self.earliest_cycle}")
+                self.reached = max(self.reached, p.cycle)
+
+                # Recent past: undo journal entries
+                if p.cycle - len(self.journal) <= cycle < p.cycle:
+                        while p.cycle > cycle:
+                                self._undo()
+                        return True
+
+                # Further back: restore the nearest checkpoint and replay the gap
+                if cycle < p.cycle:
+                        while self.checkpoints[-1].cycle > cycle:
+                                self.checkpoints.pop()
+
+                        self.checkpoints[-1].restore(p)
+                        self.journal.clear()
+                        self._prev_ir = p._ir
+
+                deadline = None if max_seconds is None else time.monotonic() + max_seconds
+
+                # Replay cycles the other hooks have already seen with them suspended, so e.g. a
+                # profiler does not count them a second time
+                hooks = p._hooks
+                p._hooks = [self]
+                p._update_hooks()
+                try:
+                        replayed = self._run_to(min(cycle, self.reached), deadline)
+                finally:
+                        p._hooks = hooks
+                        p._update_hooks()
+
+                return replayed and self._run_to(cycle, deadline)
+
+        def _run_to(self, cycle, deadline):
+                '''Steps the processor up to cycle, or until halt. Returns False if deadline passed first.'''
+                p = self.p
+                while p.cycle < cycle and p.run:
+                        if deadline is not None and time.monotonic() >= deadline:
+                                return False
+
+                        limit = min(cycle, p.cycle + BUDGET_CHECK_CYCLES)
+                        while p.cycle < limit and p.run:
+                                p.step()
+
+                return True
@@ -0,0 +1,200 @@
+'''
+jit.py
+
+BRISC basic block translator. Straight-line runs of instructions ending at a branch, jmp, rst or
+hlt are translated to Python source, compiled once, and run as a single call by
+fast_processor.start()
+
+James Jenkins 2025
+'''
+
+from simulator import _NZP, _read16, _write16, _div, decode_word
+
+# Longest block translated in one piece, so runs of NOPs past the end of a program stay bounded
+MAX_BLOCK_LENGTH = 64
+
+# Expressions for inlined ALU ops, keyed by (opcode << 3) | func. a/b are the operand registers,
+# sa/sb the same read as two's complement, imm the sign-extended immediate and n the shift amount.
+# Division is left to its handler.
+_R_TYPE_EXPRESSIONS = {
+        0b0001000: "({a} + {b}) & 0xFFFF",
+        0b0001001: "({a} - {b}) & 0xFFFF",
+        0b0001010: "({sa} * {sb}) & 0xFFFF",
+        0b0001100: "-{a} & 0xFFFF",
+        0b0010000: "~{a} & 0xFFFF",
+        0b0010001: "{a} & {b}",
+        0b0010010: "{a} | {b}",
+        0b0010011: "{a} ^ {b}",
+        0b0010100: "~({a} | {b}) & 0xFFFF",
+}
+
+_I_TYPE_EXPRESSIONS = {
+        0b0011: "({a} + {imm}) & 0xFFFF",
+        0b0100: "({a} - {imm}) & 0xFFFF",
+        0b0101: "({sa} * {imm}) & 0xFFFF",
+        0b0111: "({a} << {n}) & 0xFFFF",
+        0b1000: "{a} >> {n}",
+        0b1001: "({sa} >> {n}) & 0xFFFF",
+}
+
+def _alu_expression(d):
+        '''Returns the Python expression for an ALU instruction, or None if it is not inlined.'''
+        if d.opcode in (0b0001, 0b0010):
+                if d.func >= 0b101:
+                        return "0"
+                template = _R_TYPE_EXPRESSIONS.get((d.opcode << 3) | d.func)
+                a, b = f"r[{d.rt}]", f"r[{d.rd}]"
+        else:
+                template = _I_TYPE_EXPRESSIONS.get(d.opcode)
+                a, b = f"r[{d.rs}]", ""
+
+        if template is None:
+                return None
+
+        return template.format(a=a, b=b, sa=f"(({a} ^ 0x8000) - 0x8000)", sb=f"(({b} ^ 0x8000) - 0x8000)", imm=d.imm, n=d.imm & 0x1FF)
+
+def is_terminator(d):
+        '''True for instructions that end a basic block: taken-able branches, jmp, rst and hlt.'''
+        if d.opcode == 0b0000:
+                return d.rs != 0
+        if d.opcode == 0b1111:
+                return True
+        return d.opcode == 0b1010 and d.func in (0b110, 0b111)
+
+def sets_nzp(d):
+        '''True for instructions that write the NZP register.'''
+        return 0b0001 <= d.opcode <= 0b1001 or (d.opcode == 0b1010 and d.func == 0b000)
+
+def find_block(text, start):
+        '''Returns the [(address, decoded_instruction)] making up the basic block at start.'''
+        block = []
+        address = start
+
+        while len(block) < MAX_BLOCK_LENGTH:
+                d = decode_word(_read16(text, address))
+                block.append((address, d))
+                address = (address + 2) & 0xFFFF
+
+                if is_terminator(d):
+                        break
+
+        return block
+
+def translate_block(p, start):
+        '''Translates the basic block at start into a compiled function, caches it on p and returns it.'''
+        block = find_block(p._text, start)
+        shared = p._data is p._text
+        last_nzp = max((i for i, (_, d) in enumerate(block) if sets_nzp(d)), default=-1)
+
+        namespace = {"NZP": _NZP, "read16": _read16, "write16": _write16, "div": _div}
+        lines = ["def block(p):", "r = p._regs", "data = p._data", "blocks = p._blocks"]
+
+        # Instructions already added to p.cycle, and whether p._nzp lags an inlined instruction.
+        # Both are brought up to date before each handler call, so a handler that raises leaves
+        # the same state the interpreter would
+        counted = 0
+        nzp_pending = False
+
+        for i, (address, d) in enumerate(block):
+                next_pc = (address + 2) & 0xFFFF
+                store_nzp = shared or i == last_nzp
+                expression = _alu_expression(d) if 0b0001 <= d.opcode <= 0b1001 else None
+
+                # Terminators close the block with PC, IR and cycle count updates
+                if is_terminator(d):
+                        lines.append(f"p._ir = {d.word}")
+                        lines.append(f"p.cycle += {i + 1 - counted}")
+                        if d.opcode == 0b0000:
+                                lines.append(f"p._pc = {(next_pc + d.imm) & 0xFFFF} if {d.rs} & p._nzp else {next_pc}")
+                        elif d.opcode == 0b1111:
+                                lines.append(f"p._pc = {(next_pc + d.jmp) & 0xFFFF}")
+                        elif d.func == 0b110:
+                                lines.append("p._pc = 0")
+                        else:
+                                lines.append(f"p._pc = {next_pc}")
+                                lines.append("p.run = False")
+                        break
+
+                # Inlined ALU, move and memory ops
+                if expression is not None:
+                        lines.append(f"v = {expression}")
+                        lines.append(f"r[{d.rs}] = v")
+                        if store_nzp:
+                                lines.append("p._nzp = NZP[v]")
+                        nzp_pending = not store_nzp
+                elif d.opcode == 0b0000:
+                        lines.append("pass")
+                elif d.opcode == 0b1010 and d.func == 0b000:
+                        lines.append(f"v = r[{d.rt}]")
+                        lines.append(f"r[{d.rs}] = v")
+                        if store_nzp:
+                                lines.append("p._nzp = NZP[v]")
+                        nzp_pending = not store_nzp
+                elif d.opcode == 0b1010 and d.func == 0b001:
+                        lines.append(f"r[{d.rs}] = read16(data, r[{d.rt}])")
+                elif d.opcode == 0b1010 and d.func == 0b010 and not shared:
+                        lines.append(f"write16(data, r[{d.rs}], r[{d.rt}])")
+                elif d.opcode == 0b1010 and d.func == 0b011:
+                        lines.append(f"r[{d.rs}] = 0")
+                elif d.opcode == 0b1010 and d.func == 0b100:
+                        lines.append(f"r[{d.rs}] = {next_pc}")
+                elif d.opcode == 0b1011 and not shared:
+                        lines.append(f"write16(data, r[{d.rs}], {d.imm & 0xFFFF})")
+                elif d.opcode == 0b1100:
+                        lines.append(f"r[{d.rs}] = {d.imm & 0xFFFF}")
+
+                # Everything else runs through the instruction handler with PC as fetch left it
+                else:
+                        namespace[f"d{i}"] = d
+                        namespace[f"h{i}"] = d.handler
+                        if nzp_pending:
+                                lines.append("p._nzp = NZP[v]")
+                                nzp_pending = False
+                        if i > counted:
+                                lines.append(f"p.cycle += {i - counted}")
+                                counted = i
+                        lines.append(f"p._ir = {d.word}")
+                        lines.append(f"p._pc = {next_pc}")
+                        lines.append(f"h{i}(p, d{i})")
+
+                        # A store may have rewritten this block, in which case leave before running stale code
+                        if shared and (d.write_dst_mem or d.opcode == 0b1101):
+                                lines.append(f"if {start} not in blocks:")
+                                lines.append(f"        p.cycle += {i + 1 - counted}")
+                                lines.append("        return")
+        else:
+                # Block hit the length limit without a terminator
+                lines.append(f"p._ir = {block[-1][1].word}")
+                lines.append(f"p.cycle += {len(block) - counted}")
+                lines.append(f"p._pc = {(block[-1][0] + 2) & 0xFFFF}")
+
+        source = "\n        ".join(lines)
+        exec(compile(source, f"<block 0x{start:04X}>", "exec"), namespace)
+
+        function = namespace["block"]
+        p._blocks[start] = function
+        for address, _ in block:
+                p._block_owners.setdefault(address, []).append(start)
+                p._block_owners.setdefault((address + 1) & 0xFFFF, []).append(start)
+
+        return function
+
+def run_blocks(p, limit=float("inf")):
+        '''Runs p until halt or until its cycle count reaches limit, dispatching translated blocks.'''
+        blocks = p._blocks
+        while p.run and p.cycle <= limit - MAX_BLOCK_LENGTH:
+                function = blocks.get(p._pc)
+                if function is None:
+                        function = translate_block(p, p._pc)
+                try:
+                        function(p)
+                except Exception:
+                        # Blocks keep PC, IR, NZP and the cycle count current before every handler
+                        # call, so this is the state the faulting instruction was fetched with. Run it
+                        # again through the interpreter, which raises with the interpreter's state
+                        p._pc = (p._pc - 2) & 0xFFFF
+                        p.step()
+
+        # Finish single stepping so the cycle limit is exact
+        while p.run and p.cycle < limit:
+                p.step()
@@ -0,0 +1,119 @@
+'''
+jobs.py
+
+BRISC background runs. A run_job steps a processor towards halt on a worker thread in short
+chunks, so the caller stays responsive, and stops early when its cycle or time budget runs out
+or it is cancelled
+
+James Jenkins 2025
+'''
+
+from brisc_logging import log
+
+import threading
+import time
+
+class run_job:
+        '''Runs processor p until halt on a background thread. Starts on creation.
+
+        The job runs at most max_cycles cycles and max_seconds seconds, chunk_cycles cycles at a
+        time. Each chunk holds lock, if given, so other threads can read a consistent processor
+        state between chunks. status is "running" until the job ends as "halted", "budget"
+        (stopped by either budget, the processor can be run again), "stopped" (at one of the
+        processor's stops, see breakpoints.py, with reason saying which), "cancelled" or "error".
+        on_done, if given, is called with the job on its thread when it ends.'''
+
+        def __init__(self, p, max_cycles=10_000_000, max_seconds=30.0, chunk_cycles=16384, lock=None, on_done=None):
+                self.p = p
+                self.max_cycles = max_cycles
+                self.max_seconds = max_seconds
+                self.chunk_cycles = chunk_cycles
+                self.lock = lock if lock is not None else threading.Lock()
+                self.on_done = on_done
+
+                self.status = "running"
+                self.error = ""
+                self.reason = ""
+                self.start_cycle = p.cycle
+                self.cycle = p.cycle
+                self.started = time.monotonic()
+                self.elapsed = 0.0
+
+                # A run started at a breakpoint steps over it
+                if getattr(p, "stops", None) is not None:
+                        p.stops.resume(p)
+
+                self._cancel = threading.Event()
+                self._done = threading.Event()
+                self.thread = threading.Thread(target=self._run, name="brisc-run-job", daemon=True)
+                self.thread.start()
+
+        @property
+        def running(self):
+                return not self._done.is_set()
+
+        @property
+        def ips(self):
+                '''Instructions per second so far.'''
+                return (self.cycle - self.start_cycle) / self.elapsed if self.elapsed > 0 else 0.0
+
+        def cancel(self):
+                '''Asks the job to stop after its current chunk.'''
+                self._cancel.set()
+
+        def wait(self, timeout=None):
+                '''Waits for the job to end. Returns True if it has.'''
+                return self._done.wait(timeout)
+
+        def progress(self):
+                '''JSON-ready summary of the job.'''
+                return {
+                        "status": self.status,
+                        "cycle": self.cycle,
+                        "cycles": self.cycle - self.start_cycle,
+                        "elapsed": round(self.elapsed, 3),
+                        "ips": round(self.ips),
+                        "error": self.error,
+                        "reason": self.reason,
+                }
+
+        def _run(self):
+                p = self.p
+                limit = self.start_cycle + self.max_cycles
+
+                try:
+                        while True:
+                                if self._cancel.is_set():
+                                        self.status = "cancelled"
+                                        break
+
+                                with self.lock:
+                                        p.start(min(p.cycle + self.chunk_cycles, limit))
+                                        self.cycle = p.cycle
+                                self.elapsed = time.monotonic() - self.started
+
+                                if not p.run:
+                                        self.status = "halted"
+                                        break
+                                if getattr(p, "stops", None) is not None and p.stops.hit:
+                                        self.status = "stopped"
+                                        self.reason = p.stops.hit
+                                        break
+                                if p.cycle >= limit or self.elapsed >= self.max_seconds:
+                                        self.status = "budget"
+                                        break
+
+                except Exception as err:
+                        self.status = "error"
+                        self.error = str(err)
+                        log(f"Run job failed at cycle {p.cycle}: {err}", level="ERROR")
+
+                finally:
+                        self.elapsed = time.monotonic() - self.started
+                        log("Run job %s after %d cycles in %.3f s", self.status, self.cycle - self.start_cycle, self.elapsed, level="INFO")
+                        if self.on_done is not None:
+                                try:
+                                        self.on_done(self)
+                                except Exception as err:
+                                        log(f"Run job completion callback failed: {err}", level="ERROR")
+                        self._done.set()
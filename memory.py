@@ -0,0 +1,235 @@
+'''
+memory.py
+
+BRISC sparse memory. Memories can be configured up to the full 16-bit address space. Anything
+larger than a page is split into fixed-size pages that are only allocated when a nonzero byte is
+written to them, so untouched pages read as zero and cost nothing to snapshot, render or diff.
+Pages can be shared copy-on-write between snapshots and forked memories
+
+James Jenkins 2025
+'''
+
+# Largest memory a 16-bit address can reach
+ADDRESS_SPACE = 0x10000
+
+# Memory size processors get unless configured otherwise
+DEFAULT_MEMORY_SIZE = 256
+
+# Page size in bytes, and the shift/mask splitting an address into page number and offset
+PAGE_BITS = 8
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+_ZERO_PAGE = memoryview(bytes(PAGE_SIZE))
+
+class paged_memory:
+        '''Byte-addressed memory of size bytes held as sparse PAGE_SIZE pages.
+
+        Supports the bytearray operations the simulator uses: len(), bytes(), int indexing and
+        contiguous slices, which read and write across pages. Slices are clamped to the memory
+        like bytearray slices, but assignments must keep their length. Writing zeros to a page
+        that has not been allocated leaves it unallocated.
+
+        A page is either a bytearray owned by this memory or an immutable bytes object that may be
+        shared with snapshots and forks, which is copied to a bytearray on its first write.'''
+        __slots__ = ("size", "pages")
+
+        def __init__(self, size=ADDRESS_SPACE, image=b""):
+                if not 0 <= size <= ADDRESS_SPACE:
+                        raise ValueError(f"Memory size {size} is outside the 16-bit address space")
+
+                self.size = size
+
+                # Page number -> bytearray, allocated on first nonzero write
+                self.pages = {}
+
+                if len(image):
+                        self[0:len(image)] = image
+
+        def __len__(self):
+                return self.size
+
+        def __bytes__(self):
+                return bytes(self[0:self.size])
+
+        def tobytes(self):
+                return bytes(self)
+
+        def __getitem__(self, key):
+                if type(key) is int:
+                        page = self.pages.get(key >> PAGE_BITS)
+                        if page is not None:
+                                return page[key & PAGE_MASK]
+                        if 0 <= key < self.size:
+                                return 0
+                        raise IndexError("paged_memory index out of range")
+
+                start, stop = self._bounds(key)
+                result = bytearray(stop - start)
+                for number, offset, position, length in self._spans(start, stop):
+                        page = self.pages.get(number)
+                        if page is not None:
+                                result[position:position + length] = page[offset:offset + length]
+
+                return result
+
+        def __setitem__(self, key, value):
+                if type(key) is int:
+                        page = self.pages.get(key >> PAGE_BITS)
+                        if type(page) is not bytearray:
+                                if page is not None:
+                                        page = self._thaw(key >> PAGE_BITS)
+                                else:
+                                        if not 0 <= key < self.size:
+                                                raise IndexError("paged_memory index out of range")
+                                        if not value:
+                                                return
+                                        page = self._allocate(key >> PAGE_BITS)
+
+                        page[key & PAGE_MASK] = value
+                        return
+
+                start, stop = self._bounds(key)
+                value = memoryview(value).cast("B")
+                if len(value) != stop - start:
+                        raise ValueError("paged_memory slice assignment cannot change the memory size")
+
+                for number, offset, position, length in self._spans(start, stop):
+                        chunk = value[position:position + length]
+                        page = self.pages.get(number)
+                        if page is None:
+                                if chunk == _ZERO_PAGE[:length]:
+                                        continue
+                                page = self._allocate(number)
+                        elif type(page) is not bytearray:
+                                page = self._thaw(number)
+
+                        page[offset:offset + length] = chunk
+
+        def read16(self, address):
+                '''Reads a big-endian 16-bit word at byte address with one page lookup. Bytes past the
+                end read as zero, like simulator._read16().'''
+                page = self.pages.get(address >> PAGE_BITS)
+                offset = address & PAGE_MASK
+                if page is not None and offset + 1 < len(page):
+                        return page[offset] << 8 | page[offset + 1]
+
+                # Unallocated page, or a word straddling two pages or the end of memory
+                high = self[address] if address < self.size else 0
+                low = self[address + 1] if address + 1 < self.size else 0
+                return high << 8 | low
+
+        def write16(self, address, value):
+                '''Writes a big-endian 16-bit word at byte address with one page lookup. Bytes past the
+                end are dropped, like simulator._write16().'''
+                page = self.pages.get(address >> PAGE_BITS)
+                offset = address & PAGE_MASK
+                if type(page) is bytearray and offset + 1 < len(page):
+                        page[offset] = value >> 8
+                        page[offset + 1] = value & 0xFF
+                        return
+
+                if address < self.size:
+                        self[address] = value >> 8
+                if address + 1 < self.size:
+                        self[address + 1] = value & 0xFF
+
+        def _bounds(self, key):
+                start, stop, step = key.indices(self.size)
+                if step != 1:
+                        raise ValueError("paged_memory slices must be contiguous")
+                return start, max(stop, start)
+
+        def _spans(self, start, stop):
+                '''Splits [start, stop) into (page number, offset in page, offset from start, length) pieces.'''
+                address = start
+                while address < stop:
+                        offset = address & PAGE_MASK
+                        length = min(PAGE_SIZE - offset, stop - address)
+                        yield address >> PAGE_BITS, offset, address - start, length
+                        address += length
+
+        def _allocate(self, number):
+                # The last page stops at the end of memory
+                page = self.pages[number] = bytearray(min(PAGE_SIZE, self.size - (number << PAGE_BITS)))
+                return page
+
+        def _thaw(self, number):
+                # Copy a shared page before writing to it
+                page = self.pages[number] = bytearray(self.pages[number])
+                return page
+
+        def allocated(self):
+                '''Yields (base address, page) for each allocated page, lowest address first.'''
+                for number in sorted(self.pages):
+                        yield number << PAGE_BITS, self.pages[number]
+
+        def snapshot(self):
+                '''Immutable copy of the allocated pages, see restore(). Pages shared already are not
+                copied again.'''
+                return {number: bytes(page) for number, page in self.pages.items()}
+
+        def restore(self, snapshot):
+                '''Returns memory to a snapshot() taken from a memory of the same size. The snapshot's
+                pages are shared until written.'''
+                self.pages = dict(snapshot)
+
+        def fork(self):
+                '''Copy of this memory sharing every page copy-on-write with it. The first fork
+                freezes this memory's pages, and later ones only copy the page table.'''
+                for number, page in self.pages.items():
+                        if type(page) is bytearray:
+                                self.pages[number] = bytes(page)
+
+                memory = paged_memory(self.size)
+                memory.pages = dict(self.pages)
+                return memory
+
+def create_memory(size=DEFAULT_MEMORY_SIZE, image=b""):
+        '''Creates a memory of size bytes holding image. Memories that fit in one page gain nothing
+        from paging and stay plain bytearrays.'''
+        if not 0 <= size <= ADDRESS_SPACE:
+                raise ValueError(f"Memory size {size} is outside the 16-bit address space")
+
+        if size <= PAGE_SIZE:
+                memory = bytearray(size)
+                image = memoryview(image)[:size]
+                memory[:len(image)] = image
+                return memory
+
+        return paged_memory(size, memoryview(image)[:size])
+
+def memory_pages(memory):
+        '''Yields (base address, bytes) for the parts of a memory that can hold nonzero bytes: the
+        allocated pages of a paged_memory, or every page of a bytes-like memory.'''
+        if type(memory) is paged_memory:
+                yield from memory.allocated()
+                return
+
+        for base in range(0, len(memory), PAGE_SIZE):
+                yield base, memory[base:base + PAGE_SIZE]
+
+def fork_memory(memory):
+        '''Copy of a memory, shared copy-on-write where it is paged.'''
+        if type(memory) is paged_memory:
+                return memory.fork()
+        return bytearray(memory)
+
+def allocated_bytes(memory):
+        '''Bytes of storage a memory actually holds.'''
+        if type(memory) is paged_memory:
+                return sum(len(page) for page in memory.pages.values())
+        return len(memory)
+
+def snapshot_memory(memory):
+        '''Immutable copy of a memory, costing only its allocated pages.'''
+        if type(memory) is paged_memory:
+                return memory.snapshot()
+        return bytes(memory)
+
+def restore_memory(memory, snapshot):
+        '''Returns a memory to a snapshot_memory() taken from it.'''
+        if type(memory) is paged_memory:
+                memory.restore(snapshot)
+        else:
+                memory[:] = snapshot
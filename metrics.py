@@ -0,0 +1,231 @@
+'''
+metrics.py
+
+BRISC app instrumentation. Counters and histograms are kept per thread, so recording a value
+takes no lock, and are only added up when scraped, in the Prometheus text format. Each request
+can also collect the time spent in each phase (assemble, simulate, render) for a Server-Timing
+header.
+
+James Jenkins 2025
+'''
+
+from bisect import bisect_left
+import math
+import os
+import sys
+import threading
+import time
+
+try:
+        import resource
+except ImportError: # not on Windows
+        resource = None
+
+# Histogram bucket upper bounds, in seconds for durations
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+INSTRUCTION_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# Threads' shards are folded into the retired totals once this many are held, or when scraped
+MAX_SHARDS = 64
+
+class _shard:
+        '''One thread's values: by (metric name, labels), a [count] for counters, or bucket counts
+        followed by the sum for histograms.'''
+        __slots__ = ("thread", "values", "phases")
+
+        def __init__(self):
+                self.thread = threading.current_thread()
+                self.values = {}
+                self.phases = None # phase -> seconds, during a request
+
+class registry:
+        '''A set of counters and histograms, declared with counter() and histogram() and recorded
+        with add() and observe(). Gauges are callables returning a value, or a dict of values by
+        label values, read when rendered.'''
+
+        def __init__(self, enabled=True):
+                self.enabled = enabled # when False, nothing is recorded
+                self.metrics = {} # name -> (type, help, label names, bucket bounds)
+                self.gauges = {} # name -> (help, label names, callable)
+
+                self._local = threading.local()
+                self._shards = []
+                self._retired = {}
+                self._lock = threading.Lock() # held to add, fold or read shards, never to record
+
+        def counter(self, name, help, labels=()):
+                self.metrics[name] = ("counter", help, labels, None)
+
+        def histogram(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+                self.metrics[name] = ("histogram", help, labels, buckets)
+
+        def gauge(self, name, help, read, labels=()):
+                self.gauges[name] = (help, labels, read)
+
+        def _shard(self):
+                shard = getattr(self._local, "shard", None)
+                if shard is None:
+                        shard = self._local.shard = _shard()
+                        with self._lock:
+                                self._shards.append(shard)
+                                if len(self._shards) > MAX_SHARDS:
+                                        self._fold_finished()
+                return shard
+
+        def add(self, name, amount=1, labels=()):
+                '''Adds amount to a counter.'''
+                if not self.enabled:
+                        return
+                values = self._shard().values
+                key = (name, labels)
+                slot = values.get(key)
+                if slot is None:
+                        slot = values[key] = [0]
+                slot[0] += amount
+
+        def observe(self, name, value, labels=()):
+                '''Records value in a histogram.'''
+                if not self.enabled:
+                        return
+                values = self._shard().values
+                key = (name, labels)
+                slot = values.get(key)
+                buckets = self.metrics[name][3]
+                if slot is None:
+                        slot = values[key] = [0] * (len(buckets) + 2)
+                slot[bisect_left(buckets, value)] += 1
+                slot[-1] += value
+
+        # Request phases. A request is handled on one thread, so its phases live in that thread's shard
+
+        def begin_request(self):
+                self._shard().phases = {}
+
+        def end_request(self):
+                '''Ends the thread's request and returns its seconds per phase.'''
+                shard = self._shard()
+                phases, shard.phases = shard.phases, None
+                return phases or {}
+
+        def timed(self, name, metric=None, labels=()):
+                '''Context manager timing a phase of the current request, and recording it in the
+                metric histogram if given. Its seconds are set when it exits.'''
+                return _timer(self, name, metric, labels)
+
+        def _add_phase(self, name, seconds):
+                phases = self._shard().phases
+                if phases is not None:
+                        phases[name] = phases.get(name, 0.0) + seconds
+
+        # Reading
+
+        def _fold_finished(self):
+                '''Moves the values of shards whose thread has ended into the retired totals. Their
+                thread can no longer write them, so no lock is needed against it.'''
+                live = []
+                for shard in self._shards:
+                        if shard.thread.is_alive():
+                                live.append(shard)
+                        else:
+                                _merge(self._retired, shard.values)
+                self._shards = live
+
+        def totals(self):
+                '''Every metric's values summed over all threads, by (name, labels).'''
+                with self._lock:
+                        self._fold_finished()
+                        totals = {key: list(slot) for key, slot in self._retired.items()}
+                        for shard in self._shards:
+                                # Live threads may add keys while this copies them
+                                _merge(totals, dict(shard.values))
+                return totals
+
+        def render(self):
+                '''All metrics in the Prometheus text exposition format.'''
+                totals = self.totals()
+                lines = []
+
+                for name, (kind, help, label_names, buckets) in self.metrics.items():
+                        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                        for (metric, labels), slot in sorted((item for item in totals.items() if item[0][0] == name), key=lambda item: item[0][1]):
+                                base = list(zip(label_names, labels))
+                                if kind == "counter":
+                                        lines.append(f"{name}{_labels(base)} {_number(slot[0])}")
+                                        continue
+
+                                cumulative = 0
+                                for bound, count in zip(buckets + (math.inf,), slot):
+                                        cumulative += count
+                                        lines.append(f"{name}_bucket{_labels(base + [("le", _number(bound))])} {cumulative}")
+                                lines.append(f"{name}_sum{_labels(base)} {_number(slot[-1])}")
+                                lines.append(f"{name}_count{_labels(base)} {cumulative}")
+
+                for name, (help, label_names, read) in self.gauges.items():
+                        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+                        value = read()
+                        if isinstance(value, dict):
+                                for labels, item in sorted(value.items()):
+                                        lines.append(f"{name}{_labels(list(zip(label_names, labels)))} {_number(item)}")
+                        else:
+                                lines.append(f"{name} {_number(value)}")
+
+                return "\n".join(lines) + "\n"
+
+class _timer:
+        __slots__ = ("registry", "name", "metric", "labels", "started", "seconds")
+
+        def __init__(self, registry, name, metric, labels):
+                self.registry = registry
+                self.name = name
+                self.metric = metric
+                self.labels = labels
+
+        def __enter__(self):
+                self.started = time.perf_counter()
+                return self
+
+        def __exit__(self, *exc):
+                self.seconds = seconds = time.perf_counter() - self.started
+                self.registry._add_phase(self.name, seconds)
+                if self.metric is not None:
+                        self.registry.observe(self.metric, seconds, self.labels)
+                return False
+
+def _merge(totals, values):
+        for key, slot in values.items():
+                total = totals.get(key)
+                if total is None:
+                        totals[key] = list(slot)
+                else:
+                        for i, value in enumerate(slot):
+                                total[i] += value
+
+def _labels(pairs):
+        if not pairs:
+                return ""
+        escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f"{name}=\"{value}\"" for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _number(value):
+        if value == math.inf:
+                return "+Inf"
+        if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+                return str(int(value))
+        return repr(value) if isinstance(value, float) else str(value)
+
+def server_timing(phases, total):
+        '''Server-Timing header value for a request's phases and total, in milliseconds.'''
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in [*phases.items(), ("total", total)])
+
+def resident_bytes():
+        '''Resident memory of this process, or its peak where the current size cannot be read, or 0.'''
+        try:
+                with open("/proc/self/statm") as file:
+                        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+                pass
+
+        if resource is None:
+                return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
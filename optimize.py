@@ -0,0 +1,93 @@
+'''
+optimize.py
+
+BRISC peephole optimization report. Assembles a program with and without the assembler's
+peephole pass (see optimize_table() in assembler.py), lists each rewrite, and reports the
+instructions saved: statically, as estimated from a profile of the original program, and as
+measured by running both. Run as a script:
+        python optimize.py program.asm --data images/input.bin
+
+James Jenkins 2025
+'''
+
+from brisc_logging import init_log
+
+import argparse
+import sys
+
+from assembler import assemble
+from brisc import DEFAULT_DATA_IMAGE, get_asm_from_file, memory_size
+from brisc_object import pack_binary, read_data_image
+from memory import DEFAULT_MEMORY_SIZE
+from profiler import profiler
+from simulator import create_processor
+
+def estimate_dynamic_savings(report, prof):
+        '''Instructions the optimized program is estimated to save, from a profiler run of the
+        original: every execution of a removed instruction, and every taken branch or jump that
+        a thread sends past jumps that are still there.'''
+        removed = set(report["removed"])
+        saved = sum(prof.pc_counts[2 * line] for line in removed)
+
+        for line, skipped in report["threaded"].items():
+                hops = sum(1 for jump in skipped if jump not in removed)
+                pc = 2 * line
+                # Conditional branches only skip the jumps when taken, jumps always do
+                taken = prof.taken[pc] if prof.taken[pc] or prof.not_taken[pc] else prof.pc_counts[pc]
+                saved += taken * hops
+
+        return saved
+
+def format_report(report, sources=None):
+        '''Plain text list of the rewrites in an optimize_table() report, by original PC and source
+        line from assemble()'s sources, and the static saving.'''
+        sources = sources or {}
+        lines = [f"{report["before"]} instructions -> {report["after"]} ({report["before"] - report["after"]} saved)"]
+        for kind, line, before, after in report["rewrites"]:
+                source = f"line {sources[2 * line][0]}" if 2 * line in sources else ""
+                lines.append(f"  0x{2 * line:04X} {source:>9}  {kind:<10} {before}{f"  ->  {after}" if after else ""}")
+        return "\n".join(lines)
+
+def _run(binary, args):
+        proc = create_processor("int", memory_size=args.memory_size)
+        proc.load_text(pack_binary(binary))
+        with read_data_image(args.data or DEFAULT_DATA_IMAGE) as image:
+                image.load_data(proc)
+        return proc
+
+def parse_args(argv):
+        parser = argparse.ArgumentParser(description="Report what the assembler's peephole optimizer saves on a BRISC program")
+        parser.add_argument("program", help=".asm file")
+        parser.add_argument("--data", help="data memory image (default: ref/test_data.bo)")
+        parser.add_argument("--max-cycles", type=int, default=10_000_000, help="cycle budget for each run (default: %(default)s)")
+        parser.add_argument("--memory-size", type=memory_size, default=DEFAULT_MEMORY_SIZE, help="bytes of data and text memory, up to 0x10000 (default: %(default)s)")
+        return parser.parse_args(argv)
+
+def main():
+        args = parse_args(sys.argv[1:])
+        init_log(logfile="log/optimize.log", quiet=True, level="INFO")
+
+        program_text = get_asm_from_file(args.program)
+        report = {}
+        sources = {}
+        binary = assemble(program_text, translation_file=None, sources=sources)
+        optimized = assemble(program_text, translation_file=None, optimize=True, report=report)
+
+        # Profile the original for the estimate, then run the optimized program to measure
+        original = _run(binary, args)
+        prof = profiler(original)
+        original.start(max_cycles=args.max_cycles)
+        prof.detach()
+        rewritten = _run(optimized, args)
+        rewritten.start(max_cycles=args.max_cycles)
+
+        print(f"{args.program}: {format_report(report, sources)}")
+        print(f"Estimated dynamic saving: {estimate_dynamic_savings(report, prof)} of {original.cycle} instructions")
+        if original.run or rewritten.run:
+                print("Measured dynamic saving: not measured, a run reached the cycle budget")
+        else:
+                same = original._regs == rewritten._regs and bytes(original._data) == bytes(rewritten._data)
+                print(f"Measured dynamic saving: {original.cycle - rewritten.cycle} ({original.cycle} -> {rewritten.cycle} instructions, {"same" if same else "DIFFERENT"} final registers and data memory)")
+
+if __name__ == "__main__":
+        main()
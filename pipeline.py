@@ -0,0 +1,328 @@
+'''
+pipeline.py
+
+BRISC pipeline timing model. A pipeline_model hook follows the functional simulator instruction
+by instruction and works out when each one would pass through a classic in-order 5-stage
+pipeline (IF, ID, EX, MEM, WB), accounting for RAW hazards, the forwarding paths available,
+multi-cycle multiply/divide and branch prediction. It only observes, so architectural results
+are exactly those of the functional model. Run as a script to time a program:
+        python pipeline.py program.asm --forwarding ex --predictor bimodal
+
+James Jenkins 2025
+'''
+
+from brisc_logging import init_log
+
+import argparse
+import sys
+
+from brisc import add_program_arguments, load_program_and_data
+from simulator import create_processor
+
+# Forwarding paths: EX/MEM latch to EX, and MEM/WB latch to EX. Without a path, a dependent
+# instruction reads the register file in ID once the producer has reached WB (written in the
+# first half of the cycle, read in the second).
+FORWARDING = {
+        "full": ("ex_ex", "mem_ex"),
+        "ex": ("ex_ex",),
+        "mem": ("mem_ex",),
+        "none": (),
+}
+
+# NZP is renamed as register 8 for hazard tracking, since branches depend on it
+NZP = 8
+
+# Control transfer kinds
+_NONE, _BRANCH, _JUMP = range(3)
+
+# Stall kinds, in report order
+STALLS = ("load_use", "data", "structural", "control")
+
+class static_predictor:
+        '''Always predicts taken, or always not taken.'''
+
+        def __init__(self, taken=False):
+                self.taken = taken
+
+        def predict(self, pc, target):
+                return self.taken
+
+        def update(self, pc, taken):
+                pass
+
+class btfn_predictor:
+        '''Backward taken, forward not taken.'''
+
+        def predict(self, pc, target):
+                return target <= pc
+
+        def update(self, pc, taken):
+                pass
+
+class bimodal_predictor:
+        '''Table of 2-bit saturating counters indexed by PC, starting weakly not taken.'''
+
+        def __init__(self, entries=256):
+                self.mask = entries - 1
+                self.counters = bytearray([1]) * entries
+
+        def predict(self, pc, target):
+                return self.counters[(pc >> 1) & self.mask] >= 2
+
+        def update(self, pc, taken):
+                index = (pc >> 1) & self.mask
+                counter = self.counters[index]
+                self.counters[index] = min(counter + 1, 3) if taken else max(counter - 1, 0)
+
+class gshare_predictor(bimodal_predictor):
+        '''2-bit counters indexed by PC xor a global history of recent branch outcomes.'''
+
+        def __init__(self, entries=256, history_bits=8):
+                super().__init__(entries)
+                self.history = 0
+                self.history_mask = (1 << history_bits) - 1
+
+        def predict(self, pc, target):
+                return self.counters[((pc >> 1) ^ self.history) & self.mask] >= 2
+
+        def update(self, pc, taken):
+                index = ((pc >> 1) ^ self.history) & self.mask
+                counter = self.counters[index]
+                self.counters[index] = min(counter + 1, 3) if taken else max(counter - 1, 0)
+                self.history = ((self.history << 1) | taken) & self.history_mask
+
+PREDICTORS = {
+        "not_taken": lambda: static_predictor(False),
+        "taken": lambda: static_predictor(True),
+        "btfn": btfn_predictor,
+        "bimodal": bimodal_predictor,
+        "gshare": gshare_predictor,
+}
+
+def instruction_timing(d):
+        '''Hazard information for a decoded instruction: (registers read, registers written,
+        latency kind "alu"/"mul"/"div", is a load, control transfer kind).'''
+        opcode, func = d.opcode, d.func
+        rs, rt, rd = d.rs, d.rt, d.rd
+
+        if opcode == 0b0000:
+                return ((NZP,), (), "alu", False, _BRANCH) if rs else ((), (), "alu", False, _NONE)
+
+        # R-type ALU: rs = rt op rd. twos and not only use rt, and unused funcs just write zero
+        if opcode in (0b0001, 0b0010):
+                if func > 0b100:
+                        reads = ()
+                elif (opcode == 0b0001 and func == 0b100) or (opcode == 0b0010 and func == 0b000):
+                        reads = (rt,)
+                else:
+                        reads = (rt, rd)
+                kind = {0b010: "mul", 0b011: "div"}.get(func, "alu") if opcode == 0b0001 else "alu"
+                return (reads, (rs, NZP), kind, False, _NONE)
+
+        # I-type ALU: rs = rs op imm
+        if 0b0011 <= opcode <= 0b1001:
+                kind = {0b0101: "mul", 0b0110: "div"}.get(opcode, "alu")
+                return ((rs,), (rs, NZP), kind, False, _NONE)
+
+        if opcode == 0b1010:
+                return {
+                        0b000: ((rt,), (rs, NZP), "alu", False, _NONE),         # move
+                        0b001: ((rt,), (rs,), "alu", True, _NONE),              # ldr
+                        0b010: ((rs, rt), (), "alu", False, _NONE),             # str
+                        0b011: ((), (rs,), "alu", False, _NONE),                # clr
+                        0b100: ((), (rs,), "alu", False, _NONE),                # lpc
+                        0b101: ((rs, rt), (rs, rt), "alu", False, _NONE),       # swp
+                        0b110: ((), (), "alu", False, _JUMP),                   # rst
+                        0b111: ((), (), "alu", False, _NONE),                   # hlt
+                }[func]
+
+        return {
+                0b1011: ((rs,), (), "alu", False, _NONE),                       # sti
+                0b1100: ((), (rs,), "alu", False, _NONE),                       # ldi
+                0b1101: (tuple(range(8)), (), "alu", False, _NONE),             # save
+                0b1110: ((), tuple(range(8)), "alu", True, _NONE),              # rest
+                0b1111: ((), (), "alu", False, _JUMP),                          # jmp
+        }[opcode]
+
+class pipeline_model:
+        '''Processor hook timing a 5-stage in-order pipeline. Attaches itself on creation.
+
+        Each instruction's EX entry cycle is the latest of: the cycle after the previous one
+        entered EX, the EX unit coming free after a multi-cycle multiply (mul_latency cycles) or
+        divide (div_latency cycles), its operands becoming reachable through the forwarding
+        paths, and the front end catching up after a redirect. Loads deliver their result after
+        MEM. Conditional branches are predicted by predictor and resolved in EX, costing two
+        bubbles when mispredicted; correctly predicted taken branches are assumed to find their
+        target in a BTB. jmp and rst are resolved in ID at a cost of one bubble. All operands
+        are needed at the start of EX, including store data.'''
+
+        def __init__(self, p, forwarding="full", predictor="bimodal", mul_latency=3, div_latency=8):
+                self.p = p
+                self.paths = FORWARDING[forwarding]
+                self.predictor = PREDICTORS[predictor]() if type(predictor) is str else predictor
+                self.latencies = {"alu": 1, "mul": mul_latency, "div": div_latency}
+
+                # Hazard information by instruction word
+                self._timing = {}
+
+                # Per register (and NZP): cycle its producer finishes EX + 1, and whether it is a load
+                self._ready = [(0, False)] * 9
+
+                # Previous instruction's ID and EX entry cycles and EX latency, starting as if one had
+                # gone before so the first instruction is fetched in cycle 0 and enters EX in cycle 2
+                self._prev_id = 0
+                self._prev_ex = 1
+                self._prev_latency = 1
+                self._redirect = 0
+
+                self.instructions = 0
+                self.cycles = 0
+                self.stalls = dict.fromkeys(STALLS, 0)
+                self.branches = 0
+                self.mispredictions = 0
+                self.jumps = 0
+
+                p.add_hook(self)
+
+        def detach(self):
+                '''Stops timing and releases the processor.'''
+                self.p.remove_hook(self)
+
+        def _operand_cycle(self, earliest, register):
+                '''Earliest EX entry at or after earliest at which register can be read.'''
+                available, load = self._ready[register]
+
+                # Via the register file, once the producer has reached WB
+                if earliest >= available + 2:
+                        return earliest
+
+                # From the EX/MEM latch, the cycle after the producer leaves EX (not for loads)
+                if earliest <= available and not load and "ex_ex" in self.paths:
+                        return available
+
+                # From the MEM/WB latch, the cycle after that
+                if earliest <= available + 1 and "mem_ex" in self.paths:
+                        return available + 1
+
+                return available + 2
+
+        def after_step(self, p, pc, d, address):
+                timing = self._timing.get(d.word)
+                if timing is None:
+                        reads, writes, kind, load, control = instruction_timing(d)
+                        timing = self._timing[d.word] = (reads, writes, self.latencies[kind], load, control)
+                reads, writes, latency, load, control = timing
+
+                # Front end: fetched when the previous instruction moved to ID, unless redirected
+                fetch = max(self._prev_id, self._redirect)
+                decode = max(fetch + 1, self._prev_ex)
+
+                # EX entry, attributing each cycle of delay to its cause
+                ideal = self._prev_ex + 1
+                ex = max(ideal, decode + 1)
+                self.stalls["control"] += ex - ideal
+
+                free = max(ex, self._prev_ex + self._prev_latency)
+                self.stalls["structural"] += free - ex
+                ex = free
+
+                while True:
+                        ready = ex
+                        for register in reads:
+                                ready = max(ready, self._operand_cycle(ready, register))
+                        if ready == ex:
+                                break
+
+                        # The latest producer is the cause
+                        binding = max(reads, key=lambda register: self._ready[register][0])
+                        self.stalls["load_use" if self._ready[binding][1] else "data"] += ready - ex
+                        ex = ready
+
+                for register in writes:
+                        self._ready[register] = (ex + latency, load)
+
+                # Control transfers redirect the next fetch
+                if control == _BRANCH:
+                        taken = bool(d.rs & p._nzp)
+                        target = (pc + 2 + d.imm) & 0xFFFF
+                        self.branches += 1
+                        if self.predictor.predict(pc, target) != taken:
+                                self.mispredictions += 1
+                                self._redirect = ex + 1
+                        self.predictor.update(pc, taken)
+                elif control == _JUMP:
+                        self.jumps += 1
+                        self._redirect = decode + 1
+
+                self._prev_id = decode
+                self._prev_ex = ex
+                self._prev_latency = latency
+                self.instructions += 1
+
+                # Done once through MEM and WB
+                self.cycles = ex + latency + 2
+
+        @property
+        def cpi(self):
+                return self.cycles / self.instructions if self.instructions else 0.0
+
+        @property
+        def misprediction_rate(self):
+                return self.mispredictions / self.branches if self.branches else 0.0
+
+        def stats(self):
+                '''Timing results as a dict.'''
+                return {
+                        "instructions": self.instructions,
+                        "cycles": self.cycles,
+                        "cpi": self.cpi,
+                        "stalls": dict(self.stalls),
+                        "branches": self.branches,
+                        "mispredictions": self.mispredictions,
+                        "misprediction_rate": self.misprediction_rate,
+                        "jumps": self.jumps,
+                }
+
+        def report(self):
+                '''Plain text report.'''
+                cycles = self.cycles or 1
+                lines = [
+                        f"{self.instructions} instructions in {self.cycles} cycles, CPI {self.cpi:.3f}",
+                        "",
+                        "Stall cycles:",
+                ]
+                for kind in STALLS:
+                        lines.append(f"  {kind:<12} {self.stalls[kind]:>12} {self.stalls[kind] / cycles:7.2%}")
+
+                lines += [
+                        "",
+                        f"Branches: {self.branches}, mispredicted {self.mispredictions} ({self.misprediction_rate:.2%})",
+                        f"Jumps: {self.jumps}",
+                ]
+                return "\n".join(lines)
+
+def parse_args(argv):
+        parser = argparse.ArgumentParser(description="Time a BRISC program on a 5-stage pipeline model")
+        add_program_arguments(parser, "instruction budget")
+        parser.add_argument("--forwarding", choices=FORWARDING, default="full", help="forwarding paths (default: %(default)s)")
+        parser.add_argument("--predictor", choices=PREDICTORS, default="bimodal", help="branch predictor (default: %(default)s)")
+        parser.add_argument("--mul-latency", type=int, default=3, help="EX cycles for mulr/muli (default: %(default)s)")
+        parser.add_argument("--div-latency", type=int, default=8, help="EX cycles for divr/divi (default: %(default)s)")
+        return parser.parse_args(argv)
+
+def main():
+        args = parse_args(sys.argv[1:])
+        init_log(logfile="log/pipeline.log", quiet=True, level="INFO")
+
+        proc = create_processor("int", memory_size=args.memory_size)
+        model = pipeline_model(proc, args.forwarding, args.predictor, args.mul_latency, args.div_latency)
+
+        load_program_and_data(proc, args.program, args.data)
+
+        proc.start(max_cycles=args.max_cycles)
+
+        print(f"{args.program}: {"halted" if not proc.run else "stopped at the instruction budget"}, {args.forwarding} forwarding, {args.predictor} predictor")
+        print(model.report())
+
+if __name__ == "__main__":
+        main()
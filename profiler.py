@@ -0,0 +1,162 @@
+'''
+profiler.py
+
+BRISC guest program profiler. A profiler hook counts executions per PC and per instruction,
+taken and not taken branches per PC and loads/stores per data address, each with a single
+array increment. Without one attached a processor pays nothing. Run as a script to profile a
+program and print a report:
+        python profiler.py program.asm --top 20
+
+James Jenkins 2025
+'''
+
+from brisc_logging import init_log
+
+from array import array
+import argparse
+import sys
+
+from assembler import func_mnemonic_index, numbered_listing, opcode_mnemonic_index
+from brisc import add_program_arguments, get_asm_from_file, load_program_and_data
+from simulator import create_processor
+
+# Whether each instruction key, (opcode << 3) | func, that accesses data memory is a store
+_LOAD, _STORE = range(2)
+_EVENTS = [_LOAD] * 128
+for _func in range(8):
+        _EVENTS[(0b1011 << 3) | _func] = _STORE
+        _EVENTS[(0b1101 << 3) | _func] = _STORE
+_EVENTS[(0b1010 << 3) | 0b010] = _STORE
+
+# R-type opcodes select the instruction with func. For the others func is part of the immediate
+# or jump offset, so their keys are folded together when reported
+R_TYPE_OPCODES = {0b0001, 0b0010, 0b1010}
+
+# Mnemonic for each reported instruction key
+MNEMONICS = {}
+for _mnemonic, (_opcode, _type) in opcode_mnemonic_index.items():
+        if _type == "R":
+                MNEMONICS[(int(_opcode, 2) << 3) | int(func_mnemonic_index[_mnemonic], 2)] = _mnemonic
+        elif int(_opcode, 2) != 0b0000:
+                MNEMONICS[int(_opcode, 2) << 3] = _mnemonic
+MNEMONICS[0b0000] = "br/nop"
+
+class profiler:
+        '''Processor hook counting where a program spends its cycles. Attaches itself on creation.
+
+        pc_counts, taken and not_taken are indexed by PC, loads and stores by data memory byte
+        address (the base address for save/rest) and instructions by (opcode << 3) | func. All
+        are 32-bit counters.'''
+
+        def __init__(self, p):
+                self.p = p
+                self.pc_counts = array("I", bytes(4 * 0x10000))
+                self.instructions = array("I", bytes(4 * 128))
+                self.taken = array("I", bytes(4 * 0x10000))
+                self.not_taken = array("I", bytes(4 * 0x10000))
+                self.loads = array("I", bytes(4 * 0x10000))
+                self.stores = array("I", bytes(4 * 0x10000))
+
+                p.add_hook(self)
+
+        def detach(self):
+                '''Stops counting and releases the processor.'''
+                self.p.remove_hook(self)
+
+        def after_step(self, p, pc, d, address):
+                self.pc_counts[pc] += 1
+                key = (d.opcode << 3) | d.func
+                self.instructions[key] += 1
+
+                # Only loads and stores have a data address
+                if address >= 0:
+                        if _EVENTS[key] == _STORE:
+                                self.stores[address] += 1
+                        else:
+                                self.loads[address] += 1
+                elif key < 8 and d.rs:
+                        # A branch, unless it is a nop, which has no condition
+                        if d.rs & p._nzp:
+                                self.taken[pc] += 1
+                        else:
+                                self.not_taken[pc] += 1
+
+        @property
+        def total(self):
+                '''Instructions counted.'''
+                return sum(self.instructions)
+
+        def hot_pcs(self, top=None):
+                '''(PC, count) of executed instructions, most executed first.'''
+                counts = sorted(((count, pc) for pc, count in enumerate(self.pc_counts) if count), reverse=True)
+                return [(pc, count) for count, pc in counts[:top]]
+
+        def instruction_mix(self):
+                '''Count per mnemonic, most executed first.'''
+                mix = {}
+                for key, count in enumerate(self.instructions):
+                        if count:
+                                opcode = key >> 3
+                                mnemonic = MNEMONICS.get(key if opcode in R_TYPE_OPCODES else opcode << 3, f"op {opcode:04b} func {key & 7:03b}")
+                                mix[mnemonic] = mix.get(mnemonic, 0) + count
+                return dict(sorted(mix.items(), key=lambda item: -item[1]))
+
+        def branches(self):
+                '''(PC, taken, not taken) for every conditional branch executed, by PC.'''
+                return [(pc, self.taken[pc], self.not_taken[pc]) for pc in range(0x10000) if self.taken[pc] or self.not_taken[pc]]
+
+        def data_accesses(self, top=None):
+                '''(address, loads, stores) for every data address accessed, busiest first.'''
+                accesses = [(address, self.loads[address], self.stores[address]) for address in range(0x10000) if self.loads[address] or self.stores[address]]
+                accesses.sort(key=lambda access: -(access[1] + access[2]))
+                return accesses[:top]
+
+        def line_counts(self, num_lines):
+                '''Executions of the first num_lines instructions of the program listing.'''
+                return list(self.pc_counts[0:2 * num_lines:2])
+
+        def report(self, listing=None, top=10):
+                '''Plain text report. listing gives the source line of each instruction, by index, see numbered_listing().'''
+                total = self.total or 1
+                lines = [f"{self.total} instructions executed", "", f"Hottest {top} instructions:"]
+                for pc, count in self.hot_pcs(top):
+                        source = listing[pc // 2].strip() if listing is not None and pc % 2 == 0 and pc // 2 < len(listing) else ""
+                        lines.append(f"  0x{pc:04X} {count:>12} {count / total:7.2%}  {source}")
+
+                lines += ["", "Instruction mix:"]
+                for mnemonic, count in self.instruction_mix().items():
+                        lines.append(f"  {mnemonic:<8} {count:>12} {count / total:7.2%}")
+
+                lines += ["", "Branches:", f"  {"PC":<6} {"taken":>12} {"not taken":>12} {"taken %":>8}"]
+                for pc, taken, not_taken in self.branches():
+                        lines.append(f"  0x{pc:04X} {taken:>12} {not_taken:>12} {taken / (taken + not_taken):8.1%}")
+
+                lines += ["", f"Busiest {top} data addresses:", f"  {"address":<7} {"loads":>12} {"stores":>12}"]
+                for address, loads, stores in self.data_accesses(top):
+                        lines.append(f"  0x{address:04X}  {loads:>12} {stores:>12}")
+
+                return "\n".join(lines)
+
+def parse_args(argv):
+        parser = argparse.ArgumentParser(description="Profile a BRISC program and report where its cycles go")
+        add_program_arguments(parser)
+        parser.add_argument("--top", type=int, default=10, help="hot instructions and data addresses to list (default: %(default)s)")
+        return parser.parse_args(argv)
+
+def main():
+        args = parse_args(sys.argv[1:])
+        init_log(logfile="log/profile.log", quiet=True, level="INFO")
+
+        proc = create_processor("int", memory_size=args.memory_size)
+        prof = profiler(proc)
+
+        load_program_and_data(proc, args.program, args.data)
+
+        proc.start(max_cycles=args.max_cycles)
+
+        listing = numbered_listing(get_asm_from_file(args.program)) if args.program.endswith(".asm") else None
+        print(f"{args.program}: {"halted" if not proc.run else "stopped at the cycle budget"} after {proc.cycle} cycles")
+        print(prof.report(listing, args.top))
+
+if __name__ == "__main__":
+        main()
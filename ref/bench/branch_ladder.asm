@@ -0,0 +1,46 @@
+# Branch ladder: dispatches on (counter & 7) through a chain of compare and branch rungs,
+# 20 x 250 times
+ldi $r6 7               # $r6 = mask
+ldi $r0 20              # $r0 = outer count
+
+OUTER: ldi $r7 250                              # $r7 = inner count
+        LOOP: and $r1 $r7 $r6                   # $r1 = counter & 7
+                move $r2 $r1
+                brz R0
+                subi $r2 1
+                brz R1
+                subi $r2 1
+                brz R2
+                subi $r2 1
+                brz R3
+                subi $r2 1
+                brz R4
+                subi $r2 1
+                brz R5
+                subi $r2 1
+                brz R6
+                jmp R7
+
+                R0: addi $r3 1
+                        jmp NEXT
+                R1: addi $r4 1
+                        jmp NEXT
+                R2: addi $r5 1
+                        jmp NEXT
+                R3: subi $r3 1
+                        jmp NEXT
+                R4: subi $r4 1
+                        jmp NEXT
+                R5: subi $r5 1
+                        jmp NEXT
+                R6: addi $r3 2
+                        jmp NEXT
+                R7: addi $r4 2
+
+                NEXT: subi $r7 1
+                brp LOOP
+
+        subi $r0 1
+        brp OUTER
+
+hlt
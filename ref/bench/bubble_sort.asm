@@ -0,0 +1,31 @@
+# Bubble sort of 32 words at 0x0080, filled in descending order so every pair swaps
+ldi $r1 0x0080          # $r1 = base address
+ldi $r2 32              # $r2 = fill value/count
+move $r3 $r1            # $r3 = fill pointer
+
+FILL: str $r3 $r2                               # Mem[p] = count
+        addi $r3 2
+        subi $r2 1
+        brp FILL
+
+ldi $r4 31              # $r4 = passes left
+
+OUTER: move $r3 $r1                             # p = base
+        move $r5 $r4                            # $r5 = pairs left this pass
+
+        INNER: ldr $r6 $r3                      # a = Mem[p]
+                addi $r3 2
+                ldr $r7 $r3                     # b = Mem[p + 2]
+                subr $r0 $r7 $r6
+                brzp NOSWAP                     # if (b < a)
+                        str $r3 $r6             # Mem[p + 2] = a
+                        subi $r3 2
+                        str $r3 $r7             # Mem[p] = b
+                        addi $r3 2
+                NOSWAP: subi $r5 1
+                brp INNER
+
+        subi $r4 1
+        brp OUTER
+
+hlt
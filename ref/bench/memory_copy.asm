@@ -0,0 +1,26 @@
+# Copies 64 words from 0x0000 to 0x0080, 100 times over
+ldi $r1 0x0000          # $r1 = fill pointer
+ldi $r3 64              # $r3 = words left
+
+FILL: str $r1 $r3                               # Mem[p] = words left
+        addi $r1 2
+        subi $r3 1
+        brp FILL
+
+ldi $r7 100             # $r7 = copies left
+
+REPEAT: ldi $r1 0x0000                          # $r1 = source
+        ldi $r2 0x0080                          # $r2 = destination
+        ldi $r3 64
+
+        COPY: ldr $r4 $r1                       # Mem[dst] = Mem[src]
+                str $r2 $r4
+                addi $r1 2
+                addi $r2 2
+                subi $r3 1
+                brp COPY
+
+        subi $r7 1
+        brp REPEAT
+
+hlt
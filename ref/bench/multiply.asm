@@ -0,0 +1,16 @@
+# Multiply/divide heavy kernel: 200 x 100 iterations of mixed mulr/muli/divi arithmetic
+ldi $r1 200             # $r1 = outer count
+
+OUTER: ldi $r2 100                              # $r2 = inner count
+        INNER: mulr $r3 $r2 $r1                 # $r3 = i * j
+                muli $r4 3
+                addr $r4 $r4 $r3                # $r4 = 3 * $r4 + i * j
+                divi $r4 7
+                mulr $r5 $r4 $r2
+                subi $r2 1
+                brp INNER
+
+        subi $r1 1
+        brp OUTER
+
+hlt
@@ -0,0 +1,111 @@
+'''
+sessions.py
+
+BRISC GUI session store. Keeps one state dict per visitor, least recently used first, and
+drops sessions that have been idle too long or that push the store over its size limits
+
+James Jenkins 2025
+'''
+
+from brisc_logging import log
+
+from collections import OrderedDict
+import threading
+import time
+
+class session_store:
+        '''LRU store of per-session state dicts, created on first use by factory().
+
+        Sessions idle for more than idle_timeout seconds are dropped. Beyond max_sessions, or
+        when the sizes reported by sizeof(state), taken whenever a session is fetched, add up to
+        more than max_bytes, the least recently used sessions are dropped, though never the one
+        being fetched. on_evict(state) is called for every dropped session.'''
+
+        def __init__(self, factory, max_sessions=256, idle_timeout=3600.0, max_bytes=None, sizeof=None, on_evict=None):
+                self.factory = factory
+                self.max_sessions = max_sessions
+                self.idle_timeout = idle_timeout
+                self.max_bytes = max_bytes
+                self.sizeof = sizeof
+                self.on_evict = on_evict
+
+                # session id -> [last used time, state, size], least recently used first. Sizes are
+                # taken when a session is created or used, and total is kept as their sum
+                self.sessions = OrderedDict()
+                self.total = 0
+                self.lock = threading.Lock()
+
+        def __len__(self):
+                return len(self.sessions)
+
+        def __contains__(self, session_id):
+                return session_id in self.sessions
+
+        def get(self, session_id):
+                '''Returns the state for session_id, creating it if needed, and marks it used.'''
+                now = time.monotonic()
+
+                with self.lock:
+                        entry = self.sessions.get(session_id)
+                        if entry is None:
+                                state = self.factory()
+                                entry = self.sessions[session_id] = [now, state, self._sizeof(state)]
+                                self.total += entry[2]
+                                log("Session created, %d open", len(self.sessions), level="INFO")
+                        else:
+                                entry[0] = now
+                                self.sessions.move_to_end(session_id)
+
+                                # Only this session can have grown since it was last sized
+                                size = self._sizeof(entry[1])
+                                self.total += size - entry[2]
+                                entry[2] = size
+
+                        self._evict(now)
+                        return entry[1]
+
+        def remove(self, session_id):
+                '''Drops session_id, if present.'''
+                with self.lock:
+                        entry = self.sessions.pop(session_id, None)
+                        if entry is not None:
+                                self.total -= entry[2]
+
+                if entry is not None and self.on_evict is not None:
+                        self.on_evict(entry[1])
+
+        def total_bytes(self):
+                '''Sum of sizeof() over all sessions, as of each one's last use, or 0 without sizeof.'''
+                return self.total
+
+        def _sizeof(self, state):
+                return self.sizeof(state) if self.sizeof is not None else 0
+
+        def _pop_oldest(self):
+                _, state, size = self.sessions.popitem(last=False)[1]
+                self.total -= size
+                return state
+
+        def _evict(self, now):
+                evicted = []
+
+                # Idle sessions, oldest first, stopping at the first recent one
+                while len(self.sessions) > 1:
+                        last_used = next(iter(self.sessions.values()))[0]
+                        if now - last_used <= self.idle_timeout:
+                                break
+                        evicted.append(self._pop_oldest())
+
+                while len(self.sessions) > max(self.max_sessions, 1):
+                        evicted.append(self._pop_oldest())
+
+                if self.max_bytes is not None:
+                        while self.total > self.max_bytes and len(self.sessions) > 1:
+                                evicted.append(self._pop_oldest())
+
+                if evicted:
+                        log("Evicted %d sessions, %d open", len(evicted), len(self.sessions), level="INFO")
+
+                if self.on_evict is not None:
+                        for state in evicted:
+                                self.on_evict(state)
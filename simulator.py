@@ -8,16 +8,21 @@ James Jenkins 2025
 
 from brisc_logging import log
 from common import int_to_bits
+from memory import ADDRESS_SPACE, DEFAULT_MEMORY_SIZE, create_memory, fork_memory, paged_memory
 
 from bitarray import bitarray
-from bitarray.util import ba2int
+from bitarray.util import ba2int, int2ba
+import bisect
 
 class processor:
 
-        def __init__(self):
-                # Memory files
-                self.data_memory = bitarray(256 * 8)
-                self.text_memory = bitarray(256 * 8)
+        def __init__(self, memory_size=DEFAULT_MEMORY_SIZE):
+                if not 0 < memory_size <= ADDRESS_SPACE:
+                        raise ValueError(f"Memory size {memory_size} is outside the 16-bit address space")
+
+                # Memory files, memory_size bytes each
+                self.data_memory = bitarray(memory_size * 8)
+                self.text_memory = bitarray(memory_size * 8)
 
                 # GP registers R0-R7
                 self.register_file = [
@@ -32,7 +37,7 @@ class processor:
                 ]
 
                 # Internal registers
-                self.pc = bitarray(4)
+                self.pc = bitarray(16)
                 self.ir = bitarray(16)
                 self.nzp = bitarray(3)
                 
@@ -74,7 +79,7 @@ class processor:
                         result = processor.ba_math("*", a, b, a_signed=True, b_signed=True)
                 # div
                 if op in (bitarray("0001011"), bitarray("0110000")):
-                        result = processor.a_math("/", a, b, a_signed=True, b_signed=True)
+                        result = processor.ba_math("/", a, b, a_signed=True, b_signed=True)
                 # twos
                 if op == bitarray("0001100"):
                         result = processor.ba_math("*", a, -1, b_signed=True)
@@ -103,8 +108,10 @@ class processor:
                         result = a >> ba2int(b)
                 # sra
                 if op == bitarray("1001000"):
-                        a_shift = a >> ba2int(b)
-                        a_shift[0:ba2int(b)] = a_shift[ba2int(b)]
+                        # Shifts of 16 or more leave only copies of the sign bit
+                        shift = min(ba2int(b), 16)
+                        a_shift = a >> shift
+                        a_shift[0:shift] = a[0]
                         result = a_shift
 
                 # Set NZP registers
@@ -159,7 +166,16 @@ class processor:
                         int_address = ba2int(address)
 
                 bit_address = int_address * 8
-                return source[bit_address:bit_address + 8 * num_bytes]
+                bits = source[bit_address:bit_address + 8 * num_bytes]
+
+                # Bytes past the end read as zero
+                bits.extend(bitarray(8 * num_bytes - len(bits)))
+                return bits
+
+        def mem_write(self, bit_address, bits):
+                '''Writes bits to data memory at bit address. Bytes past the end are dropped.'''
+                bits = bits[:max(len(self.data_memory) - bit_address, 0)]
+                self.data_memory[bit_address:bit_address + len(bits)] = bits
 
         def write_back(self, write_input):
                 '''Performs write back with control signals and input.'''
@@ -169,10 +185,10 @@ class processor:
                 if self.controls["write_dst_mem"]:
                         bit_address = processor.ba_math("*", self.rs, 8, ret_int=True)
                         if self.controls["write_src_reg"]:
-                                self.data_memory[bit_address:bit_address + 16] = write_input
+                                self.mem_write(bit_address, write_input)
 
                         if self.controls["write_src_imm"]:
-                                self.data_memory[bit_address:bit_address + 16] = write_input
+                                self.mem_write(bit_address, write_input)
                                 
         def fetch(self):
                 '''Processor fetch stage.'''
@@ -180,7 +196,7 @@ class processor:
                 self.ir = self.mem_access(self.pc, self.text_memory, 2)
                 self.pc = processor.ba_math("+", self.pc, 2)
                 
-                log(f"Cycle {self.cycle} instruction = {self.ir}")
+                log("Cycle %d instruction = %s", self.cycle, self.ir, level="DEBUG")
 
         def decode(self):
                 '''Processor decode stage. Separates instruction register into the various fields. Sets control signals.'''
@@ -260,17 +276,17 @@ class processor:
 
                 # Register save to mem[pc + sext(imm)] (J-type)
                 if self.opcode == bitarray("1101"):
-                        bit_offset = processor.ba_math("*", self.jmp, 8, a_signed=True)
-                        base_address = processor.ba_math("+", self.pc, bit_offset, b_signed=True, ret_int=True)
-                        self.data_memory[base_address:base_address + 8*16] = self.register_file[0] + self.register_file[1] + self.register_file[2] + self.register_file[3] + self.register_file[4] + self.register_file[5] + self.register_file[6] + self.register_file[7]
+                        base_address = processor.ba_math("+", self.pc, self.jmp, b_signed=True)
+                        base_address = processor.ba_math("*", base_address, 8, ret_int=True)
+                        self.mem_write(base_address, self.register_file[0] + self.register_file[1] + self.register_file[2] + self.register_file[3] + self.register_file[4] + self.register_file[5] + self.register_file[6] + self.register_file[7])
 
                 # Register restore from mem[pc + sext(imm)] (J-type)
                 if self.opcode == bitarray("1110"):
-                        bit_offset = processor.ba_math("*", self.jmp, 8, a_signed=True)
-                        base_address = processor.ba_math("+", self.pc, bit_offset, b_signed=True, ret_int=True)
+                        base_address = processor.ba_math("+", self.pc, self.jmp, b_signed=True)
+                        base_address = processor.ba_math("*", base_address, 8, ret_int=True)
 
-                        for i in range(0, 7):
-                                self.register_file[i] = self.data_mem[base_address + 16 * i:base_address + 16 * i + 16]
+                        for i in range(0, 8):
+                                self.register_file[i] = self.mem_access(base_address // 8 + 2 * i, self.data_memory, 2)
 
                 # Jump unconditionally to pc + sext(imm) (J-type)
                 if self.opcode == bitarray("1111"):
@@ -299,11 +315,13 @@ class processor:
                         case "*":
                                 result = a_int * b_int
                         case "/":
-                                result = a_int / b_int
+                                # Integer division truncates toward zero
+                                result = int(a_int / b_int)
                 if ret_int:
                         return result
                 else:
-                        return bitarray(int_to_bits(result, 16))
+                        # Results wrap to the 16-bit datapath
+                        return bitarray(int_to_bits(result & 0xFFFF, 16))
 
         def step(self):
                 '''Step one instruction forward.'''
@@ -312,7 +330,615 @@ class processor:
                 self.execute()
                 self.cycle += 1
 
-        def start(self):
-                '''Run the processor.'''
-                while self.run:
-                        self.step()
\ No newline at end of file
+        def start(self, max_cycles=None):
+                '''Run the processor until halt, or until cycle reaches max_cycles.'''
+                while self.run and (max_cycles is None or self.cycle < max_cycles):
+                        self.step()
+
+        @staticmethod
+        def _load(memory, image, address):
+                '''Copies a bytes-like image into a bitarray memory at byte address, dropping bytes past the end.'''
+                image = memoryview(image)[:max(len(memory) // 8 - address, 0)]
+                bits = bitarray()
+                bits.frombytes(image)
+                memory[address * 8:address * 8 + len(bits)] = bits
+
+        def load_text(self, image, address=0):
+                '''Copies a bytes-like image, e.g. a packed program, into text memory at byte address.'''
+                processor._load(self.text_memory, image, address)
+
+        def load_data(self, image, address=0):
+                '''Copies a bytes-like image into data memory at byte address.'''
+                processor._load(self.data_memory, image, address)
+
+# Integer-backed backend. Architectural state is kept as plain ints and bytearrays, and each
+# instruction word is split into its fields once with shifts and masks. Results are identical
+# to processor above, but nothing is allocated per cycle beyond the decoded instruction.
+
+# NZP value for every 16-bit result: 0b100 negative, 0b010 zero, 0b001 positive
+_NZP = [0b010] + [0b001] * 0x7FFF + [0b100] * 0x8000
+
+def _sext(value, bits):
+        '''Sign extends a bits-wide field to a Python int.'''
+        sign = 1 << (bits - 1)
+        return (value ^ sign) - sign
+
+def _signed(value):
+        '''Interprets a 16-bit register value as two's complement.'''
+        return value - 0x10000 if value & 0x8000 else value
+
+def _div(a, b):
+        '''Signed division truncating toward zero.'''
+        return int(a / b)
+
+def _read16(memory, address):
+        '''Reads a big-endian 16-bit word at byte address. Bytes past the end read as zero.'''
+        if type(memory) is paged_memory:
+                return memory.read16(address)
+        if address + 1 < len(memory):
+                return memory[address] << 8 | memory[address + 1]
+
+        high = memory[address] if address < len(memory) else 0
+        return high << 8
+
+def _write16(memory, address, value):
+        '''Writes a big-endian 16-bit word at byte address. Bytes past the end are dropped.'''
+        if type(memory) is paged_memory:
+                memory.write16(address, value)
+        elif address + 1 < len(memory):
+                memory[address] = value >> 8
+                memory[address + 1] = value & 0xFF
+        elif address < len(memory):
+                memory[address] = value >> 8
+
+def effective_address(p, d):
+        '''Data memory byte address d accesses, or -1 if it does not access data memory. PC must be
+        as fetch left it, and registers as they were before d executes.'''
+        if d.opcode == 0b1010:
+                if d.func == 0b001:
+                        return p._regs[d.rt]
+                if d.func == 0b010:
+                        return p._regs[d.rs]
+        elif d.opcode == 0b1011:
+                return p._regs[d.rs]
+        elif d.opcode in (0b1101, 0b1110):
+                return (p._pc + d.jmp) & 0xFFFF
+
+        return -1
+
+class decoded_instruction:
+        '''An instruction word split into its fields and control signals, with the handler that executes it.'''
+        __slots__ = ("word", "opcode", "func", "rs", "rt", "rd", "imm", "jmp", "handler", "write_dst_reg", "write_dst_mem")
+
+def decode_word(word):
+        '''Splits a 16-bit instruction word into a decoded_instruction.'''
+        d = decoded_instruction()
+        d.word = word
+        d.opcode = word >> 12
+        d.rs = (word >> 9) & 7
+        d.rt = (word >> 6) & 7
+        d.rd = (word >> 3) & 7
+        d.func = word & 7
+        d.imm = _sext(word & 0x1FF, 9)
+        d.jmp = _sext(word & 0xFFF, 12)
+        d.handler = _HANDLERS[(d.opcode << 3) | d.func]
+
+        # Control signals, as set by processor.set_controls()
+        d.write_dst_reg = 0b0001 <= d.opcode <= 0b1001 or d.opcode == 0b1100 or (d.opcode == 0b1010 and d.func in (0b000, 0b001, 0b011, 0b100))
+        d.write_dst_mem = d.opcode == 0b1011 or (d.opcode == 0b1010 and d.func == 0b010)
+        return d
+
+# Instruction handlers. Each takes the processor and the decoded instruction and performs the
+# execute and write back stages. The PC has already been incremented by fetch.
+
+def _op_branch(p, d):
+        if d.rs & p._nzp:
+                p._pc = (p._pc + d.imm) & 0xFFFF
+
+def _alu_r(fn):
+        '''Builds an R-type ALU handler: rs = fn(rt, rd), setting NZP.'''
+        def handler(p, d):
+                regs = p._regs
+                result = fn(regs[d.rt], regs[d.rd]) & 0xFFFF
+                regs[d.rs] = result
+                p._nzp = _NZP[result]
+        return handler
+
+def _alu_i(fn):
+        '''Builds an I-type ALU handler: rs = fn(rs, imm), setting NZP.'''
+        def handler(p, d):
+                regs = p._regs
+                result = fn(regs[d.rs], d.imm) & 0xFFFF
+                regs[d.rs] = result
+                p._nzp = _NZP[result]
+        return handler
+
+def _op_move(p, d):
+        value = p._regs[d.rt]
+        p._regs[d.rs] = value
+        p._nzp = _NZP[value]
+
+def _op_ldr(p, d):
+        p._regs[d.rs] = _read16(p._data, p._regs[d.rt])
+
+def _op_str(p, d):
+        p.store16(p._regs[d.rs], p._regs[d.rt])
+
+def _op_clr(p, d):
+        p._regs[d.rs] = 0
+
+def _op_lpc(p, d):
+        p._regs[d.rs] = p._pc
+
+def _op_swp(p, d):
+        regs = p._regs
+        regs[d.rs], regs[d.rt] = regs[d.rt], regs[d.rs]
+
+def _op_rst(p, d):
+        p._pc = 0
+
+def _op_hlt(p, d):
+        p.run = False
+
+def _op_sti(p, d):
+        p.store16(p._regs[d.rs], d.imm & 0xFFFF)
+
+def _op_ldi(p, d):
+        p._regs[d.rs] = d.imm & 0xFFFF
+
+def _op_save(p, d):
+        base = (p._pc + d.jmp) & 0xFFFF
+        for i, value in enumerate(p._regs):
+                p.store16(base + 2 * i, value)
+
+def _op_rest(p, d):
+        base = (p._pc + d.jmp) & 0xFFFF
+        for i in range(8):
+                p._regs[i] = _read16(p._data, base + 2 * i)
+
+def _op_jmp(p, d):
+        p._pc = (p._pc + d.jmp) & 0xFFFF
+
+_zero = lambda a, b: 0
+
+# Handler table indexed by (opcode << 3) | func
+_HANDLERS = [None] * 128
+
+def _set_handlers(opcode, handlers):
+        for func in range(8):
+                _HANDLERS[(opcode << 3) | func] = handlers[func] if type(handlers) is list else handlers
+
+_set_handlers(0b0000, _op_branch)
+_set_handlers(0b0001, [
+        _alu_r(lambda a, b: a + b),
+        _alu_r(lambda a, b: a - b),
+        _alu_r(lambda a, b: _signed(a) * _signed(b)),
+        _alu_r(lambda a, b: _div(_signed(a), _signed(b))),
+        _alu_r(lambda a, b: -a),
+        _alu_r(_zero), _alu_r(_zero), _alu_r(_zero)
+])
+_set_handlers(0b0010, [
+        _alu_r(lambda a, b: ~a),
+        _alu_r(lambda a, b: a & b),
+        _alu_r(lambda a, b: a | b),
+        _alu_r(lambda a, b: a ^ b),
+        _alu_r(lambda a, b: ~(a | b)),
+        _alu_r(_zero), _alu_r(_zero), _alu_r(_zero)
+])
+_set_handlers(0b0011, _alu_i(lambda a, imm: a + imm))
+_set_handlers(0b0100, _alu_i(lambda a, imm: a - imm))
+_set_handlers(0b0101, _alu_i(lambda a, imm: _signed(a) * imm))
+_set_handlers(0b0110, _alu_i(lambda a, imm: _div(_signed(a), imm)))
+_set_handlers(0b0111, _alu_i(lambda a, imm: a << (imm & 0x1FF)))
+_set_handlers(0b1000, _alu_i(lambda a, imm: a >> (imm & 0x1FF)))
+_set_handlers(0b1001, _alu_i(lambda a, imm: _signed(a) >> (imm & 0x1FF)))
+_set_handlers(0b1010, [_op_move, _op_ldr, _op_str, _op_clr, _op_lpc, _op_swp, _op_rst, _op_hlt])
+_set_handlers(0b1011, _op_sti)
+_set_handlers(0b1100, _op_ldi)
+_set_handlers(0b1101, _op_save)
+_set_handlers(0b1110, _op_rest)
+_set_handlers(0b1111, _op_jmp)
+
+class fast_processor:
+        '''Integer-backed processor. Exposes the same register_file, pc, ir, nzp, data_memory and
+        text_memory bitarray views as processor, built on demand from the integer state.
+
+        With decode_cache set, instructions are decoded once per text address and reused until the
+        text memory under them is written. With jit set, start() runs translated basic blocks
+        instead (see jit.py). With shared_memory set, data and text memory are one buffer, so
+        stores can modify the program. Memories are memory_size bytes, up to the full 16-bit
+        address space; larger than a page, they are sparse paged_memory (see memory.py).
+
+        Hooks added with add_hook() observe every instruction. A hook may define
+        before_step(p, pc, d, address) and/or after_step(p, pc, d, address), called around the
+        execute stage with the fetch address, the decoded instruction and its data memory
+        address (see effective_address()). While any hook is present, start() steps one
+        instruction at a time.
+
+        With stops set to a breakpoints.stop_conditions, start() stops early at its breakpoints,
+        watchpoints and conditions. The JIT is not used while it is set.'''
+
+        def __init__(self, decode_cache=True, jit=False, shared_memory=False, memory_size=DEFAULT_MEMORY_SIZE):
+                if not 0 < memory_size <= ADDRESS_SPACE:
+                        raise ValueError(f"Memory size {memory_size} is outside the 16-bit address space")
+
+                # Memory files
+                self._data = create_memory(memory_size)
+                self._text = self._data if shared_memory else create_memory(memory_size)
+                self.shared_memory = shared_memory
+
+                # Predecoded instructions by text address
+                self.decode_cache = decode_cache
+                self._decoded = {}
+
+                # Translated basic blocks by start address, and the blocks covering each text byte
+                self.jit = jit
+                self._blocks = {}
+                self._block_owners = {}
+
+                # GP registers R0-R7
+                self._regs = [0] * 8
+
+                # Internal registers
+                self._pc = 0
+                self._ir = 0
+                self._nzp = 0
+
+                # Other vars
+                self.run = True
+                self.cycle = 0
+
+                # Instruction observers
+                self._hooks = []
+                self._before_hooks = []
+                self._after_hooks = []
+
+                # Breakpoints, watchpoints and conditions checked by start(), see breakpoints.py
+                self.stops = None
+
+        def add_hook(self, hook):
+                '''Adds an instruction observer.'''
+                self._hooks.append(hook)
+                self._update_hooks()
+
+        def remove_hook(self, hook):
+                '''Removes an instruction observer added with add_hook().'''
+                self._hooks.remove(hook)
+                self._update_hooks()
+
+        def _update_hooks(self):
+                self._before_hooks = [hook.before_step for hook in self._hooks if hasattr(hook, "before_step")]
+                self._after_hooks = [hook.after_step for hook in self._hooks if hasattr(hook, "after_step")]
+
+        @staticmethod
+        def _to_memory(bits):
+                '''Converts a bitarray memory image to a memory of the same size, padding to a whole byte.'''
+                image = bits.tobytes()
+                return create_memory(len(image), image)
+
+        @staticmethod
+        def _to_bits(memory):
+                '''Converts a bytearray or paged memory to a bitarray view.'''
+                bits = bitarray()
+                bits.frombytes(bytes(memory))
+                return bits
+
+        @property
+        def data_memory(self):
+                return fast_processor._to_bits(self._data)
+
+        @data_memory.setter
+        def data_memory(self, bits):
+                self._data = fast_processor._to_memory(bits)
+                if self.shared_memory:
+                        self._text = self._data
+                        self.invalidate_all()
+
+        @property
+        def text_memory(self):
+                return fast_processor._to_bits(self._text)
+
+        @text_memory.setter
+        def text_memory(self, bits):
+                self._text = fast_processor._to_memory(bits)
+                if self.shared_memory:
+                        self._data = self._text
+                self.invalidate_all()
+
+        @property
+        def register_file(self):
+                return [int2ba(value, 16) for value in self._regs]
+
+        @register_file.setter
+        def register_file(self, registers):
+                self._regs = [ba2int(value) if type(value) is bitarray else value & 0xFFFF for value in registers]
+
+        @property
+        def pc(self):
+                return int2ba(self._pc, 16)
+
+        @pc.setter
+        def pc(self, value):
+                self._pc = ba2int(value) if type(value) is bitarray else value & 0xFFFF
+
+        @property
+        def ir(self):
+                return int2ba(self._ir, 16)
+
+        @property
+        def nzp(self):
+                return int2ba(self._nzp, 3)
+
+        def load_text(self, image, address=0):
+                '''Copies a bytes-like image, e.g. a packed program, into text memory at byte address,
+                dropping bytes past the end.'''
+                image = memoryview(image)[:max(len(self._text) - address, 0)]
+                self._text[address:address + len(image)] = image
+                self.invalidate_all()
+
+        def load_data(self, image, address=0):
+                '''Copies a bytes-like image into data memory at byte address, dropping bytes past the end.'''
+                image = memoryview(image)[:max(len(self._data) - address, 0)]
+                self._data[address:address + len(image)] = image
+                if self.shared_memory:
+                        self.invalidate_all()
+
+        def store16(self, address, value):
+                '''Stores a 16-bit word to data memory, invalidating any decoded instructions it overwrites.'''
+                _write16(self._data, address, value)
+                if self._data is self._text:
+                        self.invalidate_text(address, 2)
+
+        def write_text(self, address, value):
+                '''Writes a 16-bit word to text memory, invalidating any decoded instructions it overwrites.'''
+                _write16(self._text, address, value)
+                self.invalidate_text(address, 2)
+
+        def invalidate_text(self, address, num_bytes):
+                '''Drops decoded instructions overlapping num_bytes of text memory at address.'''
+                # An instruction at address - 1 shares its low byte with address
+                for pc in range(address - 1, address + num_bytes):
+                        self._decoded.pop(pc & 0xFFFF, None)
+
+                if self._block_owners:
+                        for byte in range(address, address + num_bytes):
+                                for start in self._block_owners.pop(byte & 0xFFFF, ()):
+                                        self._blocks.pop(start, None)
+
+        def invalidate_all(self):
+                '''Drops all decoded instructions and translated blocks.'''
+                self._decoded.clear()
+                self._blocks.clear()
+                self._block_owners.clear()
+
+        def fork(self):
+                '''Clones the processor mid-run. Memories are shared copy-on-write (see memory.py),
+                decoded instructions and translated blocks are shared as they are immutable, and
+                registers are copied, so a fork costs O(pages + decoded instructions) rather than a
+                copy of memory. The fork has no hooks or stops.'''
+                p = fast_processor.__new__(fast_processor)
+                p.__dict__.update(self.__dict__)
+
+                p._data = fork_memory(self._data)
+                p._text = p._data if self.shared_memory else fork_memory(self._text)
+                p._decoded = dict(self._decoded)
+                p._blocks = dict(self._blocks)
+                p._block_owners = {byte: list(starts) for byte, starts in self._block_owners.items()}
+                p._regs = list(self._regs)
+
+                p._hooks = []
+                p._before_hooks = []
+                p._after_hooks = []
+                p.stops = None
+                return p
+
+        def fetch(self):
+                '''Processor fetch and decode stages. Returns the decoded instruction and increments PC.'''
+                pc = self._pc
+                d = self._decoded.get(pc) if self.decode_cache else None
+
+                if d is None:
+                        d = decode_word(_read16(self._text, pc))
+                        if self.decode_cache:
+                                self._decoded[pc] = d
+
+                self._ir = d.word
+                self._pc = (pc + 2) & 0xFFFF
+                return d
+
+        def step(self):
+                '''Step one instruction forward.'''
+                if self._hooks:
+                        self._step_hooked()
+                        return
+
+                d = self.fetch()
+                d.handler(self, d)
+                self.cycle += 1
+
+        def _step_hooked(self):
+                '''Step one instruction forward, calling hooks around the execute stage. Returns the
+                decoded instruction and its data memory address.'''
+                pc = self._pc
+                d = self.fetch()
+                address = effective_address(self, d)
+
+                for hook in self._before_hooks:
+                        hook(self, pc, d, address)
+
+                d.handler(self, d)
+                self.cycle += 1
+
+                for hook in self._after_hooks:
+                        hook(self, pc, d, address)
+
+                return d, address
+
+        def start(self, max_cycles=None):
+                '''Run the processor until halt, or until cycle reaches max_cycles.'''
+                limit = float("inf") if max_cycles is None else max_cycles
+
+                if self.stops is not None:
+                        self._start_stopping(limit)
+                        return
+
+                if self._hooks:
+                        while self.run and self.cycle < limit:
+                                self._step_hooked()
+                        return
+
+                if self.jit:
+                        from jit import run_blocks
+                        run_blocks(self, limit)
+                        return
+
+                if not self.decode_cache:
+                        while self.run and self.cycle < limit:
+                                self.step()
+                        return
+
+                decoded = self._decoded
+                while self.run and self.cycle < limit:
+                        pc = self._pc
+                        d = decoded.get(pc)
+                        if d is None:
+                                d = decoded[pc] = decode_word(_read16(self._text, pc))
+
+                        self._ir = d.word
+                        self._pc = (pc + 2) & 0xFFFF
+                        d.handler(self, d)
+                        self.cycle += 1
+
+        def _start_stopping(self, limit):
+                '''start() checking stops. Breakpoints cost a set lookup per instruction, and
+                watchpoints and conditions are only checked after the instructions stops has
+                flagged as able to trigger them.'''
+                stops = self.stops
+                stops.hit = ""
+                pcs = stops.pcs
+                flags = stops.flags if stops.checking else None
+                decoded = self._decoded if self.decode_cache else None
+
+                # Cycle conditions just shorten the run
+                cycle_stop = stops.next_cycle_stop(self.cycle)
+                if cycle_stop is not None and cycle_stop[0] <= limit:
+                        limit = cycle_stop[0]
+                else:
+                        cycle_stop = None
+
+                if self._hooks:
+                        while self.run and self.cycle < limit:
+                                pc = self._pc
+                                if pc in pcs and self.cycle != stops.resume_cycle:
+                                        stops.stop(self, f"breakpoint at 0x{pc:04X}")
+                                        return
+
+                                d, address = self._step_hooked()
+                                if flags is not None:
+                                        flag = flags[d.word]
+                                        if flag and (flag == 1 or stops.classify(d)) and stops.check(self, d, address):
+                                                return
+                else:
+                        while self.run and self.cycle < limit:
+                                pc = self._pc
+                                if pc in pcs and self.cycle != stops.resume_cycle:
+                                        stops.stop(self, f"breakpoint at 0x{pc:04X}")
+                                        return
+
+                                d = decoded.get(pc) if decoded is not None else None
+                                if d is None:
+                                        d = decode_word(_read16(self._text, pc))
+                                        if decoded is not None:
+                                                decoded[pc] = d
+
+                                self._ir = d.word
+                                self._pc = (pc + 2) & 0xFFFF
+                                if flags is not None and flags[d.word] and (flags[d.word] == 1 or stops.classify(d)):
+                                        address = effective_address(self, d)
+                                        d.handler(self, d)
+                                        self.cycle += 1
+                                        if stops.check(self, d, address):
+                                                return
+                                else:
+                                        d.handler(self, d)
+                                        self.cycle += 1
+
+                if cycle_stop is not None and self.run and self.cycle == cycle_stop[0]:
+                        stops.stop(self, f"{cycle_stop[1]} at cycle {self.cycle}")
+
+# Data memory writes dirty_tracker keeps before dropping older ones
+CHANGE_LOG_LIMIT = 1 << 16
+
+class dirty_tracker:
+        '''Hook recording which registers and data memory words each step changes.
+
+        Every step bumps version. Each register remembers the version that last wrote it, and each
+        16-bit data memory word written (by even byte address) is appended to a change log with
+        its version, so changes_since() costs O(changes after version) rather than O(words ever
+        written). Past CHANGE_LOG_LIMIT writes, all but the newest half of that are dropped, and
+        diffs from before them become full ones. Call mark_all() after changing state outside of
+        step(), e.g. when stepping back, to make the next diff a full one.'''
+
+        def __init__(self, p):
+                self.version = 0
+                self.full_version = 0
+                self.register_versions = [0] * 8
+
+                # Change log: words written, and the version that wrote each, in version order
+                self.changed_words = []
+                self.change_versions = []
+                p.add_hook(self)
+
+        def after_step(self, p, pc, d, address):
+                self.version += 1
+                version = self.version
+
+                if d.write_dst_reg:
+                        self.register_versions[d.rs] = version
+                elif d.opcode == 0b1010 and d.func == 0b101:
+                        self.register_versions[d.rs] = version
+                        self.register_versions[d.rt] = version
+                elif d.opcode == 0b1110:
+                        self.register_versions = [version] * 8
+
+                if address >= 0 and (d.write_dst_mem or d.opcode == 0b1101):
+                        size = 16 if d.opcode == 0b1101 else 2
+                        for word in range(address & ~1, address + size, 2):
+                                self.changed_words.append(word)
+                                self.change_versions.append(version)
+
+                        if len(self.changed_words) > CHANGE_LOG_LIMIT:
+                                drop = len(self.changed_words) - CHANGE_LOG_LIMIT // 2
+                                self.full_version = self.change_versions[drop - 1]
+                                del self.changed_words[:drop]
+                                del self.change_versions[:drop]
+
+        def mark_all(self):
+                '''Marks the whole machine as changed.'''
+                self.version += 1
+                self.full_version = self.version
+                self.changed_words.clear()
+                self.change_versions.clear()
+
+        def changes_since(self, version):
+                '''Returns (full, registers, memory words) changed after version. full is True when
+                version is unknown or predates mark_all(), and everything must be resent.'''
+                if version < self.full_version or version > self.version:
+                        return True, list(range(8)), None
+
+                registers = [i for i, changed in enumerate(self.register_versions) if changed > version]
+                words = sorted(set(self.changed_words[bisect.bisect_right(self.change_versions, version):]))
+                return False, registers, words
+
+# Selectable simulator backends
+BACKENDS = {
+        "bitarray": processor,
+        "int": fast_processor,
+}
+
+def create_processor(backend="bitarray", **options):
+        '''Creates a processor using the named backend. Options are passed to the backend constructor.'''
+        if backend not in BACKENDS:
+                raise ValueError(f"Unknown simulator backend '{backend}'")
+
+        return BACKENDS[backend](**options)
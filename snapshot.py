@@ -0,0 +1,175 @@
+'''
+snapshot.py
+
+BRISC machine snapshots. A processor's full state (registers, PC, IR, NZP, control signals,
+cycle, run flag and memories) is serialized to a compact versioned blob: a fixed header followed
+by the nonzero memory pages, zlib compressed. Blobs restore into a new processor of the same
+backend and configuration, or into an existing one. To run many variants from one point, fork()
+the processor instead, which shares its memory copy-on-write:
+        base.start(setup_cycles)
+        for variant in variants:
+                p = base.fork()
+                ...
+
+James Jenkins 2025
+'''
+
+from bitarray import bitarray
+from bitarray.util import ba2int, int2ba
+
+import struct
+import zlib
+
+from memory import PAGE_SIZE, create_memory, memory_pages
+from simulator import decode_word, fast_processor, processor
+
+# Header: magic, version, backend, flags, cycle, PC, IR, NZP, control signals, registers R0-R7,
+# memory size, compressed page data size
+HEADER = struct.Struct("<4sHBBQHHBB8HII")
+MAGIC = b"BRSS"
+VERSION = 1
+
+# Backends by header code
+BACKEND_CODES = {processor: 0, fast_processor: 1}
+
+# Flags
+RUN = 1
+SHARED_MEMORY = 2
+DECODE_CACHE = 4
+JIT = 8
+
+# Control signal bits, in processor.controls order
+CONTROLS = ("write_dst_reg", "write_dst_mem", "write_src_reg", "write_src_imm")
+
+# Page record in the compressed data: page number, followed by the page bytes. Each memory is a
+# page count followed by its records
+PAGE = struct.Struct("<H")
+COUNT = struct.Struct("<H")
+
+def _fast_controls(p):
+        '''Control signals of the instruction in a fast_processor's IR, as processor.set_controls() sets them.'''
+        d = decode_word(p._ir)
+        return {
+                "write_dst_reg": d.write_dst_reg,
+                "write_dst_mem": d.write_dst_mem,
+                "write_src_reg": d.opcode == 0b1010 and d.func == 0b010,
+                "write_src_imm": d.opcode == 0b1011,
+        }
+
+def _pack_pages(memory):
+        records = [PAGE.pack(base // PAGE_SIZE) + bytes(page) for base, page in memory_pages(memory) if any(page)]
+        return COUNT.pack(len(records)) + b"".join(records)
+
+def _unpack_pages(view, offset, memory):
+        '''Writes the pages recorded at offset into memory and returns the offset after them.'''
+        count, = COUNT.unpack_from(view, offset)
+        offset += COUNT.size
+        for _ in range(count):
+                number, = PAGE.unpack_from(view, offset)
+                offset += PAGE.size
+                base = number * PAGE_SIZE
+                length = min(PAGE_SIZE, len(memory) - base)
+                if length <= 0 or offset + length > len(view):
+                        raise ValueError("BRISC snapshot page data is corrupt")
+                memory[base:base + length] = view[offset:offset + length]
+                offset += length
+        return offset
+
+def dump_state(p):
+        '''Serializes a processor's state to bytes.'''
+        if type(p) is fast_processor:
+                regs, pc, ir, nzp = p._regs, p._pc, p._ir, p._nzp
+                controls = _fast_controls(p)
+                memories = [p._data] if p.shared_memory else [p._data, p._text]
+                flags = SHARED_MEMORY * p.shared_memory | DECODE_CACHE * p.decode_cache | JIT * p.jit
+                memory_size = len(p._data)
+        else:
+                regs = [ba2int(register) for register in p.register_file]
+                pc, ir, nzp = ba2int(p.pc), ba2int(p.ir), ba2int(p.nzp)
+                controls = p.controls
+                memories = [bytearray(p.data_memory.tobytes()), bytearray(p.text_memory.tobytes())]
+                flags = 0
+                memory_size = len(p.data_memory) // 8
+
+        control_bits = sum(1 << i for i, signal in enumerate(CONTROLS) if controls[signal])
+        pages = zlib.compress(b"".join(_pack_pages(memory) for memory in memories))
+
+        header = HEADER.pack(MAGIC, VERSION, BACKEND_CODES[type(p)], flags | RUN * p.run, p.cycle, pc, ir, nzp, control_bits, *regs, memory_size, len(pages))
+        return header + pages
+
+def load_state(blob, p=None):
+        '''Restores a dump_state() blob into processor p, or into a new processor of the backend and
+        configuration it was taken from, and returns the processor. p must have the same backend
+        and memory size. A fast_processor's control signals follow from its IR, so only the bitarray
+        processor restores them.'''
+        view = memoryview(blob)
+        if len(view) < HEADER.size or bytes(view[:4]) != MAGIC:
+                raise ValueError("Not a BRISC snapshot")
+
+        magic, version, backend, flags, cycle, pc, ir, nzp, control_bits, *fields = HEADER.unpack_from(view)
+        regs, memory_size, pages_size = fields[:8], fields[8], fields[9]
+        if version != VERSION:
+                raise ValueError(f"Unsupported BRISC snapshot version {version}")
+        if HEADER.size + pages_size > len(view):
+                raise ValueError("BRISC snapshot is truncated")
+
+        backend = {code: cls for cls, code in BACKEND_CODES.items()}.get(backend)
+        if backend is None:
+                raise ValueError("BRISC snapshot is from an unknown backend")
+
+        if p is None:
+                if backend is fast_processor:
+                        p = fast_processor(decode_cache=bool(flags & DECODE_CACHE), jit=bool(flags & JIT), shared_memory=bool(flags & SHARED_MEMORY), memory_size=memory_size)
+                else:
+                        p = processor(memory_size=memory_size)
+        elif type(p) is not backend:
+                raise ValueError(f"Cannot restore a {backend.__name__} snapshot into a {type(p).__name__}")
+
+        pages = memoryview(zlib.decompress(view[HEADER.size:HEADER.size + pages_size]))
+
+        if backend is fast_processor:
+                if len(p._data) != memory_size or p.shared_memory != bool(flags & SHARED_MEMORY):
+                        raise ValueError("BRISC snapshot memory configuration does not match the processor")
+
+                p._data = create_memory(memory_size)
+                offset = _unpack_pages(pages, 0, p._data)
+                if p.shared_memory:
+                        p._text = p._data
+                else:
+                        p._text = create_memory(memory_size)
+                        _unpack_pages(pages, offset, p._text)
+
+                p._regs = list(regs)
+                p._pc, p._ir, p._nzp = pc, ir, nzp
+                p.invalidate_all()
+        else:
+                if len(p.data_memory) // 8 != memory_size:
+                        raise ValueError("BRISC snapshot memory size does not match the processor")
+
+                data, text = bytearray(memory_size), bytearray(memory_size)
+                _unpack_pages(pages, _unpack_pages(pages, 0, data), text)
+                p.data_memory = _bits(data)
+                p.text_memory = _bits(text)
+
+                p.register_file = [int2ba(value, 16) for value in regs]
+                p.pc, p.ir, p.nzp = int2ba(pc, 16), int2ba(ir, 16), int2ba(nzp, 3)
+                p.controls = {signal: bool(control_bits >> i & 1) for i, signal in enumerate(CONTROLS)}
+
+        p.cycle = cycle
+        p.run = bool(flags & RUN)
+        return p
+
+def _bits(image):
+        bits = bitarray()
+        bits.frombytes(bytes(image))
+        return bits
+
+def write_state(path, p):
+        '''Writes a processor's state to a file, see dump_state().'''
+        with open(path, "wb") as file:
+                file.write(dump_state(p))
+
+def read_state(path, p=None):
+        '''Restores a processor from a file, see load_state().'''
+        with open(path, "rb") as file:
+                return load_state(file.read(), p)
@@ -0,0 +1,101 @@
+'''
+test_batch.py
+
+Differential tests of the lockstep batch simulator: every machine in a batch_processor must end
+with the same registers, PC, NZP, cycle count, halt or fault and data memory as the same program
+run alone on fast_processor. Run from the repository root:
+        python -m pytest tests
+
+James Jenkins 2025
+'''
+
+import glob
+import hashlib
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+from assembler import assemble
+from batch import batch_processor
+from brisc import DEFAULT_DATA_IMAGE
+from brisc_object import pack_binary, read_data_image
+from simulator import create_processor
+from test_jit import _random_program
+
+def _run(image, data, registers, max_cycles):
+        '''Runs one machine on fast_processor and returns its state in batch_processor.results() form.
+        Text and data memory are both the size of data, which must hold the program.'''
+        proc = create_processor("int", memory_size=len(data))
+        proc.load_text(image)
+        proc.load_data(data)
+        proc.register_file = registers
+        faulted = False
+        try:
+                proc.start(max_cycles=max_cycles)
+        except ZeroDivisionError:
+                faulted = True
+        return {
+                "registers": list(proc._regs),
+                "pc": proc._pc,
+                "nzp": proc._nzp,
+                "cycle": proc.cycle,
+                "halted": not proc.run,
+                "faulted": faulted,
+                "data_digest": hashlib.sha256(bytes(proc._data)).hexdigest(),
+        }
+
+class batch_test(unittest.TestCase):
+        def assert_same(self, image, data_images, registers, max_cycles):
+                batch = batch_processor(image, data_images, registers)
+                batch.start(max_cycles=max_cycles)
+                results = batch.results()
+                self.assertEqual(len(results), len(data_images))
+                for i, (data, machine_registers) in enumerate(zip(data_images, registers)):
+                        with self.subTest(machine=i):
+                                self.assertEqual(results[i], _run(image, data, machine_registers, max_cycles))
+                                machine = batch.machine(i)
+                                self.assertEqual((machine._regs, machine._pc, machine._nzp, machine.cycle), (results[i]["registers"], results[i]["pc"], results[i]["nzp"], results[i]["cycle"]))
+                return results
+
+        def test_sample_and_bench_programs(self):
+                # Machines differ only in their starting registers, so they stay together
+                with read_data_image(DEFAULT_DATA_IMAGE) as image:
+                        data = bytes(image.data).ljust(0x10000, b"\0")
+                rng = random.Random(4)
+                for path in [os.path.join(ROOT, "ref", "test.asm")] + sorted(glob.glob(os.path.join(ROOT, "ref", "bench", "*.asm"))):
+                        with self.subTest(program=os.path.basename(path)):
+                                with open(path) as file:
+                                        image = pack_binary(assemble(file.read(), translation_file=None))
+                                registers = [[0] * 8] + [[rng.getrandbits(16) for _ in range(8)] for _ in range(3)]
+                                self.assert_same(image, [data] * len(registers), registers, 1_000_000)
+
+        def test_diverging_machines(self):
+                # r2 sets each machine's loop count, and zero faults the division
+                program = "divr $r3 $r1 $r2\nloop: addi $r4 3\nsubi $r2 1\nbrp loop\nstr $r4 $r4\nhlt\n"
+                image = pack_binary(assemble(program, translation_file=None))
+                counts = (0, 1, 5, 40, 0xFFFF, 3)
+                registers = [[0, 100, count, 0, 0, 0, 0, 0] for count in counts]
+                results = self.assert_same(image, [bytes(0x400)] * len(counts), registers, 1_000)
+                self.assertEqual([result["faulted"] for result in results], [True] + [False] * 5)
+                self.assertEqual([result["cycle"] for result in results], [0, 6, 18, 123, 6, 12])
+
+        def test_random_programs(self):
+                # Different data and registers per machine make branches diverge, and divisions
+                # by zero fault some machines while others keep running
+                rng = random.Random(426)
+                for _ in range(100):
+                        image = _random_program(rng, rng.randrange(1, 60))
+                        count = rng.randrange(1, 9)
+                        size = rng.choice((0x400, 0x10000))
+                        data_images = [rng.randbytes(size) for _ in range(count)]
+                        registers = [[rng.getrandbits(16) if rng.random() < 0.5 else rng.randrange(4) for _ in range(8)] for _ in range(count)]
+                        with self.subTest(image=image.hex()):
+                                self.assert_same(image, data_images, registers, 300)
+
+if __name__ == "__main__":
+        unittest.main()
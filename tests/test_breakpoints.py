@@ -0,0 +1,62 @@
+'''
+test_breakpoints.py
+
+Tests of breakpoints, watchpoints and run-until conditions on fast_processor. Run from the
+repository root:
+        python -m pytest tests
+
+James Jenkins 2025
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from assembler import assemble
+from breakpoints import stop_conditions
+from brisc_object import pack_binary
+from simulator import create_processor
+
+def _run(program, breakpoints=(), watch=(), conditions=(), jit=True):
+        symbols = {}
+        proc = create_processor("int", jit=jit)
+        proc.load_text(pack_binary(assemble(program, translation_file=None, symbols=symbols)))
+        proc.stops = stop_conditions(breakpoints, watch, conditions, symbols)
+        proc.start(max_cycles=1000)
+        return proc
+
+class stop_conditions_test(unittest.TestCase):
+        def test_condition_ignores_instructions_not_writing_its_operand(self):
+                # The store is checked for the memory watchpoint, but does not write $r5
+                program = "ldi $r1 0x0010\nsti $r1 0x0001\naddi $r2 1\nhlt\n"
+                proc = _run(program, watch=["0x80"], conditions=["$r5 == 0"])
+                self.assertFalse(proc.run)
+                self.assertEqual(proc.stops.hit, "")
+
+        def test_condition_stops_when_its_register_is_written(self):
+                program = "ldi $r5 3\nldi $r5 0\naddi $r2 1\nhlt\n"
+                proc = _run(program, conditions=["$r5 == 0"])
+                self.assertEqual((proc.cycle, proc.stops.hit), (2, "$r5 == 0 at cycle 2"))
+
+        def test_memory_condition_stops_on_overlapping_store(self):
+                program = "ldi $r1 0x0011\nsti $r1 0x0002\nldi $r1 0x0010\nsti $r1 0x0001\nhlt\n"
+                proc = _run(program, conditions=["mem[0x10] == 1"])
+                self.assertEqual((proc.cycle, proc.stops.hit), (4, "mem[0x10] == 1 at cycle 4"))
+
+        def test_nzp_condition_only_after_flag_writes(self):
+                program = "ldi $r1 0\nldi $r2 0\naddi $r1 0\nhlt\n"
+                proc = _run(program, conditions=["nzp == 0"])
+                self.assertFalse(proc.run)
+                proc = _run(program, conditions=["nzp == 2"])
+                self.assertEqual(proc.cycle, 3)
+
+        def test_watchpoint_and_breakpoint(self):
+                program = "ldi $r1 1\nSTOP: ldi $r3 2\nhlt\n"
+                self.assertEqual(_run(program, watch=["$r3"]).cycle, 2)
+                proc = _run(program, breakpoints=["STOP"])
+                self.assertEqual((proc.cycle, proc._pc), (1, 2))
+
+if __name__ == "__main__":
+        unittest.main()
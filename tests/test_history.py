@@ -0,0 +1,112 @@
+'''
+test_history.py
+
+Tests of time travel: after journal undo, checkpoint restore and replay, and going forward, a
+processor must hold the same state as a fresh run to the same cycle. Run from the repository root:
+        python -m pytest tests
+
+James Jenkins 2025
+'''
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from assembler import assemble
+from brisc_object import pack_binary
+from history import history
+from profiler import profiler
+from simulator import create_processor
+
+# Sums and stores a countdown, so registers, flags and data memory all change as it runs
+PROGRAM = """
+        ldi $r1 0x0060
+        ldi $r2 0x0000
+LOOP:   addr $r2 $r2 $r1
+        str $r2 $r1
+        subi $r1 1
+        brp LOOP
+        hlt
+"""
+
+# Never halts
+FOREVER = "LOOP: addi $r1 1\njmp LOOP\n"
+
+def _processor(program=PROGRAM, **options):
+        proc = create_processor("int", **options)
+        proc.load_text(pack_binary(assemble(program, translation_file=None)))
+        return proc
+
+def _state(proc):
+        return (proc.cycle, list(proc._regs), proc._pc, proc._ir, proc._nzp, proc.run, bytes(proc._data))
+
+def _fresh_states(**options):
+        proc = _processor(**options)
+        states = [_state(proc)]
+        while proc.run:
+                proc.step()
+                states.append(_state(proc))
+        return states
+
+class history_test(unittest.TestCase):
+        @classmethod
+        def setUpClass(cls):
+                cls.states = _fresh_states()
+
+        def make(self, **options):
+                proc = _processor(**options)
+                return proc, history(proc, checkpoint_interval=32, max_checkpoints=8, journal_limit=20)
+
+        def test_goto_back_and_forward(self):
+                for options in ({}, {"jit": True}, {"shared_memory": True}):
+                        states = _fresh_states(shared_memory=options.get("shared_memory", False))
+                        proc, hist = self.make(**options)
+                        proc.start()
+                        self.assertEqual(_state(proc), states[-1])
+
+                        rng = random.Random(8)
+                        for _ in range(200):
+                                cycle = rng.randrange(hist.earliest_cycle, len(states))
+                                self.assertTrue(hist.goto(cycle))
+                                self.assertEqual(_state(proc), states[cycle], (options, cycle))
+
+        def test_journal_undo(self):
+                proc, hist = self.make()
+                proc.start(max_cycles=100)
+                for cycle in range(99, 80, -1):
+                        hist.step_back()
+                        self.assertEqual(_state(proc), self.states[cycle])
+
+        def test_record_after_detached_run(self):
+                proc, hist = self.make(jit=True)
+                hist.record()
+                hist.detach()
+                proc.start()
+                hist.record()
+                hist.attach()
+
+                for cycle in (len(self.states) - 1, 5, 200, len(self.states) - 2, 0):
+                        hist.goto(cycle)
+                        self.assertEqual(_state(proc), self.states[cycle])
+
+        def test_replay_is_not_profiled_again(self):
+                proc, hist = self.make()
+                prof = profiler(proc)
+                proc.start(max_cycles=60)
+                hist.goto(10)
+                hist.goto(60)
+                self.assertEqual(prof.total, 60)
+                hist.goto(70)
+                self.assertEqual(prof.total, 70)
+
+        def test_time_budget(self):
+                proc, hist = self.make(program=FOREVER)
+                self.assertFalse(hist.goto(10_000_000, max_seconds=0.05))
+                self.assertTrue(0 < proc.cycle < 10_000_000)
+                self.assertTrue(hist.goto(proc.cycle + 10, max_seconds=1.0))
+
+if __name__ == "__main__":
+        unittest.main()
@@ -0,0 +1,112 @@
+'''
+test_incremental.py
+
+Randomized edit tests of incremental_assembler: after every edit, the patched instruction words,
+binary() and errors() must match a fresh assembly of the same text, and binary() must match
+assemble() whenever there are no errors. Run from the repository root:
+        python -m pytest tests
+
+James Jenkins 2025
+'''
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from assembler import assemble, incremental_assembler
+
+def _random_line(rng, labels):
+        label = f"{rng.choice(labels)}: " if rng.random() < 0.15 else ""
+        kind = rng.random()
+        if kind < 0.05:
+                return ""
+        if kind < 0.1:
+                return "# comment"
+        if kind < 0.17:
+                return f"{rng.choice(labels)}:"
+        if kind < 0.4:
+                return label + f"{rng.choice(("addr", "subr", "and", "or", "move", "hlt", "twos"))} $r{rng.randrange(8)} $r{rng.randrange(8)}"
+        if kind < 0.65:
+                return label + f"{rng.choice(("addi", "subi", "ldi", "sl"))} $r{rng.randrange(8)} {rng.randrange(100)}"
+        if kind < 0.85:
+                return label + f"{rng.choice(("brp", "brz", "brnz", "brnzp"))} {rng.choice(labels)}"
+        if kind < 0.97:
+                return label + f"jmp {rng.choice(labels)}"
+        return label + "bogus $r1"
+
+def _assemble(text):
+        try:
+                return assemble(text, translation_file=None)
+        except (Exception, SystemExit):
+                return None
+
+class incremental_test(unittest.TestCase):
+        def check_edits(self, rng, lines, labels, edits, make_lines):
+                editor = incremental_assembler("\n".join(lines))
+                client = [instruction.word for instruction in editor.instructions]
+
+                for _ in range(edits):
+                        start = rng.randint(0, len(lines))
+                        end = min(len(lines), start + rng.choice((0, 0, 1, 1, 1, 2, 5)))
+                        new = make_lines()
+                        if start == end and not new:
+                                continue
+                        lines[start:end] = new
+                        patch = editor.edit(start, end, new)
+
+                        # A client applying the patches holds the same words
+                        client[patch["start"]:patch["start"] + patch["removed"]] = patch["words"]
+                        for index, word in patch["changed"].items():
+                                client[index] = word
+                        words = [instruction.word for instruction in editor.instructions]
+                        self.assertEqual(client, words)
+
+                        text = "\n".join(lines)
+                        fresh = incremental_assembler(text)
+                        self.assertEqual([instruction.word for instruction in fresh.instructions], words, text)
+                        self.assertEqual(editor.errors(), fresh.errors(), text)
+
+                        binary = editor.binary()
+                        expected = _assemble(text)
+                        if binary is not None and editor.instructions:
+                                self.assertEqual(binary, expected, text)
+                        elif expected is not None:
+                                # assemble() only accepts erroneous text when the errors are unknown labels
+                                self.assertTrue(all(message.startswith("Unknown label") for _, message in editor.errors()), text)
+
+        def test_random_edits(self):
+                for seed in range(80):
+                        rng = random.Random(seed)
+                        labels = [f"L{i}" for i in range(rng.randint(1, 8))]
+                        lines = [_random_line(rng, labels) for _ in range(rng.randint(0, 40))]
+                        with self.subTest(seed=seed):
+                                self.check_edits(rng, lines, labels, 30, lambda: [_random_line(rng, labels) for _ in range(rng.choice((0, 1, 1, 1, 2, 3)))])
+
+        def test_edits_moving_far_references(self):
+                # Branches reach about 128 instructions, so inserting and removing lines moves
+                # references in and out of range and relinks ones spanning the edit
+                rng = random.Random(14)
+                labels = [f"F{i}" for i in range(6)]
+                lines = []
+                for i in range(900):
+                        if i % 150 == 0:
+                                lines.append(f"{labels[i // 150]}: addi $r1 1")
+                        elif rng.random() < 0.05:
+                                lines.append(f"{rng.choice(("brz", "brnzp"))} {rng.choice(labels)}")
+                        elif rng.random() < 0.02:
+                                lines.append(f"jmp {rng.choice(labels)}")
+                        else:
+                                lines.append("addr $r2 $r2 $r3")
+                self.check_edits(rng, lines, labels, 40, lambda: ["subi $r4 1"] * rng.choice((0, 1, 3, 20)))
+
+        def test_unknown_labels(self):
+                editor = incremental_assembler("ldi $r1 1\njmp NOWHERE\nhlt")
+                self.assertEqual(editor.errors(), [(2, "Unknown label NOWHERE")])
+                self.assertIsNone(editor.binary())
+                self.assertIsNotNone(_assemble("ldi $r1 1\njmp NOWHERE\nhlt"))
+
+if __name__ == "__main__":
+        unittest.main()
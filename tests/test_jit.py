@@ -0,0 +1,79 @@
+'''
+test_jit.py
+
+Differential tests of the basic block translator: random programs are run on fast_processor with
+and without the JIT, and must leave the same registers, flags, cycle count and memory, including
+when an instruction faults partway through a block. Run from the repository root:
+        python -m pytest tests
+
+James Jenkins 2025
+'''
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from assembler import assemble
+from brisc_object import pack_binary
+from simulator import create_processor
+
+MEMORY_SIZE = 0x400
+MAX_CYCLES = 2_000
+
+def _random_program(rng, length):
+        # Mostly ALU, move and memory ops with small registers and addresses, so blocks run long
+        # and divisions by zero happen partway through them
+        words = []
+        for _ in range(length):
+                opcode = rng.choice((0b0000, 0b0001, 0b0001, 0b0010, 0b0011, 0b0100, 0b0101, 0b0110, 0b0111, 0b1000, 0b1001, 0b1010, 0b1010, 0b1011, 0b1100, 0b1100, 0b1101, 0b1110, 0b1111))
+                word = (opcode << 12) | rng.getrandbits(12)
+                if opcode == 0b1111:
+                        word = (word & 0xF000) | (rng.randrange(-8, 8) & 0xFFF)
+                words.append(word)
+        return b"".join(word.to_bytes(2, "big") for word in words)
+
+def _run(image, data, jit, shared_memory=False):
+        proc = create_processor("int", jit=jit, shared_memory=shared_memory, memory_size=MEMORY_SIZE)
+        proc.load_text(image)
+        if not shared_memory:
+                proc.load_data(data)
+        error = None
+        try:
+                proc.start(max_cycles=MAX_CYCLES)
+        except Exception as exception:
+                error = type(exception)
+        return (error, proc.cycle, proc.run, proc._pc, proc._ir, proc._nzp, list(proc._regs), bytes(proc._data))
+
+class jit_test(unittest.TestCase):
+        def assert_same(self, image, data=b"", shared_memory=False):
+                expected = _run(image, data, jit=False, shared_memory=shared_memory)
+                self.assertEqual(_run(image, data, jit=True, shared_memory=shared_memory), expected)
+                return expected
+
+        def test_fault_inside_block(self):
+                program = "ldi $r1 5\nldi $r2 0\naddi $r1 1\ndivr $r3 $r1 $r2\nhlt\n"
+                image = pack_binary(assemble(program, translation_file=None))
+                error, cycle, _, pc, *_ = self.assert_same(image)
+                self.assertIs(error, ZeroDivisionError)
+                self.assertEqual((cycle, pc), (3, 8))
+
+        def test_random_programs(self):
+                rng = random.Random(426)
+                for _ in range(300):
+                        image = _random_program(rng, rng.randrange(1, 120))
+                        data = rng.randbytes(MEMORY_SIZE)
+                        with self.subTest(image=image.hex()):
+                                self.assert_same(image, data)
+
+        def test_random_programs_shared_memory(self):
+                rng = random.Random(2025)
+                for _ in range(150):
+                        image = _random_program(rng, rng.randrange(1, 120))
+                        with self.subTest(image=image.hex()):
+                                self.assert_same(image, shared_memory=True)
+
+if __name__ == "__main__":
+        unittest.main()
@@ -0,0 +1,136 @@
+'''
+test_memory.py
+
+Tests of paged_memory: random reads and writes must match a bytearray of the same size, and
+pages shared copy-on-write between forks and snapshots must never carry a write from one memory
+to another. Run from the repository root:
+        python -m pytest tests
+
+James Jenkins 2025
+'''
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from memory import PAGE_SIZE, allocated_bytes, create_memory, fork_memory, paged_memory, restore_memory, snapshot_memory
+from simulator import _read16, _write16
+
+class memory_test(unittest.TestCase):
+        def assert_matches(self, memories, models):
+                for memory, model in zip(memories, models):
+                        self.assertEqual(bytes(memory), bytes(model))
+
+        def test_random_operations(self):
+                # Each step writes to, reads from, forks, snapshots or restores one of a growing
+                # family of memories, and every memory must still match its own bytearray model
+                rng = random.Random(16)
+                for size in (PAGE_SIZE + 1, 0x1000, 0x1234, 0x10000):
+                        with self.subTest(size=size):
+                                memories = [paged_memory(size)]
+                                models = [bytearray(size)]
+                                snapshots = []
+                                for step in range(2_000):
+                                        i = rng.randrange(len(memories))
+                                        memory, model = memories[i], models[i]
+                                        address = rng.randrange(size) if rng.random() < 0.8 else rng.choice((0, size - 1, size - 2, PAGE_SIZE - 1, PAGE_SIZE))
+                                        kind = rng.random()
+                                        if kind < 0.25:
+                                                value = rng.choice((0, rng.randrange(256)))
+                                                memory[address] = value
+                                                model[address] = value
+                                        elif kind < 0.45:
+                                                end = min(size, address + rng.randrange(2 * PAGE_SIZE))
+                                                value = bytes(end - address) if rng.random() < 0.3 else rng.randbytes(end - address)
+                                                memory[address:end] = value
+                                                model[address:end] = value
+                                        elif kind < 0.6:
+                                                value = rng.getrandbits(16)
+                                                _write16(memory, address, value)
+                                                _write16(model, address, value)
+                                        elif kind < 0.7:
+                                                self.assertEqual(_read16(memory, address), _read16(model, address))
+                                                end = address + rng.randrange(3 * PAGE_SIZE)
+                                                self.assertEqual(memory[address:end], model[address:end])
+                                        elif kind < 0.82:
+                                                if len(memories) < 12:
+                                                        memories.append(fork_memory(memory))
+                                                        models.append(bytearray(model))
+                                        elif kind < 0.92:
+                                                snapshots.append((snapshot_memory(memory), bytes(model)))
+                                        elif snapshots:
+                                                snapshot, image = rng.choice(snapshots)
+                                                restore_memory(memory, snapshot)
+                                                model[:] = image
+                                        self.assertEqual(bytes(memory), bytes(model))
+                                        if step % 20 == 0:
+                                                self.assert_matches(memories, models)
+                                self.assert_matches(memories, models)
+
+                                # Restoring a snapshot into every memory and writing to them leaves the
+                                # snapshot and the other memories alone
+                                for snapshot, image in snapshots[:5]:
+                                        for memory, model in zip(memories, models):
+                                                restore_memory(memory, snapshot)
+                                                model[:] = image
+                                        for memory, model in zip(memories, models):
+                                                address = rng.randrange(size)
+                                                memory[address] = model[address] = model[address] ^ 0xFF
+                                        self.assert_matches(memories, models)
+                                        restore_memory(memories[0], snapshot)
+                                        self.assertEqual(bytes(memories[0]), image)
+
+        def test_shared_pages_copied_on_write(self):
+                parent = paged_memory(0x1000)
+                parent[0:3] = b"abc"
+                parent[PAGE_SIZE] = 1
+                first, second = parent.fork(), parent.fork()
+
+                # Pages written before the fork are shared until the first write to them
+                self.assertIs(first.pages[0], parent.pages[0])
+                self.assertIs(second.pages[0], parent.pages[0])
+
+                first[1] = ord("x")
+                _write16(second, 1, 0x7979)
+                parent[2] = ord("z")
+                self.assertEqual((bytes(parent[0:3]), bytes(first[0:3]), bytes(second[0:3])), (b"abz", b"axc", b"ayy"))
+
+                # The untouched page is still shared, and forking a fork shares its copies
+                self.assertIs(first.pages[1], parent.pages[1])
+                third = first.fork()
+                first[0] = 0
+                self.assertEqual(bytes(third[0:3]), b"axc")
+                self.assertEqual(bytes(first[0:3]), b"\0xc")
+
+                # A snapshot keeps the state it was taken in
+                snapshot = snapshot_memory(second)
+                second[0:3] = b"\0\0\0"
+                self.assertEqual(bytes(second[0:3]), bytes(3))
+                restore_memory(second, snapshot)
+                self.assertEqual(bytes(second[0:3]), b"ayy")
+                second[0] = 0
+                restore_memory(first, snapshot)
+                self.assertEqual(bytes(first[0:3]), b"ayy")
+
+        def test_zero_writes_stay_unallocated(self):
+                memory = paged_memory(0x1000)
+                memory[5] = 0
+                memory[PAGE_SIZE:3 * PAGE_SIZE] = bytes(2 * PAGE_SIZE)
+                _write16(memory, 0x800, 0)
+                self.assertEqual(allocated_bytes(memory), 0)
+                memory[0x1000 - 1] = 1
+                self.assertEqual(allocated_bytes(memory), PAGE_SIZE)
+
+        def test_small_memories_are_bytearrays(self):
+                memory = create_memory(PAGE_SIZE, b"\1\2")
+                self.assertIs(type(memory), bytearray)
+                fork = fork_memory(memory)
+                fork[0] = 9
+                self.assertEqual(memory[0], 1)
+                self.assertIs(type(create_memory(PAGE_SIZE + 1)), paged_memory)
+
+if __name__ == "__main__":
+        unittest.main()
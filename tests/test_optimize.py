@@ -0,0 +1,130 @@
+'''
+test_optimize.py
+
+Tests of the assembler's peephole optimizer: optimized programs must end with the same registers,
+data memory and halt state as the originals, and each rewrite must only fire where it is safe.
+Run from the repository root:
+        python -m pytest tests
+
+James Jenkins 2025
+'''
+
+import glob
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+from assembler import assemble
+from brisc import DEFAULT_DATA_IMAGE
+from brisc_object import pack_binary, read_data_image
+from simulator import create_processor
+
+def _run(binary, max_cycles=100_000):
+        proc = create_processor("int")
+        proc.load_text(pack_binary(binary))
+        with read_data_image(DEFAULT_DATA_IMAGE) as image:
+                image.load_data(proc)
+        proc.start(max_cycles=max_cycles)
+        return proc
+
+def _random_program(rng):
+        # Straight-line code with labels, branches and the patterns each rewrite looks for
+        length = rng.randrange(8, 40)
+        labels = [f"L{i}" for i in range(length // 3 + 1)]
+        placed = dict(zip(rng.sample(range(length), len(labels)), labels))
+        lines = []
+        for i in range(length):
+                r = rng.randrange(8)
+                line = rng.choice((
+                        f"ldi $r{r} {rng.randrange(-256, 256)}",
+                        f"{rng.choice(("addi", "subi", "sl", "srl", "sra"))} $r{r} {rng.randrange(-3, 6)}",
+                        f"move $r{r} $r{r}",
+                        f"br{rng.choice(("n", "z", "p", "nz", "zp", "np", "nzp"))} {rng.choice(labels)}",
+                        f"jmp {rng.choice(labels)}",
+                        f"addr $r{r} $r{rng.randrange(8)} $r{rng.randrange(8)}",
+                        "hlt",
+                        f"str $r{r} $r{rng.randrange(8)}",
+                        f"ldi $r{r} {rng.randrange(-256, 256)}\nsl $r{r} {rng.randrange(9)}\naddi $r{r} {rng.randrange(-9, 9)}",
+                        f"subi $r{r} 0",
+                        f"lpc $r{r}" if rng.random() < 0.2 else f"move $r{r} $r{rng.randrange(8)}",
+                ))
+                lines.append(f"{placed[i]}: {line}" if i in placed else line)
+        lines.append("hlt")
+        return "\n".join(lines)
+
+class optimize_test(unittest.TestCase):
+        def optimize(self, text, max_cycles=100_000):
+                '''Returns the optimizer's report for text, checking the optimized program ends the same.'''
+                report = {}
+                original = _run(assemble(text, translation_file=None), max_cycles)
+                optimized = _run(assemble(text, translation_file=None, optimize=True, report=report), max_cycles)
+                if not original.run and not optimized.run:
+                        self.assertEqual(optimized._regs, original._regs)
+                        self.assertEqual(bytes(optimized._data), bytes(original._data))
+                        self.assertLessEqual(optimized.cycle, original.cycle)
+                return report
+
+        def kinds(self, report):
+                return sorted(kind for kind, *_ in report["rewrites"])
+
+        def test_sample_and_bench_programs(self):
+                for path in [os.path.join(ROOT, "ref", "test.asm")] + sorted(glob.glob(os.path.join(ROOT, "ref", "bench", "*.asm"))):
+                        with self.subTest(program=os.path.basename(path)):
+                                with open(path) as file:
+                                        text = file.read()
+                                original = _run(assemble(text, translation_file=None), 10_000_000)
+                                optimized = _run(assemble(text, translation_file=None, optimize=True), 10_000_000)
+                                self.assertFalse(original.run)
+                                self.assertFalse(optimized.run)
+                                self.assertEqual(optimized._regs, original._regs)
+                                self.assertEqual(bytes(optimized._data), bytes(original._data))
+
+        def test_random_programs(self):
+                for seed in range(300):
+                        with self.subTest(seed=seed):
+                                self.optimize(_random_program(random.Random(seed)), max_cycles=3000)
+
+        def test_fold(self):
+                report = self.optimize("ldi $r1 3\nsl $r1 2\naddi $r1 1\nstr $r1 $r0\nhlt")
+                self.assertEqual(report["rewrites"], [("fold", 0, "ldi $r1 3; sl $r1 2; addi $r1 1", "ldi $r1 13")])
+
+        def test_fold_sets_flags_that_are_read(self):
+                report = self.optimize("ldi $r1 3\nsl $r1 2\naddi $r1 -12\nbrz Z\nldi $r2 1\nZ: hlt")
+                self.assertEqual(report["rewrites"], [("fold", 0, "ldi $r1 3; sl $r1 2; addi $r1 -12", "ldi $r1 0; move $r1 $r1")])
+
+        def test_no_fold_across_label(self):
+                report = self.optimize("ldi $r1 3\nL: addi $r1 1\nstr $r1 $r0\nhlt")
+                self.assertEqual(report["rewrites"], [])
+
+        def test_dead_flags(self):
+                report = self.optimize("move $r2 $r2\naddi $r3 0\nsubi $r1 1\nbrz E\nldi $r4 1\nE: hlt")
+                self.assertEqual(self.kinds(report), ["dead_flags", "dead_flags"])
+
+        def test_no_dead_flags_when_read(self):
+                report = self.optimize("subi $r1 1\nmove $r2 $r2\nbrz E\nldi $r4 1\nE: hlt")
+                self.assertEqual(report["rewrites"], [])
+
+        def test_no_dead_flags_when_read_at_a_branch_target(self):
+                report = self.optimize("ldi $r1 2\nL: move $r1 $r1\nJ: brz E\nsubi $r1 1\nbrnzp J\nE: hlt")
+                self.assertNotIn("dead_flags", self.kinds(report))
+
+        def test_thread(self):
+                report = self.optimize("ldi $r1 0\nmove $r1 $r1\nbrz A\nhlt\nA: jmp B\nldi $r2 1\nB: hlt")
+                self.assertIn(("thread", 2, "brz A", "brz B"), report["rewrites"])
+                self.assertEqual(report["threaded"], {2: [4]})
+
+        def test_dead_jump(self):
+                report = self.optimize("ldi $r1 1\njmp N\nN: brnzp M\nM: hlt")
+                self.assertEqual(report["removed"], [1, 2])
+                self.assertEqual(self.kinds(report), ["dead_jump", "dead_jump"])
+
+        def test_nothing_removed_before_lpc(self):
+                report = self.optimize("move $r2 $r2\naddi $r3 1\nlpc $r1\nstr $r1 $r0\nhlt")
+                self.assertEqual(report["removed"], [])
+
+if __name__ == "__main__":
+        unittest.main()
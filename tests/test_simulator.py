@@ -0,0 +1,150 @@
+'''
+test_simulator.py
+
+Differential tests of the simulator backends: fast_processor, with and without its decode cache
+and JIT, must leave the same registers, PC, NZP, cycle count and data memory as the bitarray
+processor on the sample and bench programs and on random programs. dirty_tracker diffs must bring
+a client's copy of the machine up to date. Run from the repository root:
+        python -m pytest tests
+
+James Jenkins 2025
+'''
+
+import glob
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+from assembler import assemble
+from brisc import DEFAULT_DATA_IMAGE
+from brisc_object import pack_binary, read_data_image
+import simulator
+from simulator import create_processor, dirty_tracker
+from test_jit import _random_program
+
+FAST_OPTIONS = ({"decode_cache": False}, {}, {"jit": True})
+
+def _run(backend, image, data, max_cycles, **options):
+        proc = create_processor(backend, **options)
+        proc.load_text(image)
+        proc.load_data(data)
+        error = None
+        try:
+                proc.start(max_cycles=max_cycles)
+        except Exception as exception:
+                error = type(exception)
+
+        # Compare through the bitarray views both backends expose
+        return {
+                "error": error,
+                "cycle": proc.cycle,
+                "run": proc.run,
+                "pc": proc.pc.to01(),
+                "nzp": proc.nzp.to01(),
+                "registers": [register.to01() for register in proc.register_file],
+                "data": proc.data_memory.tobytes(),
+        }
+
+class simulator_test(unittest.TestCase):
+        def assert_same(self, image, data, max_cycles, **options):
+                expected = _run("bitarray", image, data, max_cycles, **options)
+                for fast_options in FAST_OPTIONS:
+                        with self.subTest(**fast_options):
+                                self.assertEqual(_run("int", image, data, max_cycles, **options, **fast_options), expected)
+                return expected
+
+        def test_sample_and_bench_programs(self):
+                with read_data_image(DEFAULT_DATA_IMAGE) as image:
+                        data = bytes(image.data)
+                for path in [os.path.join(ROOT, "ref", "test.asm")] + sorted(glob.glob(os.path.join(ROOT, "ref", "bench", "*.asm"))):
+                        with self.subTest(program=os.path.basename(path)):
+                                with open(path) as file:
+                                        binary = assemble(file.read(), translation_file=None)
+                                result = self.assert_same(pack_binary(binary), data, 1_000_000)
+                                self.assertFalse(result["run"])
+
+        def test_random_programs(self):
+                # Random words reach every opcode, including shifts past 16 bits, division by zero
+                # and loads and stores past the end of memory
+                rng = random.Random(1)
+                for _ in range(300):
+                        image = _random_program(rng, rng.randrange(1, 60))
+                        data = rng.randbytes(0x400)
+                        memory_size = rng.choice((0x40, 0x400, 0x10000))
+                        with self.subTest(image=image.hex(), memory_size=memory_size):
+                                self.assert_same(image, data, 500, memory_size=memory_size)
+
+class dirty_tracker_test(unittest.TestCase):
+        def assert_client_follows(self, limit):
+                # Clients poll at random intervals and patch their copies with each diff, reading
+                # everything again when it is a full one
+                rng = random.Random(9)
+                original_limit = simulator.CHANGE_LOG_LIMIT
+                simulator.CHANGE_LOG_LIMIT = limit
+                fulls = diffs = 0
+                try:
+                        for _ in range(60):
+                                image = _random_program(rng, rng.randrange(1, 60))
+                                proc = create_processor("int", memory_size=rng.choice((0x100, 0x1000)))
+                                proc.load_text(image)
+                                proc.load_data(rng.randbytes(0x400))
+                                tracker = dirty_tracker(proc)
+                                clients = [[-1, None, None] for _ in range(3)]
+                                for _ in range(40):
+                                        try:
+                                                proc.start(max_cycles=proc.cycle + rng.randrange(30))
+                                        except ZeroDivisionError:
+                                                pass
+                                        if rng.random() < 0.05:
+                                                proc.store16(rng.randrange(0, 0x100, 2), rng.getrandbits(16))
+                                                tracker.mark_all()
+
+                                        client = rng.choice(clients)
+                                        full, registers, words = tracker.changes_since(client[0])
+                                        if full:
+                                                fulls += 1
+                                                client[1:] = list(proc._regs), bytearray(proc._data)
+                                        else:
+                                                diffs += 1
+                                                self.assertEqual(words, sorted(set(words)))
+                                                for i in registers:
+                                                        client[1][i] = proc._regs[i]
+                                                for word in words:
+                                                        client[2][word:word + 2] = proc._data[word:word + 2]
+                                        client[0] = tracker.version
+                                        self.assertEqual(client[1], proc._regs)
+                                        self.assertEqual(bytes(client[2]), bytes(proc._data))
+                                self.assertLessEqual(len(tracker.changed_words), limit)
+                finally:
+                        simulator.CHANGE_LOG_LIMIT = original_limit
+                return fulls, diffs
+
+        def test_diffs(self):
+                fulls, diffs = self.assert_client_follows(simulator.CHANGE_LOG_LIMIT)
+                self.assertGreater(diffs, fulls)
+
+        def test_diffs_after_dropping_changes(self):
+                # Clients that fall behind the log get full diffs they would not have otherwise
+                fulls, diffs = self.assert_client_follows(8)
+                self.assertGreater(diffs, 0)
+                self.assertGreater(fulls, self.assert_client_follows(simulator.CHANGE_LOG_LIMIT)[0])
+
+        def test_diff_costs_only_new_changes(self):
+                proc = create_processor("int", memory_size=0x10000)
+                proc.load_text(pack_binary(assemble("ldi $r1 0\nLOOP: str $r1 $r1\naddi $r1 2\njmp LOOP", translation_file=None)))
+                tracker = dirty_tracker(proc)
+                proc.start(max_cycles=3_000)
+                version = tracker.version
+                proc.start(max_cycles=3_009)
+                full, registers, words = tracker.changes_since(version)
+                self.assertFalse(full)
+                self.assertEqual(registers, [1])
+                self.assertEqual(words, [2000, 2002, 2004])
+
+if __name__ == "__main__":
+        unittest.main()
@@ -0,0 +1,179 @@
+'''
+test_snapshot.py
+
+Tests of processor snapshots and forks: a dump_state() blob must restore the exact state it was
+taken from and run on identically, and writes to a fork must not reach its parent or its
+siblings, including through memory pages they shared before the write. Run from the repository
+root:
+        python -m pytest tests
+
+James Jenkins 2025
+'''
+
+import glob
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+from assembler import assemble
+from brisc import DEFAULT_DATA_IMAGE
+from brisc_object import pack_binary, read_data_image
+from simulator import create_processor
+from snapshot import dump_state, load_state
+from test_jit import _random_program
+
+FAST_OPTIONS = ({}, {"decode_cache": False}, {"jit": True}, {"shared_memory": True}, {"memory_size": 0x10000}, {"memory_size": 0x10000, "shared_memory": True, "jit": True})
+
+def _state(p):
+        '''Every part of a processor's state, through the bitarray views both backends expose.'''
+        state = {
+                "type": type(p),
+                "cycle": p.cycle,
+                "run": p.run,
+                "pc": p.pc.to01(),
+                "ir": p.ir.to01(),
+                "nzp": p.nzp.to01(),
+                "registers": [register.to01() for register in p.register_file],
+                "data": p.data_memory.tobytes(),
+                "text": p.text_memory.tobytes(),
+        }
+        if hasattr(p, "controls"):
+                state["controls"] = dict(p.controls)
+        else:
+                state.update(shared_memory=p.shared_memory, decode_cache=p.decode_cache, jit=p.jit)
+        return state
+
+def _load(backend, image, data=b"", **options):
+        p = create_processor(backend, **options)
+        p.load_text(image)
+        p.load_data(data)
+        return p
+
+def _bench_images():
+        with read_data_image(DEFAULT_DATA_IMAGE) as image:
+                data = bytes(image.data)
+        for path in [os.path.join(ROOT, "ref", "test.asm")] + sorted(glob.glob(os.path.join(ROOT, "ref", "bench", "*.asm"))):
+                with open(path) as file:
+                        yield os.path.basename(path), pack_binary(assemble(file.read(), translation_file=None)), data
+
+class snapshot_test(unittest.TestCase):
+        def assert_round_trip(self, p, run_to, backend="int", **options):
+                '''Snapshots p, created with options, and checks the restored processor is identical and
+                runs on identically.'''
+                blob = dump_state(p)
+                restored = load_state(blob)
+                self.assertEqual(_state(restored), _state(p))
+                self.assertEqual(dump_state(restored), blob)
+
+                # Restoring into an existing processor of the same configuration gives the same
+                into = create_processor(backend, **options)
+                self.assertIs(load_state(blob, into), into)
+                self.assertEqual(dump_state(into), blob)
+
+                ends = []
+                for proc in (p, restored, into):
+                        try:
+                                proc.start(max_cycles=run_to)
+                        except ZeroDivisionError:
+                                pass
+                        ends.append(_state(proc))
+                self.assertEqual(ends[1], ends[0])
+                self.assertEqual(ends[2], ends[0])
+
+        def test_bench_programs(self):
+                for name, image, data in _bench_images():
+                        for options in FAST_OPTIONS:
+                                with self.subTest(program=name, **options):
+                                        p = _load("int", image, data, **options)
+                                        p.start(max_cycles=40)
+                                        self.assert_round_trip(p, 2_000, **options)
+
+        def test_bitarray_processor(self):
+                name, image, data = next(_bench_images())
+                p = _load("bitarray", image, data)
+                p.start(max_cycles=40)
+                self.assert_round_trip(p, 2_000, "bitarray")
+
+                # A stopped machine round-trips too
+                self.assertFalse(p.run)
+                self.assertEqual(_state(load_state(dump_state(p))), _state(p))
+
+        def test_random_programs(self):
+                rng = random.Random(22)
+                for _ in range(100):
+                        image = _random_program(rng, rng.randrange(1, 60))
+                        data = rng.randbytes(0x400)
+                        options = rng.choice(FAST_OPTIONS)
+                        with self.subTest(image=image.hex(), **options):
+                                p = _load("int", image, data, **options)
+                                try:
+                                        p.start(max_cycles=rng.randrange(100))
+                                except ZeroDivisionError:
+                                        pass
+                                self.assert_round_trip(p, 300, **options)
+
+        def test_mismatched_processor(self):
+                blob = dump_state(create_processor("int", memory_size=0x400))
+                for into in (create_processor("int"), create_processor("int", memory_size=0x400, shared_memory=True), create_processor("bitarray", memory_size=0x400)):
+                        with self.assertRaises(ValueError):
+                                load_state(blob, into)
+                for corrupt in (b"", b"XXXX" + blob[4:], blob[:-1]):
+                        with self.assertRaises(ValueError):
+                                load_state(corrupt)
+
+class fork_test(unittest.TestCase):
+        def test_forks_are_isolated(self):
+                # Each fork stores a different value over the same words, which the parent wrote
+                # before forking so their pages are shared
+                program = "\n".join([
+                        "ldi $r1 0", "ldi $r2 7", "str $r1 $r2",
+                        "ldi $r1 1", "sl $r1 10", "str $r1 $r2",
+                        "ldi $r1 3", "sl $r1 14", "str $r1 $r2",
+                        "hlt",
+                        "add: addr $r2 $r2 $r3", "ldi $r1 0", "str $r1 $r2", "ldi $r1 1", "sl $r1 10", "str $r1 $r2", "ldi $r1 3", "sl $r1 14", "str $r1 $r2", "hlt",
+                ])
+                image = pack_binary(assemble(program, translation_file=None))
+                for options in ({"memory_size": 0x10000}, {"memory_size": 0x10000, "shared_memory": True}, {"memory_size": 0x10000, "jit": True}, {}):
+                        with self.subTest(**options):
+                                parent = create_processor("int", **options)
+                                parent.load_text(image)
+                                parent.start()
+                                before = _state(parent)
+
+                                forks = [parent.fork() for _ in range(3)]
+                                for value, fork in enumerate(forks):
+                                        fork._regs[3] = value + 1
+                                        fork.pc = 20
+                                        fork.run = True
+                                        fork.start()
+
+                                self.assertEqual(_state(parent), before)
+                                for value, fork in enumerate(forks):
+                                        words = [fork._data[address] << 8 | fork._data[address + 1] for address in (0, 0x400, 0xC000) if address < len(fork._data)]
+                                        self.assertEqual(words, [8 + value] * len(words))
+                                        self.assertEqual(fork._regs[2], 8 + value)
+
+                                # Writes to the parent after forking do not reach the forks either
+                                parent.store16(0, 0x1234)
+                                for value, fork in enumerate(forks):
+                                        self.assertEqual(fork._data[0] << 8 | fork._data[1], 8 + value)
+
+        def test_forks_run_like_the_parent(self):
+                for name, image, data in _bench_images():
+                        with self.subTest(program=name):
+                                parent = _load("int", image, data, memory_size=0x10000, jit=True)
+                                parent.start(max_cycles=100)
+                                fork = parent.fork()
+                                expected = load_state(dump_state(parent))
+                                for proc in (parent, fork, expected):
+                                        proc.start(max_cycles=1_000_000)
+                                self.assertEqual(_state(fork), _state(expected))
+                                self.assertEqual(_state(parent), _state(expected))
+
+if __name__ == "__main__":
+        unittest.main()